@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Archive Writer - Zip archives with per-payload compression policies
+Part of the Pewpi Login / Infinity Research Portal
+
+Every cart used to write its zips with ZIP_DEFLATED at the default level,
+whatever the member: nested micro zips and other already-compressed
+payloads were deflated a second time for nothing. ArchiveWriter is a
+drop-in zipfile.ZipFile that picks the compression of each member from
+its kind instead:
+
+    archive   nested .zip/.gz/images (by name or magic bytes)  stored
+    html      .html/.htm                                       deflate-6
+    json      .json                                            deflate-6
+    text      .txt/.md/.csv/.hash and anything else            deflate-6
+
+Members under MIN_COMPRESS_SIZE bytes are always stored.
+
+A policy is "stored", "deflate-N" (N = 0..9), "bzip2", "lzma" or, on
+Pythons whose zipfile has it, "zstd". Override kinds with ZIP_POLICY, e.g.
+ZIP_POLICY="html=deflate-9,json=lzma". Readers need nothing special: all
+of these are standard zip methods.
+
+    python archive_writer.py [--policies stored,deflate-1,...] [PATH...]
+
+benchmarks every policy on the members of the archives under PATH
+(default zipcoins/), reporting MB/s and ratio for each payload kind.
+"""
+
+import io
+import os
+import sys
+import time
+import gzip
+import argparse
+import zipfile
+
+# ------------------------------ CONFIG ------------------------------
+DEFAULT_POLICY = {
+    "archive": "stored",
+    "html": "deflate-6",
+    "json": "deflate-6",
+    "text": "deflate-6",
+}
+
+# Members smaller than this are stored: deflating a few hundred bytes saves a
+# few dozen and doubles the cost of writing them
+MIN_COMPRESS_SIZE = 256
+
+ARCHIVE_SUFFIXES = (".zip", ".gz", ".tgz", ".bz2", ".xz", ".zst", ".7z",
+                    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".mp3", ".mp4")
+ARCHIVE_MAGIC = (b"PK\x03\x04", b"\x1f\x8b", b"BZh", b"\xfd7zXZ", b"(\xb5/\xfd",
+                 b"\x89PNG", b"\xff\xd8\xff", b"GIF8")
+HTML_SUFFIXES = (".html", ".htm")
+JSON_SUFFIXES = (".json",)
+
+METHODS = {
+    "stored": zipfile.ZIP_STORED,
+    "deflate": zipfile.ZIP_DEFLATED,
+    "bzip2": zipfile.ZIP_BZIP2,
+    "lzma": zipfile.ZIP_LZMA,
+}
+# zstd members need Python 3.14+ to write (and to read back with zipfile)
+if hasattr(zipfile, "ZIP_ZSTANDARD"):
+    METHODS["zstd"] = zipfile.ZIP_ZSTANDARD
+
+
+def parse_policy(spec):
+    """'deflate-9' -> (compress_type, compresslevel)."""
+    method, _, level = spec.strip().lower().partition("-")
+    if method not in METHODS:
+        raise ValueError(f"Unknown compression policy: {spec!r} (have {', '.join(METHODS)})")
+    if method == "stored":
+        return METHODS[method], None
+    return METHODS[method], int(level) if level else None
+
+
+def load_policy(env=None):
+    """DEFAULT_POLICY with ZIP_POLICY overrides applied; values are parsed."""
+    policy = dict(DEFAULT_POLICY)
+    env = os.getenv("ZIP_POLICY", "") if env is None else env
+    for item in env.split(","):
+        if "=" in item:
+            kind, spec = item.split("=", 1)
+            policy[kind.strip()] = spec.strip()
+    return {kind: parse_policy(spec) for kind, spec in policy.items()}
+
+
+POLICY = load_policy()
+
+
+def payload_kind(name, head=b""):
+    """Kind of a member from its name and, if given, its first bytes."""
+    lower = name.lower()
+    if lower.endswith(ARCHIVE_SUFFIXES) or head.startswith(ARCHIVE_MAGIC):
+        return "archive"
+    if lower.endswith(HTML_SUFFIXES):
+        return "html"
+    if lower.endswith(JSON_SUFFIXES):
+        return "json"
+    return "text"
+
+
+def policy_for(name, data=b"", policy=None):
+    """(compress_type, compresslevel) for member ``name`` holding ``data``."""
+    policy = POLICY if policy is None else policy
+    if data is not None and 0 < len(data) < MIN_COMPRESS_SIZE:
+        return zipfile.ZIP_STORED, None
+    kind = payload_kind(name, data[:8] if data else b"")
+    return policy.get(kind) or policy["text"]
+
+
+class ArchiveWriter(zipfile.ZipFile):
+    """ZipFile whose members are compressed according to a policy."""
+
+    def __init__(self, file, mode="w", policy=None, **kwargs):
+        """
+        Args:
+            file: Path or file object, as for zipfile.ZipFile
+            mode: "w", "x" or "a"
+            policy: {kind: (compress_type, compresslevel)}, default POLICY;
+                parse specs with load_policy or parse_policy
+        """
+        self.policy = POLICY if policy is None else policy
+        super().__init__(file, mode, zipfile.ZIP_DEFLATED, **kwargs)
+
+    def writestr(self, zinfo_or_arcname, data, compress_type=None, compresslevel=None):
+        if compress_type is None and not isinstance(zinfo_or_arcname, zipfile.ZipInfo):
+            raw = data.encode("utf-8") if isinstance(data, str) else data
+            compress_type, level = policy_for(zinfo_or_arcname, raw, self.policy)
+            if compresslevel is None:
+                compresslevel = level
+        super().writestr(zinfo_or_arcname, data, compress_type, compresslevel)
+
+    def write(self, filename, arcname=None, compress_type=None, compresslevel=None):
+        if compress_type is None and not os.path.isdir(filename):
+            with open(filename, "rb") as f:
+                head = f.read(MIN_COMPRESS_SIZE)
+            compress_type, level = policy_for(arcname or filename, head, self.policy)
+            if compresslevel is None:
+                compresslevel = level
+        super().write(filename, arcname, compress_type, compresslevel)
+
+    def open(self, name, mode="r", pwd=None, *, force_zip64=False):
+        if mode == "w" and isinstance(name, str):
+            # Streamed members are only known by name
+            zinfo = zipfile.ZipInfo(name, date_time=time.localtime(time.time())[:6])
+            zinfo.compress_type, level = policy_for(name, None, self.policy)
+            zinfo._compresslevel = level
+            name = zinfo
+        return super().open(name, mode, pwd, force_zip64=force_zip64)
+
+
+# ------------------------------ BENCHMARK ------------------------------
+def iter_payloads(paths):
+    """Yield (name, data) for every member of the .zip/.gz archives under ``paths``."""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    yield from _archive_payloads(os.path.join(root, name))
+        else:
+            yield from _archive_payloads(path)
+
+
+def _archive_payloads(path):
+    try:
+        if path.endswith(".gz"):
+            with gzip.open(path, "rb") as f:
+                yield os.path.basename(path)[:-3], f.read()
+        elif path.endswith(".zip"):
+            with zipfile.ZipFile(path) as zf:
+                yield from _zip_payloads(zf)
+    except (OSError, zipfile.BadZipFile, EOFError):
+        return
+
+
+def _zip_payloads(zf):
+    for info in zf.infolist():
+        if info.is_dir():
+            continue
+        data = zf.read(info)
+        yield info.filename, data
+        # What nested archives hold is benchmarked as well
+        if data.startswith(b"PK\x03\x04"):
+            try:
+                with zipfile.ZipFile(io.BytesIO(data)) as nested:
+                    yield from _zip_payloads(nested)
+            except zipfile.BadZipFile:
+                pass
+
+
+def benchmark(payloads, specs):
+    """
+    Compress every payload under every policy spec.
+
+    Returns:
+        {kind: {spec: (files, bytes_in, bytes_out, seconds)}}; bytes_out is
+        the compressed size of the members as written into a zip
+    """
+    by_kind = {}
+    for name, data in payloads:
+        by_kind.setdefault(payload_kind(name, data[:8]), []).append((name, data))
+
+    results = {}
+    for kind, members in sorted(by_kind.items()):
+        size = sum(len(data) for _, data in members)
+        results[kind] = {}
+        for spec in specs:
+            compress_type, level = parse_policy(spec)
+            buf = io.BytesIO()
+            start = time.perf_counter()
+            with zipfile.ZipFile(buf, "w") as zf:
+                for n, (name, data) in enumerate(members):
+                    zf.writestr(f"{n}/{name}", data, compress_type, level)
+            elapsed = time.perf_counter() - start
+            with zipfile.ZipFile(buf) as zf:
+                packed = sum(info.compress_size for info in zf.infolist())
+            results[kind][spec] = (len(members), size, packed, elapsed)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark zip compression policies per payload kind")
+    parser.add_argument("paths", nargs="*", default=["zipcoins"], help="archives or directories")
+    default_specs = ["stored", "deflate-1", "deflate-6", "deflate-9", "bzip2", "lzma"]
+    if "zstd" in METHODS:
+        default_specs.append("zstd")
+    parser.add_argument("--policies", default=",".join(default_specs),
+                        help="comma separated policy specs to compare")
+    args = parser.parse_args(argv)
+
+    results = benchmark(iter_payloads(args.paths), args.policies.split(","))
+    if not results:
+        print("No .zip or .gz archives found")
+        return 1
+
+    current = {kind: DEFAULT_POLICY.get(kind) for kind in results}
+    print(f"{'kind':<8} {'policy':<10} {'files':>6} {'MB in':>8} {'ratio':>6} {'MB/s':>8}")
+    for kind, rows in results.items():
+        for spec, (files, size, packed, elapsed) in rows.items():
+            mark = " *" if spec == current[kind] else ""
+            ratio = packed / size if size else 1.0
+            speed = size / 1e6 / elapsed if elapsed else float("inf")
+            print(f"{kind:<8} {spec:<10} {files:>6} {size / 1e6:>8.2f} {ratio:>6.3f} {speed:>8.1f}{mark}")
+    print("* = current policy (ratio = compressed / original)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,18 +5,24 @@ Handles OAuth flow, session management, and user tracking
 """
 
 import os
-import json
 import hashlib
 import secrets
 import datetime
 from datetime import timezone
 from functools import wraps
 
-from flask import Flask, request, redirect, jsonify, session, url_for, send_from_directory
+from flask import Flask, request, redirect, jsonify, session, url_for, send_file, abort, Response
 from flask_cors import CORS
 import requests
 from dotenv import load_dotenv
 
+from user_store import UserStore
+from commit_log import CommitLog
+import magic_link_store
+from token_jobs import TokenJobs
+from shared_state import SharedState
+from static_variants import StaticFile
+
 # Load environment variables
 load_dotenv()
 
@@ -33,13 +39,29 @@ GITHUB_REDIRECT_URI = os.getenv('GITHUB_REDIRECT_URI', 'http://localhost:5000/au
 # File paths
 Z_ROOT = os.path.abspath(os.path.dirname(__file__))
 USERS_FILE = os.path.join(Z_ROOT, "users.json")
+LOGIN_COMMITS_DIR = os.path.join(Z_ROOT, "login_commits")
+# Pre-log commits, imported into LOGIN_COMMITS_DIR once
 LOGIN_COMMITS_FILE = os.path.join(Z_ROOT, "login_commits.json")
 
-# Rate limiting storage (simple in-memory for now)
-rate_limit_store = {}
+# Largest number of texts accepted by /api/token/build-batch
+MAX_BATCH_TOKENS = int(os.getenv('MAX_BATCH_TOKENS', 1000))
+
+# Largest file accepted by /api/token/upload, and largest request body of any
+# kind; bigger requests get 413
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_BYTES', 10 * 1024 * 1024))
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH', 64 * 1024 * 1024))
+
+# Background token builds ("async": true or Prefer: respond-async)
+TOKEN_JOB_WORKERS = int(os.getenv('TOKEN_JOB_WORKERS', os.cpu_count() or 1))
+TOKEN_JOB_QUEUE = int(os.getenv('TOKEN_JOB_QUEUE', 64))
 
-# Magic link tokens storage (in-memory for now, use Redis in production)
-magic_link_tokens = {}
+# Requests per minute allowed per client IP on the login endpoints
+RATE_LIMIT_PER_MINUTE = int(os.getenv('RATE_LIMIT_PER_MINUTE', 10))
+
+# Rate limits, magic links and job results: "memory" (this process only) or
+# "sqlite" (STATE_DB, shared by every worker process; see shared_state.py)
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'memory')
+STATE_DB = os.getenv('STATE_DB', os.path.join(Z_ROOT, "portal_state.db"))
 
 # ------------------------------ UTILITIES ------------------------------
 
@@ -48,49 +70,70 @@ def get_timestamp():
     return datetime.datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
 
 
+_state = None
+
+
+def get_state():
+    """Process-wide SharedState for STATE_BACKEND (see shared_state.py)."""
+    global _state
+    if _state is None or (_state.backend, _state.path) != (STATE_BACKEND, STATE_DB):
+        _state = SharedState(STATE_BACKEND, STATE_DB)
+    return _state
+
+
+_user_store = None
+
+
+def get_user_store():
+    """Process-wide in-memory view of USERS_FILE (see user_store.py)."""
+    global _user_store
+    if _user_store is None or _user_store.path != USERS_FILE:
+        # With a multi-process backend other workers write users.json too
+        _user_store = UserStore(USERS_FILE, shared=get_state().multi_process)
+    return _user_store
+
+
 def load_users():
-    """Load users data from JSON file."""
-    if os.path.exists(USERS_FILE):
-        with open(USERS_FILE, "r") as f:
-            return json.load(f)
-    return {"users": {}, "sessions": {}}
+    """Return a copy of the users data."""
+    return get_user_store().export()
 
 
 def save_users(data):
-    """Save users data to JSON file."""
-    with open(USERS_FILE, "w") as f:
-        json.dump(data, f, indent=4)
+    """Replace the users data and write it to USERS_FILE."""
+    get_user_store().replace_all(data)
 
 
-def load_login_commits():
-    """Load login commits from JSON file."""
-    if os.path.exists(LOGIN_COMMITS_FILE):
-        with open(LOGIN_COMMITS_FILE, "r") as f:
-            return json.load(f)
-    return {"commits": [], "metadata": {"created_at": get_timestamp()}}
+_commit_log = None
 
 
-def save_login_commits(data):
-    """Save login commits to JSON file."""
-    with open(LOGIN_COMMITS_FILE, "w") as f:
-        json.dump(data, f, indent=4)
+def get_commit_log():
+    """Process-wide login commit log in LOGIN_COMMITS_DIR (see commit_log.py)."""
+    global _commit_log
+    if _commit_log is None or _commit_log.root != LOGIN_COMMITS_DIR:
+        _commit_log = CommitLog(LOGIN_COMMITS_DIR, legacy_path=LOGIN_COMMITS_FILE)
+    return _commit_log
 
 
-def add_login_commit(username, action, ip_address=None):
-    """Track a login commit."""
-    commits = load_login_commits()
-    
+def load_login_commits():
+    """Return every live login commit in the old login_commits.json shape."""
+    return {
+        "commits": list(get_commit_log().iter_commits()),
+        "metadata": {"created_at": get_timestamp()}
+    }
+
+
+def add_login_commit(username, action, ip_address=None, session_id=None):
+    """Track a login commit (pass ip_address and session_ref() as session_id outside a request)."""
     commit = {
         "username": username,
         "timestamp": get_timestamp(),
         "action": action,
         "ip": ip_address or request.remote_addr,
-        "session_id": session.get('session_token', 'unknown')
+        # The log is kept on disk: a hash of the session token, never the token
+        "session_id": session_id or session_ref(session.get('session_token'))
     }
     
-    commits["commits"].append(commit)
-    save_login_commits(commits)
-    return commit
+    return get_commit_log().append(commit)
 
 
 def generate_session_token():
@@ -98,23 +141,103 @@ def generate_session_token():
     return secrets.token_hex(32)
 
 
-def check_rate_limit(identifier, limit_per_minute=10):
-    """Simple rate limiting check."""
-    now = datetime.datetime.now()
-    minute_key = now.strftime('%Y-%m-%d %H:%M')
-    key = f"{identifier}:{minute_key}"
-    
-    count = rate_limit_store.get(key, 0)
-    if count >= limit_per_minute:
-        return False
-    
-    rate_limit_store[key] = count + 1
-    
-    # Clean old entries (simple approach)
-    if len(rate_limit_store) > 1000:
-        rate_limit_store.clear()
+def session_ref(session_token):
+    """Stable reference to a session that does not reveal its token."""
+    if not session_token:
+        return 'unknown'
+    return hashlib.sha256(session_token.encode('utf-8')).hexdigest()
+
+
+def check_rate_limit(identifier, limit_per_minute=None, scope='ip'):
+    """Count a request by ``identifier``; False once it has used up its per-minute token bucket."""
+    limit = limit_per_minute or RATE_LIMIT_PER_MINUTE
+    return get_state().rate_limiter.allow(f"{scope}:{identifier}", limit, 60.0)
+
+
+def record_user_token(username, token):
+    """Add a built token to the user's record and return their token count."""
+    return record_user_tokens(username, [token])
+
+
+def record_user_tokens(username, tokens):
+    """Add built tokens to the user's record in one update; returns their token count."""
+    created_at = get_timestamp()
+    return get_user_store().add_user_tokens(username, [
+        {
+            "hash": token["hash"],
+            "value": token.get("value", 0),
+            "created_at": created_at
+        }
+        for token in tokens
+    ])
+
+
+def token_summary(token):
+    """Public fields of a token returned by the build endpoints."""
+    return {
+        "hash": token["hash"],
+        "value": token.get("value", 0),
+        "value_formatted": token.get("value_formatted", ""),
+        "score": token.get("score", 0),
+        "timestamp": token.get("timestamp", "")
+    }
+
+
+_token_jobs = None
+
+
+def get_token_jobs():
+    """Process-wide background token builder (see token_jobs.py)."""
+    global _token_jobs
+    if _token_jobs is None:
+        _token_jobs = TokenJobs(TOKEN_JOB_WORKERS, TOKEN_JOB_QUEUE, on_done=finish_token_job,
+                                registry=get_state().job_registry)
+    return _token_jobs
+
+
+def wants_async(data):
+    """True if the client asked for a build job instead of waiting for the token."""
+    return bool(data.get('async')) or 'respond-async' in request.headers.get('Prefer', '')
+
+
+def finish_token_job(job, tokens):
+    """Credit a finished build job to its owner; returns the job's result."""
+    context = job["context"]
+    token_count = record_user_tokens(job["owner"], tokens)
+    add_login_commit(job["owner"], context["action"], context["ip"], context["session_id"])
+    if context.get("single"):
+        return {"token": token_summary(tokens[0]), "token_count": token_count}
+    return {"tokens": [token_summary(t) for t in tokens], "token_count": token_count}
+
+
+def queue_token_job(username, texts, source_type, filenames, action, single=False):
+    """Queue a build and answer 202 with where to poll for it (503 if the queue is full)."""
+    job = get_token_jobs().submit(username, texts, source_type, filenames, context={
+        "action": action,
+        "single": single,
+        "ip": request.remote_addr,
+        # Persisted with STATE_BACKEND=sqlite, so the same hash the commit log records
+        "session_id": session_ref(session.get('session_token'))
+    })
+    if job is None:
+        response = jsonify({
+            "success": False,
+            "error": "Token build queue is full. Please try again shortly."
+        })
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
     
-    return True
+    status_url = url_for('token_job_status', job_id=job["id"])
+    response = jsonify({
+        "success": True,
+        "job_id": job["id"],
+        "status": job["status"],
+        "status_url": status_url
+    })
+    response.status_code = 202
+    response.headers['Location'] = status_url
+    return response
 
 
 # ------------------------------ DECORATORS ------------------------------
@@ -129,8 +252,7 @@ def require_auth(f):
             return jsonify({"success": False, "error": "Not authenticated"}), 401
         
         # Verify session exists
-        users_data = load_users()
-        if session_token not in users_data.get("sessions", {}):
+        if get_user_store().get_session(session_token) is None:
             session.clear()
             return jsonify({"success": False, "error": "Invalid session"}), 401
         
@@ -139,6 +261,29 @@ def require_auth(f):
     return decorated_function
 
 
+@app.errorhandler(413)
+def request_too_large(e):
+    """Answer over-limit bodies (MAX_CONTENT_LENGTH, MAX_UPLOAD_BYTES) in the API's JSON shape."""
+    return jsonify({
+        "success": False,
+        "error": "Request is too large"
+    }), 413
+
+
+class UploadTooLarge(Exception):
+    """Raised while streaming an upload once it passes MAX_UPLOAD_BYTES."""
+
+
+def read_limited(stream, limit, chunk_size=1 << 20):
+    """Yield ``stream`` in chunks, raising UploadTooLarge once more than ``limit`` bytes were read."""
+    total = 0
+    for chunk in iter(lambda: stream.read(chunk_size), b""):
+        total += len(chunk)
+        if total > limit:
+            raise UploadTooLarge()
+        yield chunk
+
+
 # ------------------------------ OAUTH ENDPOINTS ------------------------------
 
 @app.route('/auth/github', methods=['GET'])
@@ -237,11 +382,11 @@ def github_oauth_callback():
             }), 400
         
         # Create or update user in our system
-        users_data = load_users()
+        users = get_user_store()
         
-        if github_username not in users_data["users"]:
+        if not users.has_user(github_username):
             # New user - create account
-            users_data["users"][github_username] = {
+            users.put_user(github_username, {
                 "github_id": github_id,
                 "github_username": github_username,
                 "token_count": 0,
@@ -250,19 +395,18 @@ def github_oauth_callback():
                 "created_at": get_timestamp(),
                 "last_login": None,
                 "oauth_provider": "github"
-            }
+            })
         
         # Create session
         session_token = generate_session_token()
-        users_data["sessions"][session_token] = {
+        users.put_session(session_token, {
             "username": github_username,
             "created_at": get_timestamp(),
             "github_access_token": access_token  # Store for API calls
-        }
+        })
         
         # Update last login
-        users_data["users"][github_username]["last_login"] = get_timestamp()
-        save_users(users_data)
+        users.patch_user(github_username, last_login=get_timestamp())
         
         # Store session token in Flask session
         session['session_token'] = session_token
@@ -293,9 +437,10 @@ def auth_status():
             "error": "Not authenticated"
         }), 401
     
-    users_data = load_users()
+    users = get_user_store()
+    session_data = users.get_session(session_token)
     
-    if session_token not in users_data.get("sessions", {}):
+    if session_data is None:
         session.clear()
         return jsonify({
             "success": False,
@@ -303,9 +448,8 @@ def auth_status():
             "error": "Invalid session"
         }), 401
     
-    session_data = users_data["sessions"][session_token]
     username = session_data["username"]
-    user = users_data["users"].get(username)
+    user = users.get_user(username)
     
     if not user:
         return jsonify({
@@ -335,11 +479,7 @@ def logout():
     username = session.get('username')
     
     if session_token:
-        users_data = load_users()
-        
-        if session_token in users_data.get("sessions", {}):
-            del users_data["sessions"][session_token]
-            save_users(users_data)
+        get_user_store().delete_session(session_token)
         
         # Track logout commit
         if username:
@@ -375,32 +515,16 @@ def send_magic_link():
             "error": "Invalid email format"
         }), 400
     
-    # Check rate limit
-    if not check_rate_limit(email, limit_per_minute=5):
+    # Check rate limit: per client, and per address so one inbox is not flooded
+    if not check_rate_limit(request.remote_addr) or \
+            not check_rate_limit(email, limit_per_minute=5, scope='email'):
         return jsonify({
             "success": False,
             "error": "Too many requests. Please try again later."
         }), 429
     
-    # Generate magic link token
-    token = secrets.token_urlsafe(32)
-    expiry = datetime.datetime.now(timezone.utc) + datetime.timedelta(minutes=15)
-    
-    # Store token with email and expiry
-    magic_link_tokens[token] = {
-        "email": email,
-        "expiry": expiry.isoformat(),
-        "used": False
-    }
-    
-    # Clean expired tokens
-    now = datetime.datetime.now(timezone.utc)
-    expired_tokens = [
-        t for t, data in magic_link_tokens.items()
-        if datetime.datetime.fromisoformat(data['expiry']) < now
-    ]
-    for t in expired_tokens:
-        del magic_link_tokens[t]
+    # Generate magic link token (expired ones are dropped as links are issued)
+    token, _ = get_state().magic_links.issue(email)
     
     # In dev mode, return the token directly
     dev_mode = os.getenv('DEV_MODE', 'true').lower() == 'true'
@@ -439,43 +563,28 @@ def verify_magic_link():
             "error": "Token is required"
         }), 400
     
-    # Check if token exists and is valid
-    if token not in magic_link_tokens:
+    # Use up the token: it is removed whatever the outcome
+    status, email = get_state().magic_links.consume(token)
+    if status == magic_link_store.INVALID:
         return jsonify({
             "success": False,
             "error": "Invalid or expired token"
         }), 400
     
-    token_data = magic_link_tokens[token]
-    
-    # Check if token has been used
-    if token_data['used']:
-        return jsonify({
-            "success": False,
-            "error": "Token has already been used"
-        }), 400
-    
-    # Check if token has expired
-    expiry = datetime.datetime.fromisoformat(token_data['expiry'])
-    if datetime.datetime.now(timezone.utc) > expiry:
-        del magic_link_tokens[token]
+    if status == magic_link_store.EXPIRED:
         return jsonify({
             "success": False,
             "error": "Token has expired"
         }), 400
     
-    # Mark token as used
-    token_data['used'] = True
-    
-    email = token_data['email']
     username = email.split('@')[0]  # Use email prefix as username
     
     # Load or create user
-    users_data = load_users()
+    users = get_user_store()
     
-    if username not in users_data["users"]:
+    if not users.has_user(username):
         # Create new user
-        users_data["users"][username] = {
+        users.put_user(username, {
             "email": email,
             "username": username,
             "token_count": 0,
@@ -484,21 +593,19 @@ def verify_magic_link():
             "created_at": get_timestamp(),
             "last_login": get_timestamp(),
             "oauth_provider": "magic_link"
-        }
+        })
     else:
         # Update existing user
-        users_data["users"][username]["last_login"] = get_timestamp()
+        users.patch_user(username, last_login=get_timestamp())
     
     # Create session
     session_token = generate_session_token()
-    users_data["sessions"][session_token] = {
+    users.put_session(session_token, {
         "username": username,
         "created_at": get_timestamp(),
         "email": email,
         "provider": "magic_link"
-    }
-    
-    save_users(users_data)
+    })
     
     # Set session cookies
     session['session_token'] = session_token
@@ -509,7 +616,7 @@ def verify_magic_link():
     add_login_commit(username, "magic_link_login", request.remote_addr)
     
     # Return success with user info
-    user = users_data["users"][username]
+    user = users.get_user(username)
     
     response_data = {
         "success": True,
@@ -537,19 +644,11 @@ def verify_magic_link():
 def get_user_commits():
     """Get user's login commit history."""
     username = session.get('username')
-    commits_data = load_login_commits()
-    
-    user_commits = [
-        c for c in commits_data.get("commits", [])
-        if c.get("username") == username
-    ]
-    
-    # Sort by timestamp, most recent first
-    user_commits.sort(key=lambda c: c.get("timestamp", ""), reverse=True)
+    user_commits = get_commit_log().latest(username, limit=50)
     
     return jsonify({
         "success": True,
-        "commits": user_commits[:50]  # Return last 50 commits
+        "commits": user_commits  # Most recent first
     })
 
 
@@ -570,32 +669,25 @@ def update_user_tokens():
             "error": "token_hash is required"
         }), 400
     
-    users_data = load_users()
+    # Add token to user's record and increment token count
+    token_count = get_user_store().add_user_tokens(username, [{
+        "hash": token_hash,
+        "value": token_value,
+        "created_at": get_timestamp()
+    }])
     
-    if username not in users_data["users"]:
+    if not token_count:
         return jsonify({
             "success": False,
             "error": "User not found"
         }), 404
     
-    # Add token to user's record
-    users_data["users"][username]["tokens_created"].append({
-        "hash": token_hash,
-        "value": token_value,
-        "created_at": get_timestamp()
-    })
-    
-    # Increment token count
-    users_data["users"][username]["token_count"] += 1
-    
-    save_users(users_data)
-    
     # Track action commit
     add_login_commit(username, action)
     
     return jsonify({
         "success": True,
-        "token_count": users_data["users"][username]["token_count"],
+        "token_count": token_count,
         "message": "Token count updated successfully"
     })
 
@@ -627,6 +719,9 @@ def build_token_api():
     if filename:
         filename = os.path.basename(str(filename))
     
+    if wants_async(data):
+        return queue_token_job(username, [text], source_type, [filename], "token_build", single=True)
+    
     try:
         # Import and use build_token function
         from build_token import build_token
@@ -634,34 +729,19 @@ def build_token_api():
         token = build_token(
             text=text,
             source_type=source_type,
-            filename=filename,
-            username=username
+            filename=filename
         )
         
         # Update user's token count
-        users_data = load_users()
-        if username in users_data["users"]:
-            users_data["users"][username]["tokens_created"].append({
-                "hash": token["hash"],
-                "value": token.get("value", 0),
-                "created_at": get_timestamp()
-            })
-            users_data["users"][username]["token_count"] += 1
-            save_users(users_data)
+        token_count = record_user_token(username, token)
         
         # Track token build commit
         add_login_commit(username, "token_build")
         
         return jsonify({
             "success": True,
-            "token": {
-                "hash": token["hash"],
-                "value": token.get("value", 0),
-                "value_formatted": token.get("value_formatted", ""),
-                "score": token.get("score", 0),
-                "timestamp": token.get("timestamp", "")
-            },
-            "token_count": users_data["users"][username]["token_count"],
+            "token": token_summary(token),
+            "token_count": token_count,
             "message": "Token created successfully"
         })
     
@@ -672,6 +752,159 @@ def build_token_api():
         }), 500
 
 
+@app.route('/api/token/build-batch', methods=['POST'])
+@require_auth
+def build_token_batch_api():
+    """
+    Build a batch of tokens with authentication.
+    Body: {"texts": [...], "source_type": "text", "filenames": [...] (optional)}
+    """
+    username = session.get('username')
+    data = request.get_json() or {}
+    
+    texts = data.get('texts')
+    source_type = data.get('source_type', 'text')
+    filenames = data.get('filenames')
+    
+    if not isinstance(texts, list) or not texts:
+        return jsonify({
+            "success": False,
+            "error": "texts must be a non-empty list"
+        }), 400
+    
+    if len(texts) > MAX_BATCH_TOKENS:
+        return jsonify({
+            "success": False,
+            "error": f"Batch too large (max {MAX_BATCH_TOKENS} texts)"
+        }), 400
+    
+    if filenames is not None and (not isinstance(filenames, list) or len(filenames) != len(texts)):
+        return jsonify({
+            "success": False,
+            "error": "filenames must be a list the same length as texts"
+        }), 400
+    
+    # Sanitize inputs
+    texts = [str(t)[:1_000_000] for t in texts]  # Limit to 1MB each
+    if any(not t.strip() for t in texts):
+        return jsonify({
+            "success": False,
+            "error": "Text content is required for every item"
+        }), 400
+    if filenames is not None:
+        filenames = [os.path.basename(str(f)) if f else None for f in filenames]
+    
+    if wants_async(data):
+        return queue_token_job(username, texts, source_type, filenames, "token_build_batch")
+    
+    try:
+        from build_token import build_tokens
+        
+        tokens = build_tokens(texts, source_type=source_type, filenames=filenames)
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "error": f"Token creation failed: {str(e)}"
+        }), 500
+    
+    token_count = record_user_tokens(username, tokens)
+    add_login_commit(username, "token_build_batch")
+    
+    return jsonify({
+        "success": True,
+        "tokens": [token_summary(t) for t in tokens],
+        "token_count": token_count,
+        "message": f"{len(tokens)} tokens created successfully"
+    })
+
+
+@app.route('/api/token/upload', methods=['POST'])
+@require_auth
+def upload_token_api():
+    """
+    Build a token from an uploaded file (multipart field "file").
+    The upload is streamed through the scorer instead of being read into memory.
+    """
+    username = session.get('username')
+    
+    # Refuse before the multipart body is parsed (and spooled)
+    if request.content_length is not None and request.content_length > MAX_UPLOAD_BYTES + 64 * 1024:
+        abort(413)
+    upload = request.files.get('file')
+    
+    if not upload or not upload.filename:
+        return jsonify({
+            "success": False,
+            "error": "File upload is required"
+        }), 400
+    
+    filename = os.path.basename(str(upload.filename))
+    source_type = request.form.get('source_type', 'file')
+    
+    try:
+        from build_token import build_token_stream
+        
+        token = build_token_stream(
+            read_limited(upload.stream, MAX_UPLOAD_BYTES),
+            source_type=source_type,
+            filename=filename
+        )
+    except UploadTooLarge:
+        abort(413)
+    except UnicodeDecodeError:
+        return jsonify({
+            "success": False,
+            "error": "File must be UTF-8 text"
+        }), 400
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "error": f"Token creation failed: {str(e)}"
+        }), 500
+    
+    token_count = record_user_token(username, token)
+    add_login_commit(username, "token_upload")
+    
+    return jsonify({
+        "success": True,
+        "token": token_summary(token),
+        "token_count": token_count,
+        "message": "Token created successfully"
+    })
+
+
+@app.route('/api/token/jobs/<job_id>', methods=['GET'])
+@require_auth
+def token_job_status(job_id):
+    """
+    Status of a background build. Once done it carries what the build
+    endpoint would have returned: token (or tokens) and token_count.
+    """
+    job = get_token_jobs().get(job_id)
+    if job is None or job["owner"] != session.get('username'):
+        return jsonify({
+            "success": False,
+            "error": "Unknown or expired job"
+        }), 404
+    
+    if job["status"] == "failed":
+        return jsonify({
+            "success": False,
+            "job_id": job_id,
+            "status": "failed",
+            "error": f"Token creation failed: {job['error']}"
+        }), 500
+    
+    response_data = {
+        "success": True,
+        "job_id": job_id,
+        "status": job["status"]
+    }
+    if job["status"] == "done":
+        response_data.update(job["result"])
+    return jsonify(response_data)
+
+
 # ------------------------------ HEALTH CHECK ------------------------------
 
 @app.route('/health', methods=['GET'])
@@ -685,16 +918,47 @@ def health_check():
     })
 
 
+# Portal files, served with their precompressed variants (see static_variants.py)
+STATIC_FILES = {name: StaticFile(os.path.join(Z_ROOT, name))
+                for name in ("index.html", "research_index.json", "category_tokens.json")}
+
+
+def send_static(name):
+    """Respond with a portal file: 304 if the client's copy is current, else the best encoding."""
+    try:
+        status, body, headers = STATIC_FILES[name].negotiate(request.headers.get('If-None-Match'),
+                                                             request.headers.get('Accept-Encoding'))
+    except FileNotFoundError:
+        abort(404)
+    if status == 304:
+        return Response(status=304, headers=headers)
+    mimetype = STATIC_FILES[name].mimetype
+    if isinstance(body, bytes):
+        response = Response(body, mimetype=mimetype)
+    else:
+        response = send_file(body, mimetype=mimetype, conditional=False, etag=False, last_modified=None)
+        # send_file's validators describe the variant file; the ETag is the one to revalidate with
+        response.headers.pop('Last-Modified', None)
+    response.headers.update(headers)
+    return response
+
+
 @app.route('/', methods=['GET'])
 def index_page():
     """Serve the main index page."""
-    return send_from_directory('.', 'index.html')
+    return send_static('index.html')
 
 
 @app.route('/research_index.json', methods=['GET'])
 def research_index():
     """Serve the research index JSON."""
-    return send_from_directory('.', 'research_index.json')
+    return send_static('research_index.json')
+
+
+@app.route('/category_tokens.json', methods=['GET'])
+def category_tokens():
+    """Serve the category token configuration the index page loads."""
+    return send_static('category_tokens.json')
 
 
 # ------------------------------ MONGOOSE OS INTEGRATION ------------------------------
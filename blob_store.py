@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+"""
+Blob Store - Content-addressed storage behind zipcoin, micro and batch archives
+Part of the Pewpi Login / Infinity Research Portal
+
+The scrapers keep packaging the same pages and the same token JSON into new
+archives. Instead of the archive itself, producers now write a manifest next
+to where it would have gone (zipcoins/<id>.zip -> zipcoins/<id>.zip.manifest.json)
+listing its members, and each member's content is stored once:
+
+    blobs/objects/ab/cdef...   zlib-compressed content, named by the SHA-256
+                               of its normalized form (see normalize)
+    blobs/refs.json            {digest: number of manifest entries using it}
+    blobs/refs.log             "+<digest>" / "-<digest>" lines since refs.json
+    blobs/lock                 writers serialise on this with flock
+
+Only objects are synced to git: refs.json and refs.log are this machine's
+counters (see .gitignore), and producers queue just the object files their
+manifest created (ManifestWriter.new_objects).
+
+Manifest entries are {"name", "blob", "size"}, or {"name", "format": "zip",
+"entries": [...]} for an archive nested in an archive (a micro zip inside a
+master), so nested page content is shared too. materialize() rebuilds the
+real archive when one is needed; its members hold the normalized content and
+fresh zip timestamps, so it is equivalent to, not byte-identical with, what
+the producer would have written.
+
+Writing or dropping a manifest appends its references to refs.log. Those
+counts only cover this machine's writers, so gc() first recounts references
+from every manifest on disk, including ones that arrived through git pull,
+and then deletes unreferenced objects older than a grace period. put()
+refreshes an object's mtime, so a writer that stored a blob but has not
+written its manifest yet never loses it. fsck recounts without collecting.
+
+Set ZIPCOIN_BLOBS=0 to have the producers write real archives again.
+"""
+
+import io
+import os
+import sys
+import gzip
+import json
+import time
+import zlib
+import hashlib
+import zipfile
+
+from pending_queue import FileLock
+from archive_writer import ArchiveWriter
+
+# ------------------------------ CONFIG ------------------------------
+Z_ROOT = os.path.abspath(os.path.dirname(__file__))
+BLOB_DIR = os.path.join(Z_ROOT, "blobs")
+
+# Producers write manifests instead of archives unless this is "0"
+BLOBS_ENABLED = os.getenv("ZIPCOIN_BLOBS", "1") != "0"
+
+MANIFEST_SUFFIX = ".manifest.json"
+MANIFEST_VERSION = 1
+
+# Directories fsck/gc look for manifests in
+ARCHIVE_DIRS = [
+    os.path.join(Z_ROOT, "zipcoins"),
+    os.path.join(Z_ROOT, "zipcoins", "micro"),
+    os.path.join(Z_ROOT, "infinity_zips"),
+]
+
+# Unreferenced objects younger than this are kept by gc()
+GC_GRACE = 3600
+
+COMPRESS_LEVEL = 6
+
+
+def normalize(data):
+    """
+    Canonical form blobs are keyed and stored by.
+
+    JSON documents are re-encoded with fixed whitespace (key order kept), and
+    other UTF-8 text gets LF line endings; anything else is left as is.
+    """
+    try:
+        text = data.decode("utf-8")
+    except UnicodeDecodeError:
+        return data
+    if "\x00" in text:
+        return data
+    if text.lstrip()[:1] in ("{", "["):
+        try:
+            return json.dumps(json.loads(text), indent=2, ensure_ascii=False).encode("utf-8")
+        except ValueError:
+            pass
+    return text.replace("\r\n", "\n").encode("utf-8")
+
+
+def manifest_path_for(archive_path):
+    return archive_path + MANIFEST_SUFFIX
+
+
+def entry_digests(entries):
+    """Yield the blob digest of every (nested) manifest entry."""
+    for entry in entries:
+        if "entries" in entry:
+            yield from entry_digests(entry["entries"])
+        else:
+            yield entry["blob"]
+
+
+class BlobStore:
+    """Reference-counted, content-addressed blobs."""
+
+    def __init__(self, root=BLOB_DIR, level=COMPRESS_LEVEL):
+        """
+        Args:
+            root: Store directory
+            level: zlib level objects are compressed with
+        """
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self.refs_path = os.path.join(root, "refs.json")
+        self.refs_log_path = os.path.join(root, "refs.log")
+        self.lock_path = os.path.join(root, "lock")
+        self.level = level
+
+    # ------------------------------ OBJECTS ------------------------------
+    def put(self, data):
+        """Store ``data`` (normalized) if it is new; returns its digest. Does not add a reference."""
+        return self.put_new(data)[0]
+
+    def put_new(self, data):
+        """Like put(); returns (digest, object path if this call created it, else None)."""
+        data = normalize(data)
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object_path(digest)
+        try:
+            os.utime(path)  # keep it out of a concurrent gc
+            return digest, None
+        except FileNotFoundError:
+            pass
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(zlib.compress(data, self.level))
+        os.replace(tmp_path, path)
+        return digest, path
+
+    def get(self, digest):
+        """Return a blob's (normalized) content; raises KeyError if it is missing."""
+        try:
+            with open(self._object_path(digest), "rb") as f:
+                return zlib.decompress(f.read())
+        except FileNotFoundError:
+            raise KeyError(digest) from None
+
+    def __contains__(self, digest):
+        return os.path.exists(self._object_path(digest))
+
+    # ------------------------------ REFERENCES ------------------------------
+    def incref(self, digests):
+        self._adjust(digests, 1)
+
+    def decref(self, digests):
+        self._adjust(digests, -1)
+
+    def refcount(self, digest):
+        return self._load_refs().get(digest, 0)
+
+    def gc(self, grace=GC_GRACE, dirs=None):
+        """
+        Recount references from the manifests under ``dirs`` (default
+        ARCHIVE_DIRS), then delete unreferenced objects older than ``grace``
+        seconds; returns how many.
+        """
+        removed = 0
+        cutoff = time.time() - grace
+        with FileLock(self.lock_path):
+            refs = count_refs(dirs or ARCHIVE_DIRS)
+            self._save_refs(refs)
+            for digest, path in self._iter_objects():
+                if digest in refs:
+                    continue
+                try:
+                    if os.stat(path).st_mtime < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except FileNotFoundError:
+                    continue
+        return removed
+
+    def rebuild_refs(self, dirs=None):
+        """
+        Recount references from the manifests under ``dirs`` (run while no
+        producer is writing); returns the number of manifests.
+        """
+        counted = []
+        refs = count_refs(dirs or ARCHIVE_DIRS, counted)
+        with FileLock(self.lock_path):
+            self._save_refs(refs)
+        return len(counted)
+
+    def stats(self):
+        """Return (objects, bytes on disk, total references)."""
+        objects = size = 0
+        for _, path in self._iter_objects():
+            objects += 1
+            size += os.path.getsize(path)
+        return objects, size, sum(self._load_refs().values())
+
+    # ------------------------------ INTERNALS ------------------------------
+    def _object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest[2:])
+
+    def _iter_objects(self):
+        if not os.path.isdir(self.objects_dir):
+            return
+        for prefix in sorted(os.listdir(self.objects_dir)):
+            sub = os.path.join(self.objects_dir, prefix)
+            for name in os.listdir(sub):
+                if not name.endswith(".tmp"):
+                    yield prefix + name, os.path.join(sub, name)
+
+    def _adjust(self, digests, delta):
+        sign = "+" if delta > 0 else "-"
+        data = "".join(f"{sign}{digest}\n" for digest in digests)
+        if not data:
+            return
+        os.makedirs(self.root, exist_ok=True)
+        with FileLock(self.lock_path):
+            with open(self.refs_log_path, "a") as f:
+                f.write(data)
+
+    def _load_refs(self):
+        """refs.json with refs.log replayed on top."""
+        try:
+            with open(self.refs_path, "r") as f:
+                refs = json.load(f)
+        except (OSError, ValueError):
+            refs = {}
+        try:
+            with open(self.refs_log_path, "r") as f:
+                for line in f:
+                    digest = line[1:].strip()
+                    if not line.endswith("\n") or not digest:
+                        continue  # torn last line
+                    count = refs.get(digest, 0) + (1 if line[0] == "+" else -1)
+                    if count > 0:
+                        refs[digest] = count
+                    else:
+                        refs.pop(digest, None)  # collected by gc()
+        except FileNotFoundError:
+            pass
+        return refs
+
+    def _save_refs(self, refs):
+        """Replace refs.json and empty refs.log; caller holds the lock."""
+        tmp_path = self.refs_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(refs, f, separators=(",", ":"), sort_keys=True)
+        os.replace(tmp_path, self.refs_path)
+        with open(self.refs_log_path, "w"):
+            pass
+
+
+class ManifestWriter:
+    """Builds an archive manifest, storing each member as it is added."""
+
+    def __init__(self, archive_path=None, fmt="zip", store=None):
+        """
+        Args:
+            archive_path: Archive the manifest stands in for; may be left
+                for close() when the name depends on the content
+            fmt: "zip", or "gzip" for a single-member .gz
+            store: BlobStore, defaults to the repo's blobs/
+        """
+        self.archive_path = archive_path
+        self.fmt = fmt
+        self.store = store or BlobStore()
+        self.entries = []
+        # Object files this writer created: the paths to sync along with the manifest
+        self.new_objects = []
+
+    def add(self, name, data):
+        """Add a member; returns its blob digest."""
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        digest, path = self.store.put_new(data)
+        if path is not None:
+            self.new_objects.append(path)
+        self.entries.append({"name": name, "blob": digest, "size": len(data)})
+        return digest
+
+    def add_zip(self, name, members):
+        """Add a nested zip made of (member name, data) pairs."""
+        nested = ManifestWriter(store=self.store)
+        for member, data in members:
+            nested.add(member, data)
+        self.entries.append({"name": name, "format": "zip", "entries": nested.entries})
+        self.new_objects.extend(nested.new_objects)
+
+    def close(self, archive_path=None, **meta):
+        """Reference the blobs and write the manifest; returns its path."""
+        archive_path = archive_path or self.archive_path
+        manifest = {
+            "manifest": MANIFEST_VERSION,
+            "archive": os.path.basename(archive_path),
+            "format": self.fmt,
+            "entries": self.entries,
+        }
+        manifest.update(meta)
+
+        self.store.incref(entry_digests(self.entries))
+        path = manifest_path_for(archive_path)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp_path, path)
+        return path
+
+
+# ------------------------------ MANIFESTS ------------------------------
+def read_manifest(path):
+    with open(path, "r") as f:
+        manifest = json.load(f)
+    if manifest.get("manifest") != MANIFEST_VERSION:
+        raise ValueError(f"{path}: unsupported manifest version {manifest.get('manifest')!r}")
+    return manifest
+
+
+def iter_manifests(dirs):
+    for d in dirs:
+        if not os.path.isdir(d):
+            continue
+        for name in sorted(os.listdir(d)):
+            if name.endswith(MANIFEST_SUFFIX):
+                yield os.path.join(d, name)
+
+
+def count_refs(dirs, counted=None):
+    """{digest: references} over the manifests under ``dirs``; their paths are appended to ``counted``."""
+    refs = {}
+    for path in iter_manifests(dirs):
+        manifest = read_manifest(path)
+        for digest in entry_digests(manifest["entries"]):
+            refs[digest] = refs.get(digest, 0) + 1
+        if counted is not None:
+            counted.append(path)
+    return refs
+
+
+def remove(manifest_path, store=None):
+    """Delete a manifest and drop its references."""
+    store = store or BlobStore()
+    manifest = read_manifest(manifest_path)
+    os.remove(manifest_path)
+    store.decref(entry_digests(manifest["entries"]))
+
+
+def materialize(manifest_path, out_path=None, store=None):
+    """Write the real archive a manifest stands for; returns its path."""
+    store = store or BlobStore()
+    manifest = read_manifest(manifest_path)
+    if out_path is None:
+        out_path = manifest_path[:-len(MANIFEST_SUFFIX)]
+
+    tmp_path = out_path + ".tmp"
+    if manifest["format"] == "gzip":
+        with gzip.open(tmp_path, "wb") as f:
+            for entry in manifest["entries"]:
+                f.write(store.get(entry["blob"]))
+    else:
+        with open(tmp_path, "wb") as f:
+            _write_zip(f, manifest["entries"], store)
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+def _write_zip(f, entries, store):
+    with ArchiveWriter(f) as zf:
+        for entry in entries:
+            if "entries" in entry:
+                buf = io.BytesIO()
+                _write_zip(buf, entry["entries"], store)
+                zf.writestr(entry["name"], buf.getvalue())
+            else:
+                zf.writestr(entry["name"], store.get(entry["blob"]))
+
+
+def ingest(archive_path, store=None):
+    """Replace an existing .zip or .gz archive with a manifest; returns the manifest path."""
+    store = store or BlobStore()
+    if archive_path.endswith(".gz"):
+        writer = ManifestWriter(archive_path, fmt="gzip", store=store)
+        with gzip.open(archive_path, "rb") as f:
+            writer.add(os.path.basename(archive_path)[:-3], f.read())
+    else:
+        writer = ManifestWriter(archive_path, store=store)
+        with zipfile.ZipFile(archive_path) as zf:
+            writer.entries = _zip_entries(zf, store)
+
+    path = writer.close()
+    os.remove(archive_path)
+    return path
+
+
+def _zip_entries(zf, store):
+    writer = ManifestWriter(store=store)
+    for info in zf.infolist():
+        if info.is_dir():
+            continue
+        data = zf.read(info)
+        if info.filename.endswith(".zip") and zipfile.is_zipfile(io.BytesIO(data)):
+            with zipfile.ZipFile(io.BytesIO(data)) as nested:
+                writer.entries.append({"name": info.filename, "format": "zip",
+                                       "entries": _zip_entries(nested, store)})
+        else:
+            writer.add(info.filename, data)
+    return writer.entries
+
+
+# ------------------------------ CLI ------------------------------
+def main(argv=None):
+    """python blob_store.py {ingest|materialize|remove} PATH... | {fsck|gc|stats}"""
+    argv = sys.argv[1:] if argv is None else argv
+    usage = (f"Usage: {os.path.basename(__file__)} {{ingest|materialize|remove}} PATH...\n"
+             f"       {os.path.basename(__file__)} {{fsck|gc|stats}}")
+    if not argv or argv[0] not in ("ingest", "materialize", "remove", "fsck", "gc", "stats"):
+        print(usage)
+        return 1
+
+    cmd, paths = argv[0], argv[1:]
+    store = BlobStore()
+    if cmd == "ingest":
+        # Files, or every .zip/.gz archive directly inside a directory
+        archives = []
+        for path in paths:
+            if os.path.isdir(path):
+                archives.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                                if name.endswith((".zip", ".gz")))
+            else:
+                archives.append(path)
+        for path in archives:
+            print(f"[∞] {ingest(path, store)}")
+    elif cmd == "materialize":
+        for path in paths:
+            print(f"[∞] {materialize(path, store=store)}")
+    elif cmd == "remove":
+        for path in paths:
+            remove(path, store)
+    elif cmd == "fsck":
+        print(f"[∞] Recounted references from {store.rebuild_refs()} manifests")
+    elif cmd == "gc":
+        print(f"[∞] Removed {store.gc()} unreferenced blobs")
+    else:
+        objects, size, refs = store.stats()
+        print(f"[∞] {objects} blobs, {size} bytes, {refs} references in {store.root}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,19 @@
 #!/usr/bin/env python3
 import os
-import json
+import sys
+
+from research_indexer import IncrementalIndexer, IndexSource
+from static_variants import write_variants, variants_fresh
 
 ROOT = os.path.dirname(os.path.abspath(__file__))
 
 TOKEN_DIR = os.path.join(ROOT, "infinity_tokens")
 RAD_DIR = os.path.join(ROOT, "radionics_reader")
 OUTFILE = os.path.join(ROOT, "research_index.json")
-
-records = []
+# Served by auth_server from their precompressed variants
+PORTAL_FILES = [OUTFILE,
+                os.path.join(ROOT, "index.html"),
+                os.path.join(ROOT, "category_tokens.json")]
 
 color_to_role = {
     "green": "engineer",
@@ -20,73 +25,78 @@ color_to_role = {
     "purple": "assimilation",
 }
 
-# Index infinity_tokens/*.json
-if os.path.isdir(TOKEN_DIR):
-    for fname in os.listdir(TOKEN_DIR):
-        if not fname.endswith(".json"):
-            continue
-        full = os.path.join(TOKEN_DIR, fname)
-        try:
-            with open(full, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        except Exception:
-            data = {}
-
-        hash_from_name = os.path.splitext(fname)[0]
-        token_hash = data.get("hash") or hash_from_name
-
-        color = (data.get("color")
-                 or data.get("channel_color")
-                 or data.get("lane_color")
-                 or "").lower()
-
-        role = data.get("role") or color_to_role.get(color, "data")
-
-        title = (data.get("title")
-                 or data.get("label")
-                 or data.get("name")
-                 or f"Token {token_hash[:8]}…")
-
-        src = data.get("source_url") or data.get("url") or ""
-        ts = data.get("timestamp") or data.get("ts") or ""
-        notes = data.get("notes") or ""
-
-        records.append({
-            "hash": token_hash,
-            "role": role,
-            "title": title,
-            "url": f"infinity_tokens/{fname}",
-            "source_url": src,
-            "timestamp": ts,
-            "notes": notes,
-        })
-
-# Index radionics_reader/*.txt as Data role
-if os.path.isdir(RAD_DIR):
-    for fname in os.listdir(RAD_DIR):
-        if not (fname.endswith(".txt") or fname.endswith(".md")):
-            continue
-
-        hash_from_name = os.path.splitext(fname)[0]
-
-        records.append({
-            "hash": hash_from_name,
-            "role": "data",
-            "title": f"Radionics capture {hash_from_name[:8]}…",
-            "url": f"radionics_reader/{fname}",
-            "source_url": "",
-            "timestamp": "",
-            "notes": "",
-        })
-
-# Optional: sort by timestamp if present, else by hash
-def sort_key(r):
-    ts = r.get("timestamp") or ""
-    return (ts, r.get("hash") or "")
-
-records.sort(key=sort_key)
-
-with open(OUTFILE, "w", encoding="utf-8") as f:
-    json.dump(records, f, indent=2)
-
-print(f"Wrote {len(records)} records to research_index.json")
+# Index infinity_tokens/*.json (and infinity_tokens.store/ if present)
+def token_record(fname, data):
+    if data is None:
+        data = {}
+
+    hash_from_name = os.path.splitext(fname)[0]
+    token_hash = data.get("hash") or hash_from_name
+
+    color = (data.get("color")
+             or data.get("channel_color")
+             or data.get("lane_color")
+             or "").lower()
+
+    role = data.get("role") or color_to_role.get(color, "data")
+
+    title = (data.get("title")
+             or data.get("label")
+             or data.get("name")
+             or f"Token {token_hash[:8]}…")
+
+    src = data.get("source_url") or data.get("url") or ""
+    ts = data.get("timestamp") or data.get("ts") or ""
+    notes = data.get("notes") or ""
+
+    return {
+        "hash": token_hash,
+        "role": role,
+        "title": title,
+        "url": f"infinity_tokens/{fname}",
+        "source_url": src,
+        "timestamp": ts,
+        "notes": notes,
+    }
+
+# Index radionics_reader/*.txt as Data role (file name only, nothing to parse)
+def radionics_record(fname, data):
+    hash_from_name = os.path.splitext(fname)[0]
+
+    return {
+        "hash": hash_from_name,
+        "role": "data",
+        "title": f"Radionics capture {hash_from_name[:8]}…",
+        "url": f"radionics_reader/{fname}",
+        "source_url": "",
+        "timestamp": "",
+        "notes": "",
+    }
+
+def make_indexer(outfile=OUTFILE):
+    return IncrementalIndexer(outfile, [
+        IndexSource("infinity_tokens", TOKEN_DIR, token_record),
+        IndexSource("radionics_reader", RAD_DIR, radionics_record,
+                    suffixes=(".txt", ".md"), parse=False, use_store=False),
+    ])
+
+def main():
+    # --full ignores the change journal and reparses everything
+    full = "--full" in sys.argv[1:]
+    records, stats = make_indexer().update(full=full)
+
+    if stats["written"]:
+        print(f"Wrote {len(records)} records to research_index.json "
+              f"({stats['parsed']} parsed, {stats['dropped']} dropped)")
+    else:
+        print(f"research_index.json up to date ({len(records)} records)")
+
+    # gzip/brotli variants and ETags of the portal files, for those that changed
+    for path in PORTAL_FILES:
+        if os.path.exists(path) and not variants_fresh(path):
+            written = write_variants(path)
+            print(f"Compressed {os.path.basename(path)}: {written['size']} bytes, "
+                  f"gzip {written.get('gzip', '-')}, br {written.get('br', '-')}")
+
+if __name__ == "__main__":
+    main()
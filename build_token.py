@@ -9,16 +9,42 @@ import json
 import hashlib
 import datetime
 import math
+import re
 import base64
+import binascii
+import codecs
+import itertools
+import shutil
+import tempfile
+import uuid
 from datetime import timezone
 
+from keyword_scanner import KeywordScanner
+from pending_queue import PendingQueue
+from token_store import store_for, token_filenames
+
 # ------------------------------ CONFIG ------------------------------
 Z_ROOT = os.path.abspath(os.path.dirname(__file__))
 TOKENS_DIR = os.path.join(Z_ROOT, "tokens")
-SESSION_BUFFER = os.path.join(Z_ROOT, "session_buffer.json")
+SESSION_LOG = os.path.join(Z_ROOT, "session_buffer.log")
+
+# Also write tokens/<hash>.json at build time. tokens.store/ is not committed,
+# so the tracked JSON files are what a fresh clone gets; with this off run
+# `python token_store.py export tokens` before committing instead
+EXPORT_TOKEN_JSON = os.getenv("TOKEN_JSON_EXPORT", "1") != "0"
 
 os.makedirs(TOKENS_DIR, exist_ok=True)
 
+_token_store = None
+
+
+def get_token_store():
+    """Return the process-wide store for TOKENS_DIR (tokens.store/)."""
+    global _token_store
+    if _token_store is None:
+        _token_store = store_for(TOKENS_DIR)
+    return _token_store
+
 # ------------------------------ SCORING KEYWORDS ----------------------
 # Keywords that boost content value based on research importance
 BOOST_KEYWORDS = {
@@ -68,6 +94,15 @@ BOOST_KEYWORDS = {
 MIN_VALUE = 90
 MAX_VALUE = 964_590_650_869_860_860.97
 
+# Compiled once; every score_content call reuses it
+BOOST_SCANNER = KeywordScanner(BOOST_KEYWORDS)
+
+# Read size for streamed uploads
+STREAM_CHUNK_SIZE = 1 << 20
+
+# What base64.b64decode skips in its default (non-validating) mode
+NOT_BASE64 = re.compile(rb"[^A-Za-z0-9+/=]")
+
 
 def get_timestamp():
     """Get current UTC timestamp."""
@@ -97,6 +132,20 @@ def score_content(text):
     - File type bonuses
     - Uniqueness factor
     """
+    text_lower = text.lower()
+    words = text_lower.split()
+
+    return _score_counts(
+        char_count=len(text),
+        word_count=len(words),
+        unique_count=len(set(words)),
+        line_count=text.count('\n') + 1,
+        keyword_counts=BOOST_SCANNER.count(text_lower)
+    )
+
+
+def _score_counts(char_count, word_count, unique_count, line_count, keyword_counts):
+    """Turn raw content counts into the (score, analysis) pair of score_content."""
     score = 0
     analysis = {
         "word_count": 0,
@@ -106,51 +155,158 @@ def score_content(text):
         "complexity_bonus": 0
     }
 
-    text_lower = text.lower()
-    words = text_lower.split()
-
     # Base scores
-    analysis["char_count"] = len(text)
-    analysis["word_count"] = len(words)
+    analysis["char_count"] = char_count
+    analysis["word_count"] = word_count
 
     # Character count base score
-    score += len(text) * 0.5
+    score += char_count * 0.5
 
     # Word count score
-    score += len(words) * 2
+    score += word_count * 2
 
     # Keyword matching with tier bonuses
-    for keyword, bonus in BOOST_KEYWORDS.items():
-        count = text_lower.count(keyword)
-        if count > 0:
-            keyword_score = count * bonus
-            score += keyword_score
-            analysis["keyword_matches"][keyword] = {
-                "count": count,
-                "bonus": keyword_score
-            }
+    for keyword, count in keyword_counts.items():
+        keyword_score = count * BOOST_KEYWORDS[keyword]
+        score += keyword_score
+        analysis["keyword_matches"][keyword] = {
+            "count": count,
+            "bonus": keyword_score
+        }
 
     # Depth bonus - exponential scaling for long content
-    if len(text) > 100:
-        depth = int(math.log(len(text), 2) * 100)
+    if char_count > 100:
+        depth = int(math.log(char_count, 2) * 100)
         score += depth
         analysis["depth_bonus"] = depth
 
     # Complexity bonus - based on unique words ratio
-    if len(words) > 0:
-        unique_ratio = len(set(words)) / len(words)
+    if word_count > 0:
+        unique_ratio = unique_count / word_count
         complexity = int(unique_ratio * 1000)
         score += complexity
         analysis["complexity_bonus"] = complexity
 
     # Line count bonus (structured content)
-    lines = text.split('\n')
-    if len(lines) > 5:
-        score += len(lines) * 10
+    if line_count > 5:
+        score += line_count * 10
 
     return score, analysis
 
 
+# ------------------------------ STREAMING -----------------------------
+class ContentScorer:
+    """
+    Incremental score_content for text that arrives in chunks.
+
+    Only the set of distinct words is kept in memory, so large uploads can be
+    scored without holding the whole document (or its lower/split copies).
+    """
+
+    def __init__(self):
+        self.char_count = 0
+        self.word_count = 0
+        self.line_count = 1
+        self.unique_words = set()
+        self._partial_word = []
+        self._keywords = BOOST_SCANNER.stream()
+
+    def feed(self, chunk):
+        """Add the next chunk of text."""
+        if not chunk:
+            return
+
+        chunk_lower = chunk.lower()
+        self.char_count += len(chunk)
+        self.line_count += chunk.count('\n')
+        self._keywords.feed(chunk_lower)
+
+        words = chunk_lower.split()
+
+        # Join a word that was cut off at the end of the previous chunk
+        if self._partial_word:
+            if chunk_lower[0].isspace():
+                self._add_words(["".join(self._partial_word)])
+                self._partial_word = []
+            else:
+                self._partial_word.append(words[0])
+                if len(words) == 1 and not chunk_lower[-1].isspace():
+                    return
+                words[0] = "".join(self._partial_word)
+                self._partial_word = []
+
+        # A word running up to the end of the chunk may continue in the next one
+        if not chunk_lower[-1].isspace():
+            self._partial_word = [words.pop()]
+
+        self._add_words(words)
+
+    def _add_words(self, words):
+        self.word_count += len(words)
+        self.unique_words.update(words)
+
+    def result(self):
+        """Return (score, analysis) for everything fed so far."""
+        word_count = self.word_count
+        unique_words = self.unique_words
+        if self._partial_word:
+            word_count += 1
+            unique_words = unique_words | {"".join(self._partial_word)}
+
+        return _score_counts(
+            char_count=self.char_count,
+            word_count=word_count,
+            unique_count=len(unique_words),
+            line_count=self.line_count,
+            keyword_counts=self._keywords.counts()
+        )
+
+
+def iter_text_chunks(source, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Yield text chunks from a string, bytes, file-like object or chunk iterable.
+
+    Bytes are decoded as UTF-8 incrementally; a UnicodeDecodeError is raised
+    for content that is not valid UTF-8.
+    """
+    if isinstance(source, (str, bytes, bytearray)):
+        chunks = (source[i:i + chunk_size] for i in range(0, len(source), chunk_size))
+    elif hasattr(source, "read"):
+        chunks = iter(lambda: source.read(chunk_size), source.read(0))
+    else:
+        chunks = source
+
+    decoder = None
+    for chunk in chunks:
+        if isinstance(chunk, (bytes, bytearray)):
+            if decoder is None:
+                decoder = codecs.getincrementaldecoder("utf-8")()
+            chunk = decoder.decode(chunk)
+        if chunk:
+            yield chunk
+
+    if decoder is not None:
+        chunk = decoder.decode(b"", final=True)
+        if chunk:
+            yield chunk
+
+
+def score_stream(source):
+    """
+    Score content without materializing it; same result as score_content.
+
+    Args:
+        source: str, bytes, file-like object or iterable of str/bytes chunks
+
+    Returns:
+        (score, analysis) tuple
+    """
+    scorer = ContentScorer()
+    for chunk in iter_text_chunks(source):
+        scorer.feed(chunk)
+    return scorer.result()
+
+
 def calculate_value(score):
     """
     Calculate token value from score.
@@ -208,6 +364,50 @@ def build_token(text, source_type="text", filename=None):
     Returns:
         Token object with hash, value, and metadata
     """
+    token = make_token(text, source_type, filename)
+
+    # Save token to file
+    write_token(token)
+
+    # Add to session buffer for valuation pipeline
+    add_to_buffer(token["hash"])
+
+    return token
+
+
+def build_tokens(texts, source_type="text", filenames=None):
+    """
+    Build tokens for a batch of texts.
+
+    Each token is scored as with build_token, but the token store and the
+    session buffer are each appended to once for the whole batch.
+
+    Args:
+        texts: Iterable of contents to tokenize
+        source_type: "text", "file", or "paste" (applies to every token)
+        filenames: Optional iterable of filenames, parallel to texts
+
+    Returns:
+        List of token objects, in input order
+    """
+    if filenames is None:
+        filenames = itertools.repeat(None)
+
+    tokens = [make_token(text, source_type, filename)
+              for text, filename in zip(texts, filenames)]
+
+    get_token_store().put_many(tokens)
+    if EXPORT_TOKEN_JSON:
+        for token in tokens:
+            write_token_json(token)
+
+    add_many_to_buffer(t["hash"] for t in tokens)
+
+    return tokens
+
+
+def make_token(text, source_type="text", filename=None):
+    """Score text and assemble its token object without saving it."""
     # Generate hash
     token_hash = infinity_hash(text + str(datetime.datetime.now(timezone.utc)))
 
@@ -218,7 +418,7 @@ def build_token(text, source_type="text", filename=None):
     value = calculate_value(score)
 
     # Build token object
-    token = {
+    return {
         "hash": token_hash,
         "timestamp": get_timestamp(),
         "source_type": source_type,
@@ -231,50 +431,157 @@ def build_token(text, source_type="text", filename=None):
         "analysis": analysis
     }
 
-    # Save token to file
-    token_path = os.path.join(TOKENS_DIR, f"{token_hash}.json")
+
+def write_token(token):
+    """Save a token object to the token store (and TOKENS_DIR if exporting JSON)."""
+    get_token_store().put(token)
+    if EXPORT_TOKEN_JSON:
+        write_token_json(token)
+
+
+def write_token_json(token, key=None):
+    """Write a token object as TOKENS_DIR/<key>.json for the frontend."""
+    token_path = os.path.join(TOKENS_DIR, f"{key or token['hash']}.json")
     with open(token_path, "w") as f:
         json.dump(token, f, indent=4)
+    return token_path
 
-    # Add to session buffer for valuation pipeline
-    add_to_buffer(token_hash)
 
-    return token
+def load_token(key):
+    """Load a token from the store, falling back to a loose TOKENS_DIR file."""
+    token = get_token_store().get(key)
+    if token is not None:
+        return token
+    token_path = os.path.join(TOKENS_DIR, f"{key}.json")
+    if not os.path.exists(token_path):
+        return None
+    with open(token_path, "r") as f:
+        return json.load(f)
 
 
 def add_to_buffer(token_hash):
     """Add token hash to session buffer for processing."""
-    buffer = {"pending": []}
-    if os.path.exists(SESSION_BUFFER):
-        with open(SESSION_BUFFER, "r") as f:
-            buffer = json.load(f)
+    add_many_to_buffer([token_hash])
 
-    if token_hash not in buffer.get("pending", []):
-        buffer.setdefault("pending", []).append(token_hash)
 
-    with open(SESSION_BUFFER, "w") as f:
-        json.dump(buffer, f, indent=4)
+def add_many_to_buffer(token_hashes):
+    """Queue token hashes for valuation with a single append to the session log."""
+    PendingQueue(SESSION_LOG).enqueue(token_hashes)
+
+
+def build_token_stream(source, source_type="file", filename=None):
+    """
+    Build a token from streamed content without holding it in memory.
+
+    The raw text is spooled to a temp file while it is hashed and scored,
+    then copied into the token JSON, which comes out identical to the one
+    build_token writes for the same text, and packed into the token store.
+
+    Args:
+        source: str, bytes, file-like object or iterable of str/bytes chunks
+        source_type: "text", "file", or "paste"
+        filename: Original filename if from file upload
+
+    Returns:
+        Token object as returned by build_token, minus "raw_text"
+    """
+    scorer = ContentScorer()
+    hasher = hashlib.sha256()
+
+    with tempfile.TemporaryFile("w+", encoding="utf-8") as spool:
+        for chunk in iter_text_chunks(source):
+            scorer.feed(chunk)
+            hasher.update(chunk.encode())
+            spool.write(json.dumps(chunk)[1:-1])
+
+        # Same hash as infinity_hash(text + str(now))
+        hasher.update(str(datetime.datetime.now(timezone.utc)).encode())
+        token_hash = hasher.hexdigest()
+
+        score, analysis = scorer.result()
+        value = calculate_value(score)
+
+        placeholder = uuid.uuid4().hex
+        token = {
+            "hash": token_hash,
+            "timestamp": get_timestamp(),
+            "source_type": source_type,
+            "filename": filename,
+            "raw_text": placeholder,
+            "score": score,
+            "value": value,
+            "value_formatted": format_value(value),
+            "vector": vector_position(token_hash),
+            "analysis": analysis
+        }
+        head, tail = json.dumps(token, indent=4).split(f'"{placeholder}"', 1)
+
+        token_path = os.path.join(TOKENS_DIR, f"{token_hash}.json")
+        if not EXPORT_TOKEN_JSON:
+            token_path = os.path.join(TOKENS_DIR, f".{token_hash}.json.tmp")
+        try:
+            with open(token_path, "w") as f:
+                f.write(head + '"')
+                spool.seek(0)
+                shutil.copyfileobj(spool, f)
+                f.write('"' + tail)
+            get_token_store().put_file(token_hash, token_path)
+        finally:
+            if not EXPORT_TOKEN_JSON and os.path.exists(token_path):
+                os.remove(token_path)
+
+    del token["raw_text"]
+
+    # Add to session buffer for valuation pipeline
+    add_to_buffer(token_hash)
+
+    return token
+
+
+def iter_base64_chunks(data, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Decode base64 ``data`` (str or bytes) a chunk at a time.
+
+    Yields the bytes base64.b64decode would return for the whole input, in
+    pieces decoded from 4-character-aligned runs, and raises ValueError
+    (binascii.Error) where b64decode would.
+    """
+    if isinstance(data, str):
+        data = data.encode("ascii")  # b64decode refuses non-ASCII str too
+    pending = b""
+    for i in range(0, len(data), chunk_size):
+        pending += NOT_BASE64.sub(b"", data[i:i + chunk_size])
+        cut = len(pending) - len(pending) % 4
+        if cut:
+            yield binascii.a2b_base64(pending[:cut])
+            pending = pending[cut:]
+    if pending:
+        raise binascii.Error("Incorrect padding")
 
 
 def process_file_upload(file_content, filename):
     """
     Process uploaded file content.
 
+    The base64 payload is decoded and scored a chunk at a time, so neither
+    the decoded file nor its text is held in memory.
+
     Args:
         file_content: Base64 encoded file content or raw text
         filename: Name of the uploaded file
 
     Returns:
-        Token object
+        Token object without "raw_text" (see build_token_stream); the full
+        token is in the store, load_token(token["hash"])
     """
+    # A bad payload fails while it is being read, before anything is saved
     try:
-        # Try to decode base64
-        decoded = base64.b64decode(file_content).decode('utf-8')
+        return build_token_stream(iter_base64_chunks(file_content), source_type="file", filename=filename)
     except (TypeError, ValueError):
-        # If not base64, use as-is
-        decoded = file_content
+        pass
 
-    return build_token(decoded, source_type="file", filename=filename)
+    # If not base64 (or not UTF-8 once decoded), use as-is
+    return build_token_stream(file_content, source_type="file", filename=filename)
 
 
 # ------------------------------ MEGA HASH -----------------------------
@@ -300,13 +607,11 @@ def generate_mega_hash(token_hashes, description=""):
     token_data = []
 
     for th in token_hashes:
-        token_path = os.path.join(TOKENS_DIR, f"{th}.json")
-        if os.path.exists(token_path):
-            with open(token_path, "r") as f:
-                data = json.load(f)
-                combined_text += data.get("raw_text", "") + "\n---\n"
-                total_score += data.get("score", 0)
-                token_data.append(data)
+        data = load_token(th)
+        if data is not None:
+            combined_text += data.get("raw_text", "") + "\n---\n"
+            total_score += data.get("score", 0)
+            token_data.append(data)
 
     # Generate mega hash
     mega_hash = infinity_hash(combined_text + str(datetime.datetime.now(timezone.utc)) + "MEGA")
@@ -339,9 +644,9 @@ def generate_mega_hash(token_hashes, description=""):
     }
 
     # Save mega token
-    mega_path = os.path.join(TOKENS_DIR, f"MEGA_{mega_hash}.json")
-    with open(mega_path, "w") as f:
-        json.dump(mega_token, f, indent=4)
+    get_token_store().put(mega_token, key=f"MEGA_{mega_hash}")
+    if EXPORT_TOKEN_JSON:
+        write_token_json(mega_token, key=f"MEGA_{mega_hash}")
 
     return mega_token
 
@@ -410,7 +715,7 @@ def main():
                 print(f"    Value: {mega['value_formatted']}")
 
         elif cmd == "list":
-            tokens = os.listdir(TOKENS_DIR)
+            tokens = token_filenames(TOKENS_DIR, get_token_store())
             print(f"\n[∞] {len(tokens)} tokens in repository:")
             for t in tokens[:10]:
                 print(f"    {t}")
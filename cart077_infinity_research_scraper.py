@@ -1,5 +1,11 @@
 #!/usr/bin/env python3
-import os, re, json, hashlib, time, datetime, random, gzip, requests, subprocess
+import os, json, hashlib, time, datetime, random, gzip
+
+from token_store import store_for
+import git_sync
+import fetch_cache
+from blob_store import ManifestWriter, BLOBS_ENABLED
+from html_extract import visible_text
 
 # ------------------------------ CONFIG ------------------------------
 Z_ROOT = os.path.abspath(os.path.dirname(__file__))
@@ -45,24 +51,22 @@ def valuation(text):
     base = max(80, min(900 + length//150, 5000))
     return base + science_bonus
 
-def git_push():
+def git_push(paths):
+    """Queue changed paths; the git_sync.py daemon commits and pushes them in batches."""
     try:
-        subprocess.run(["git","add","."], cwd=Z_ROOT)
-        subprocess.run(["git","commit","-m","Infinity research update"], cwd=Z_ROOT)
-        subprocess.run(["git","push"], cwd=Z_ROOT)
-    except:
-        pass
+        git_sync.submit(paths, repo=Z_ROOT)
+    except Exception as e:
+        print(f"[x] git sync queue: {e}")
 
 # ------------------------------ SCRAPER ------------------------------
 def scrape():
     url = random.choice(SCRAPE_SOURCES)
     try:
-        r = requests.get(url, headers=HEADERS, timeout=10)
+        r = fetch_cache.fetch(url, headers=HEADERS, timeout=10)
         if r.status_code != 200:
             return None
-        text = r.text
-        clean = re.sub(r"<[^>]+>","",text)
-        return clean[:4000]  # throttle
+        # Parsing stops once the first 4000 characters of text are in
+        return visible_text(r.text, limit=4000)  # throttle
     except:
         return None
 
@@ -92,8 +96,9 @@ def generate_token(block):
 
 # ------------------------ ZIPCOIN PACKAGER ----------------------------
 def package_zipcoin():
+    """Pack the three oldest tokens into a zipcoin; returns the paths it changed."""
     files = sorted(os.listdir(TOKENS_DIR))
-    if len(files) < 3: return
+    if len(files) < 3: return []
 
     group = files[:3]
     combo_text = ""
@@ -105,11 +110,21 @@ def package_zipcoin():
     zip_hash = infinity_hash(combo_text)
     zip_path = os.path.join(ZIPCOIN_DIR, f"{zip_hash}.zipcoin.gz")
 
-    with gzip.open(zip_path, "wb") as z:
-        z.write(combo_text.encode())
+    if BLOBS_ENABLED:
+        # Only a manifest; the tokens' content goes to the shared blob store
+        writer = ManifestWriter(zip_path, fmt="gzip")
+        writer.add(f"{zip_hash}.zipcoin", combo_text)
+        changed = [writer.close()] + writer.new_objects
+    else:
+        changed = [zip_path]
+        with gzip.open(zip_path, "wb") as z:
+            z.write(combo_text.encode())
 
     for f in group:
         os.remove(os.path.join(TOKENS_DIR,f))
+    # tokens built through build_token are also packed in tokens.store/
+    store_for(TOKENS_DIR).delete([os.path.splitext(f)[0] for f in group])
+    return changed + [os.path.join(TOKENS_DIR,f) for f in group]
 
 # --------------------------- MAIN LOOP --------------------------------
 def main():
@@ -130,8 +145,8 @@ def main():
         print(f"[∞] Stored: {path}")
         print(f"[∞] Vector: {vector_position(seed)}")
 
-        package_zipcoin()
-        git_push()
+        changed = package_zipcoin()
+        git_push([path] + changed)
 
         time.sleep(4)  # turbo pace but safe
 
@@ -1,20 +1,14 @@
 #!/usr/bin/env python3
 import os, hashlib, json, datetime, pathlib
 
+from pending_queue import PendingQueue
+
 REPO_DIR = os.path.expanduser("~/z")
 TOKENS_DIR = os.path.join(REPO_DIR, "tokens")
 
 os.makedirs(TOKENS_DIR, exist_ok=True)
 
-SESSION_BUFFER = os.path.join(REPO_DIR, "session_buffer.json")
-
-def load_buffer():
-    if os.path.exists(SESSION_BUFFER):
-        return json.load(open(SESSION_BUFFER))
-    return {"pending": []}
-
-def save_buffer(buf):
-    json.dump(buf, open(SESSION_BUFFER,"w"), indent=4)
+SESSION_LOG = os.path.join(REPO_DIR, "session_buffer.log")
 
 def create_token(text):
     h = hashlib.sha256(text.encode()).hexdigest()
@@ -52,9 +46,7 @@ def main():
 
     token_obj = create_token(text)
 
-    buf = load_buffer()
-    buf["pending"].append(token_obj["hash"])
-    save_buffer(buf)
+    PendingQueue(SESSION_LOG).enqueue([token_obj["hash"]])
 
     print("\n[∞] Token created:", token_obj["hash"])
     print("[∞] Added to session buffer for valuation (Cart 081 + 082).")
@@ -1,19 +1,16 @@
 #!/usr/bin/env python3
-import os, json
+import os
+
+from pending_queue import PendingQueue
 
 REPO_DIR = os.path.expanduser("~/z")
 TOKENS_DIR = os.path.join(REPO_DIR, "tokens")
-BUFFER = os.path.join(REPO_DIR, "session_buffer.json")
+BUFFER = os.path.join(REPO_DIR, "session_buffer.log")
 
 def main():
     print("∞ Infinity Ingest Buffer (Cart 081) Online")
 
-    if not os.path.exists(BUFFER):
-        print("[!] No buffer found. Nothing to ingest.")
-        return
-
-    buf = json.load(open(BUFFER))
-    pending = buf.get("pending", [])
+    pending = PendingQueue(BUFFER).pending()
 
     if not pending:
         print("[!] Buffer empty. Nothing waiting for valuation.")
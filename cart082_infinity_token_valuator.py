@@ -1,23 +1,30 @@
 #!/usr/bin/env python3
-import os, json, hashlib, datetime, math, re
+import os, json, hashlib, datetime, math, re, argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from keyword_scanner import KeywordScanner
+from pending_queue import PendingQueue
+from token_store import store_for
 
 REPO_DIR = os.path.expanduser("~/z")
 TOKENS_DIR = os.path.join(REPO_DIR, "tokens")
-BUFFER = os.path.join(REPO_DIR, "session_buffer.json")
+BUFFER = os.path.join(REPO_DIR, "session_buffer.log")
+
+# tokens handed to a worker at a time; at most 2 chunks per worker in flight
+CHUNK_SIZE = 64
 
 BOOST_KEYWORDS = [
     "hydrogen","quantum","plasma","electron","vector","tensor",
     "relativity","einstein","gravity","photon","ai","neural",
     "fusion","reactor","lattice","kris","infinity","hydra","osprey"
 ]
+SCANNER = KeywordScanner(BOOST_KEYWORDS)
 
 def score_text(text):
     base = len(text)
 
     # keyword bonuses
-    boost = 0
-    for k in BOOST_KEYWORDS:
-        boost += text.lower().count(k) * 50
+    boost = sum(SCANNER.count(text.lower()).values()) * 50
 
     # exponential tail for long depth
     depth = int(math.log(max(1, len(text)), 3) * 40)
@@ -33,8 +40,8 @@ def scale_value(score):
         return f"${1200 + score*3}"
     return f"${50000 + score*12}"
 
-def valuate_token(tpath):
-    obj = json.load(open(tpath))
+def valuate_token(obj):
+    """Rescore a token object in place; returns (hash, value)."""
     text = obj["raw_text"]
 
     s = score_text(text)
@@ -43,36 +50,114 @@ def valuate_token(tpath):
     obj["value"] = v
     obj["score"] = s
 
-    json.dump(obj, open(tpath,"w"), indent=4)
-
     return obj["hash"], v
 
-def main():
-    if not os.path.exists(BUFFER):
-        print("[!] No buffer found.")
+_store = None
+
+def get_store():
+    """Per-process handle on tokens.store/ (opened lazily, so after the pool forks)."""
+    global _store
+    if _store is None:
+        _store = store_for(TOKENS_DIR)
+    return _store
+
+def valuate_chunk(hashes):
+    """Valuate a chunk of pending hashes; returns (hash, value or None, error)."""
+    store = get_store()
+    results = []
+    stored = []
+    for h in hashes:
+        path = os.path.join(TOKENS_DIR, f"{h}.json")
+        try:
+            obj = store.get(h)
+            in_store = obj is not None
+            if not in_store:
+                if not os.path.exists(path):
+                    results.append((h, None, "missing token file"))
+                    continue
+                with open(path) as f:
+                    obj = json.load(f)
+
+            _, v = valuate_token(obj)
+
+            if in_store:
+                stored.append(obj)
+            if os.path.exists(path):
+                with open(path, "w") as f:
+                    json.dump(obj, f, indent=4)
+            results.append((h, v, None))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            results.append((h, None, str(e)))
+
+    # one store append for the whole chunk
+    if stored:
+        store.put_many(stored)
+    return results
+
+def iter_chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def valuate_pending(pending, workers=1, chunk_size=CHUNK_SIZE):
+    """Yield result chunks as they complete, fanning out over a process pool if workers > 1."""
+    chunks = iter_chunks(pending, chunk_size)
+
+    if workers <= 1:
+        for chunk in chunks:
+            yield valuate_chunk(chunk)
         return
 
-    buf = json.load(open(BUFFER))
-    pending = buf.get("pending", [])
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = set()
+        for chunk in chunks:
+            if len(in_flight) >= workers * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    yield fut.result()
+            in_flight.add(pool.submit(valuate_chunk, chunk))
+
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for fut in done:
+                yield fut.result()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cart 082 - Infinity token valuator")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="valuate in a pool of N processes (default: 1, serial)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help=f"tokens per worker task (default: {CHUNK_SIZE})")
+    args = parser.parse_args(argv)
+
+    queue = PendingQueue(BUFFER)
+    pending = queue.pending()
 
     if not pending:
         print("[!] No tokens waiting.")
         return
 
-    print("∞ Valuating pending Infinity tokens...\n")
-
-    for h in pending:
-        path = os.path.join(TOKENS_DIR, f"{h}.json")
-        if not os.path.exists(path):
-            continue
-        thash, val = valuate_token(path)
-        print(f"[∞] {thash} → {val}")
-
-    # clear buffer
-    buf["pending"]=[]
-    json.dump(buf, open(BUFFER,"w"), indent=4)
-
-    print("\n[∞] Valuation complete. All tokens updated in repo.")
+    print(f"∞ Valuating {len(pending)} pending Infinity tokens...\n")
+
+    done = 0
+    skipped = 0
+    for results in valuate_pending(pending, args.workers, max(1, args.chunk_size)):
+        valuated = []
+        for h, val, err in results:
+            if err:
+                skipped += 1
+                print(f"[!] {h} skipped: {err}")
+                continue
+            valuated.append(h)
+            print(f"[∞] {h} → {val}")
+
+        # clear only what was valuated; anything else (or queued meanwhile) stays
+        queue.ack(valuated)
+        done += len(valuated)
+        print(f"[∞] progress {done + skipped}/{len(pending)}")
+
+    print(f"\n[∞] Valuation complete. {done} tokens updated in repo.")
+    if skipped:
+        print(f"[!] {skipped} tokens left in the buffer (see messages above).")
 
 if __name__ == "__main__":
     main()
@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
-import os, json, subprocess
+import os, json
+
+import git_sync
 
 ROOT = os.getcwd()
 TOKENS = os.path.join(ROOT, "tokens")
@@ -72,9 +74,9 @@ def build_all():
         build_role_page(role)
 
 def git_push():
-    subprocess.run(["git", "add", "."])
-    subprocess.run(["git", "commit", "-m", "Infinity frontend routing fix"])
-    subprocess.run(["git", "push"])
+    # Only the pages this cart writes, not the whole tree
+    git_sync.submit([os.path.join(ROOT, f"{role}.html") for role in ROLES], repo=ROOT)
+    git_sync.sync_now(ROOT, "Infinity frontend routing fix")
 
 if __name__ == "__main__":
     build_all()
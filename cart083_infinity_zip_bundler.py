@@ -1,12 +1,19 @@
 #!/usr/bin/env python3
-import os, zipfile, time, datetime, shutil
+import os, time, datetime, shutil, argparse
+
+from dir_watcher import DirWatcher
+from archive_writer import ArchiveWriter
 
 RAW_DIR = "/data/data/com.termux/files/home/infinity_raw"
 BUNDLE_DIR = "/data/data/com.termux/files/home/z/data"
 LOGFILE = "/data/data/com.termux/files/home/z/data/bundler_log.txt"
+# Files already bundled: "<batch>\t<mtime_ns>\t<size>\t<path relative to RAW_DIR>" per line
+BUNDLED_LOG = os.path.join(BUNDLE_DIR, "bundled_files.log")
 
-os.makedirs(RAW_DIR, exist_ok=True)
-os.makedirs(BUNDLE_DIR, exist_ok=True)
+BATCH_SIZE = 5000
+# Seal a smaller batch once its oldest file has waited this long (0 disables)
+MAX_AGE = int(os.getenv("BUNDLE_MAX_AGE", 3600))
+SUFFIXES = (".json", ".gz", ".hash")
 
 def log(msg):
     with open(LOGFILE, "a") as f:
@@ -17,39 +24,163 @@ def make_bundle(files, batch_number):
     bundle_path = f"{BUNDLE_DIR}/token_batch_{batch_number:05d}.zip"
     log(f"Creating bundle: {bundle_path}")
 
-    with zipfile.ZipFile(bundle_path, "w", zipfile.ZIP_DEFLATED) as z:
+    bundled = []
+    tmp_path = bundle_path + ".tmp"
+    with ArchiveWriter(tmp_path) as z:
         for fpath in files:
             arcname = os.path.basename(fpath)
             try:
                 z.write(fpath, arcname)
+                bundled.append(fpath)
             except:
                 pass
+    os.replace(tmp_path, bundle_path)
 
     log(f"Bundle saved: {bundle_path}")
-    return bundle_path
+    return bundle_path, bundled
 
-def scan_and_bundle():
-    batch = 0
+class Bundler:
+    """
+    Bundles new raw files into token batches, driven by a DirWatcher.
 
-    while True:
-        all_files = []
-        for root, dirs, files in os.walk(RAW_DIR):
+    Candidates wait in arrival order until BATCH_SIZE are pending or the
+    oldest has waited MAX_AGE seconds. Every bundled file is appended to
+    BUNDLED_LOG with its mtime and size, so restarts never bundle it again
+    (a file rewritten since is a new candidate) and batch numbers carry on.
+    """
+
+    def __init__(self, raw_dir=RAW_DIR, bundled_log=BUNDLED_LOG, batch_size=BATCH_SIZE,
+                 max_age=MAX_AGE, delete=False):
+        self.raw_dir = raw_dir
+        self.bundled_log = bundled_log
+        self.batch_size = batch_size
+        self.max_age = max_age
+        self.delete = delete
+
+        self.bundled = {}   # relpath -> (mtime_ns, size)
+        self.pending = {}   # relpath -> time first seen, in arrival order
+        self.batch = 0
+        self._load()
+
+    def rescan(self):
+        """Queue every unbundled file under raw_dir (startup and polling fallback)."""
+        present = set()
+        for root, dirs, files in os.walk(self.raw_dir):
             for f in files:
-                if f.endswith(".json") or f.endswith(".gz") or f.endswith(".hash"):
-                    all_files.append(os.path.join(root, f))
+                present.add(self.offer(os.path.join(root, f)))
+        for rel in list(self.pending):
+            if rel not in present:
+                del self.pending[rel]
+
+    def offer(self, path):
+        """Queue ``path`` if it is an unbundled candidate, or drop it if it is gone; returns its relpath."""
+        rel = os.path.relpath(path, self.raw_dir)
+        if not path.endswith(SUFFIXES):
+            return rel
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self.pending.pop(rel, None)
+            return rel
+        if self.bundled.get(rel) != (st.st_mtime_ns, st.st_size) and rel not in self.pending:
+            self.pending[rel] = time.time()
+        return rel
+
+    def due(self):
+        """Seconds until the pending files must be sealed by age, or None."""
+        if not self.pending or not self.max_age:
+            return None
+        oldest = next(iter(self.pending.values()))
+        return max(0.0, oldest + self.max_age - time.time())
+
+    def seal_ready(self):
+        """Seal full batches, plus a partial one that reached max_age."""
+        while len(self.pending) >= self.batch_size:
+            self.seal(self.batch_size)
+        if self.pending and self.due() == 0:
+            self.seal(len(self.pending))
+
+    def seal(self, count):
+        selected = list(self.pending)[:count]
+        for rel in selected:
+            del self.pending[rel]
 
-        if len(all_files) >= 5000:
-            batch += 1
-            selected = all_files[:5000]
-            bundle = make_bundle(selected, batch)
+        self.batch += 1
+        paths = [os.path.join(self.raw_dir, rel) for rel in selected]
+        sigs = {}
+        for rel, path in zip(selected, paths):
+            try:
+                st = os.stat(path)
+                sigs[rel] = (st.st_mtime_ns, st.st_size)
+            except FileNotFoundError:
+                pass
+        bundle, bundled = make_bundle(paths, self.batch)
+
+        with open(self.bundled_log, "a") as f:
+            for path in bundled:
+                rel = os.path.relpath(path, self.raw_dir)
+                if rel in sigs:
+                    self.bundled[rel] = sigs[rel]
+                    f.write(f"{self.batch}\t{sigs[rel][0]}\t{sigs[rel][1]}\t{rel}\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        # OPTIONAL: Delete raw after bundle
+        if self.delete:
+            for path in bundled:
+                os.remove(path)
+
+        log(f"Batch {self.batch} complete. {len(bundled)} files bundled.")
+        return bundle
 
-            # OPTIONAL: Delete raw after bundle
-            # for f in selected: os.remove(f)
+    def _load(self):
+        # Bundles from before the log existed still count for numbering
+        if os.path.isdir(BUNDLE_DIR):
+            for name in os.listdir(BUNDLE_DIR):
+                if name.startswith("token_batch_") and name.endswith(".zip"):
+                    try:
+                        self.batch = max(self.batch, int(name[12:-4]))
+                    except ValueError:
+                        pass
 
-            log(f"Batch {batch} complete. {len(selected)} files bundled.")
+        try:
+            f = open(self.bundled_log, "r")
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t", 3)
+                if len(parts) != 4 or not line.endswith("\n"):
+                    continue  # torn last line
+                batch, mtime_ns, size, rel = parts
+                self.bundled[rel] = (int(mtime_ns), int(size))
+                self.batch = max(self.batch, int(batch))
 
-        time.sleep(3)
+def scan_and_bundle(delete=False, poll=False):
+    os.makedirs(RAW_DIR, exist_ok=True)
+    os.makedirs(BUNDLE_DIR, exist_ok=True)
+
+    watcher = DirWatcher(RAW_DIR, use_inotify=not poll)
+    bundler = Bundler(delete=delete)
+    bundler.rescan()
+    log(f"Watching {RAW_DIR} ({'polling' if watcher.polling else 'inotify'}), "
+        f"{len(bundler.pending)} files pending, last batch {bundler.batch}")
+
+    while True:
+        bundler.seal_ready()
+        changed = watcher.wait(bundler.due())
+        if changed is None:
+            bundler.rescan()
+        else:
+            for path in changed:
+                bundler.offer(path)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cart 083 - Infinity zip bundler")
+    parser.add_argument("--delete", action="store_true", help="remove raw files once bundled")
+    parser.add_argument("--poll", action="store_true", help="rescan every few seconds instead of inotify")
+    args = parser.parse_args()
+
+    os.makedirs(BUNDLE_DIR, exist_ok=True)
     log("∞ Infinity Zip Bundler Online ∞")
-    scan_and_bundle()
+    scan_and_bundle(args.delete, args.poll)
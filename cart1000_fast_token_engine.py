@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
-import os, hashlib, zipfile, time, random, json
+import os, hashlib, zipfile, time, random, json, argparse, struct, zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from archive_writer import ArchiveWriter
 
 MASTER_DIR = "zipcoins"
 MICRO_DIR = "zipcoins/micro"
 COUNT = 1000
+BATCH_SIZE = 256
 
 SOURCES = [
     "https://research.ibm.com/publications",
@@ -22,40 +26,42 @@ def ensure_dirs():
     os.makedirs(MASTER_DIR, exist_ok=True)
     os.makedirs(MICRO_DIR, exist_ok=True)
 
-def make_micro(i):
+STUB_SUMMARY = "AI research packet (fast-mode stub)."
+
+def make_micro(i, count=COUNT):
     url = random.choice(SOURCES)
     stub = {
         "source": url,
         "generated_at": time.time(),
-        "summary": "AI research packet (fast-mode stub).",
+        "summary": STUB_SUMMARY,
         "placeholder": True
     }
     data = json.dumps(stub).encode()
     sha = hashlib.sha256(data).hexdigest()
     out = os.path.join(MICRO_DIR, f"micro_{i:04d}_{sha}.zip")
 
-    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as z:
+    with ArchiveWriter(out) as z:
         z.writestr("meta.json", json.dumps(stub, indent=2))
 
-    print(f"[{i}/{COUNT}] {sha}")
+    print(f"[{i}/{count}] {sha}")
     return out, sha
 
-def main():
+def classic_main(count=COUNT):
     ensure_dirs()
     micro_paths = []
     combined_hash_data = ""
 
     print("∞ FAST MODE: FLYING SCROLL ONLINE ∞")
 
-    for i in range(1, COUNT + 1):
-        p, h = make_micro(i)
+    for i in range(1, count + 1):
+        p, h = make_micro(i, count)
         micro_paths.append(p)
         combined_hash_data += h
 
     master_hash = hashlib.sha256(combined_hash_data.encode()).hexdigest()
     master_path = os.path.join(MASTER_DIR, f"{master_hash}.zip")
 
-    with zipfile.ZipFile(master_path, "w", zipfile.ZIP_DEFLATED) as z:
+    with ArchiveWriter(master_path) as z:
         for p in micro_paths:
             z.write(p, arcname=os.path.basename(p))
 
@@ -64,5 +70,147 @@ def main():
     print("FILE:", master_path)
     print("==========================")
 
+# ---- BULK MODE ----
+# Stubs are built and hashed a batch at a time, micro zips are assembled in
+# memory and written by a thread pool, and the master takes the bytes
+# straight from memory instead of re-reading every micro file.
+
+def zip_one(name, data, date_time):
+    """
+    Return a zip archive holding just ``name`` -> ``data``, stored.
+
+    Byte-for-byte what zipfile writes for a single stored member, without
+    the ZipFile object and header rewrites that dominate the cost of a tiny
+    archive. Stubs are a few hundred bytes, too small to be worth deflating.
+    """
+    crc = zlib.crc32(data)
+    name = name.encode()
+    dostime, dosdate = date_time
+    local = struct.pack("<4s2B4HL2L2H", b"PK\x03\x04", 20, 0, 0, zipfile.ZIP_STORED,
+                        dostime, dosdate, crc, len(data), len(data), len(name), 0)
+    central = struct.pack("<4s4B4HL2L5H2L", b"PK\x01\x02", 20, 3, 20, 0, 0, zipfile.ZIP_STORED,
+                          dostime, dosdate, crc, len(data), len(data), len(name),
+                          0, 0, 0, 0, 0o600 << 16, 0)
+    offset = len(local) + len(name) + len(data)
+    end = struct.pack("<4s4H2LH", b"PK\x05\x06", 0, 0, 1, 1, len(central) + len(name), offset, 0)
+    return b"".join((local, name, data, central, name, end))
+
+def dos_date_time(t):
+    tm = time.localtime(t)
+    return ((tm.tm_hour << 11) | (tm.tm_min << 5) | (tm.tm_sec // 2),
+            ((tm.tm_year - 1980) << 9) | (tm.tm_mon << 5) | tm.tm_mday)
+
+_json_sources = {}
+_json_summary = json.dumps(STUB_SUMMARY)
+
+def stub_json(source, now):
+    """
+    Return make_micro's stub as (json.dumps(stub), json.dumps(stub, indent=2)),
+    formatted field by field instead of through the json encoder.
+    """
+    src = _json_sources.get(source)
+    if src is None:
+        src = _json_sources[source] = json.dumps(source)
+    ts = float.__repr__(now)  # how json.dumps writes a float
+    compact = (f'{{"source": {src}, "generated_at": {ts}, '
+               f'"summary": {_json_summary}, "placeholder": true}}')
+    pretty = (f'{{\n  "source": {src},\n  "generated_at": {ts},\n'
+              f'  "summary": {_json_summary},\n  "placeholder": true\n}}')
+    return compact, pretty
+
+def make_stub_batch(start, count):
+    """Return [(i, sha, micro_zip_bytes)] for micros start .. start+count-1."""
+    date_time = dos_date_time(time.time())
+    sha256 = hashlib.sha256
+    batch = []
+    for i in range(start, start + count):
+        compact, pretty = stub_json(random.choice(SOURCES), time.time())
+        sha = sha256(compact.encode()).hexdigest()
+        batch.append((i, sha, zip_one("meta.json", pretty.encode(), date_time)))
+    return batch
+
+class StreamOut:
+    """Write-only file view: zipfile then streams members instead of seeking back to patch headers."""
+
+    def __init__(self, f):
+        self.write = f.write
+        self.flush = f.flush
+
+def write_file(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+def bulk_main(count=COUNT, batch_size=BATCH_SIZE, workers=None, virtual=False):
+    """
+    Generate ``count`` micros and the master.
+
+    With virtual=True no micro files are written: the micros only exist as
+    members of the master, located through its index.json.
+    """
+    ensure_dirs()
+    print("∞ FAST MODE: FLYING SCROLL ONLINE (bulk) ∞")
+
+    master_sha = hashlib.sha256()
+    index = []
+    tmp_path = os.path.join(MASTER_DIR, f".flying-{os.getpid()}.zip.tmp")
+    try:
+        # Micros are stored as they are, only index.json is deflated
+        with open(tmp_path, "wb") as out, \
+                ArchiveWriter(StreamOut(out)) as master, \
+                ThreadPoolExecutor(max_workers=workers) as pool:
+            writes, pending = [], []
+            for start in range(1, count + 1, batch_size):
+                batch = make_stub_batch(start, min(batch_size, count + 1 - start))
+                for i, sha, data in batch:
+                    name = f"micro_{i:04d}_{sha}.zip"
+                    if not virtual:
+                        writes.append(pool.submit(write_file, os.path.join(MICRO_DIR, name), data))
+                    master.writestr(name, data)
+                    master_sha.update(sha.encode())
+                    index.append({"i": i, "sha": sha, "member": name})
+
+                # Let this batch's writes overlap the next batch, but no more
+                for w in pending:
+                    w.result()
+                pending, writes = writes, []
+                print(f"[{batch[-1][0]}/{count}] {batch[-1][1]}")
+
+            for w in pending:
+                w.result()
+
+            master.writestr("index.json", json.dumps({"count": len(index), "micros": index}))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    master_hash = master_sha.hexdigest()
+    master_path = os.path.join(MASTER_DIR, f"{master_hash}.zip")
+    os.replace(tmp_path, master_path)
+
+    print("\n=== MASTER TOKEN READY ===")
+    print("HASH:", master_hash)
+    print("FILE:", master_path)
+    print("==========================")
+    return master_hash, master_path
+
+def main():
+    parser = argparse.ArgumentParser(description="Cart 1000 - Infinity fast token engine")
+    parser.add_argument("--bulk", action="store_true",
+                        help="batch generation with pooled writes")
+    parser.add_argument("--virtual", action="store_true",
+                        help="keep micros only inside the master zip (implies --bulk)")
+    parser.add_argument("--count", type=int, default=COUNT)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="micro file writer threads (default: Python's choice)")
+    args = parser.parse_args()
+
+    if args.bulk or args.virtual:
+        bulk_main(args.count, max(1, args.batch_size), args.workers, args.virtual)
+        return
+
+    classic_main(args.count)
+
 if __name__ == "__main__":
     main()
@@ -4,14 +4,21 @@ import json
 import time
 import uuid
 import re
-import zipfile
-import subprocess
+import argparse
 from datetime import datetime, timezone
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 
-import requests
-from bs4 import BeautifulSoup
 from colorama import init, Fore, Style
 
+import git_sync
+from token_store import store_for
+from crawl_engine import Crawler, CONCURRENCY, PER_HOST
+from fetch_cache import fetch_text
+from html_extract import paragraph_text
+from blob_store import ManifestWriter, BLOBS_ENABLED
+from archive_writer import ArchiveWriter
+
 # ====================================================
 # CONFIG
 # ====================================================
@@ -21,6 +28,8 @@ TOKENS_DIR = os.path.join(BASE_DIR, "infinity_tokens")
 ZIPS_DIR = os.path.join(BASE_DIR, "infinity_zips")
 COUNTER_FILE = os.path.join(BASE_DIR, "infinity_token_counter.json")
 SOURCES_FILE = os.path.join(BASE_DIR, "research_sources.txt")
+# Headless notes: "<url><TAB><notes>" per line, may be appended to while running
+NOTES_FILE = os.path.join(BASE_DIR, "research_notes.tsv")
 
 MAX_SENTENCES = 14
 TOKENS_PER_BATCH = 1000
@@ -69,15 +78,10 @@ def save_counter(c):
 # ====================================================
 # AUTO GIT PUSH
 # ====================================================
-def git_push():
-    """Automatically commit + push everything to GitHub."""
+def git_push(paths):
+    """Queue changed paths; the git_sync.py daemon commits and pushes them to GitHub in batches."""
     try:
-        subprocess.run(["git","add","."], cwd=BASE_DIR)
-        subprocess.run([
-            "git","commit","-m",f"∞ Scroll update {datetime.now().isoformat()}"
-        ], cwd=BASE_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        subprocess.run(["git","push","origin","main"], cwd=BASE_DIR)
-        print(Fore.GREEN + "[GIT] Repo synced successfully.")
+        git_sync.submit(paths, repo=BASE_DIR)
     except Exception as e:
         print(Fore.RED + f"[GIT] FAILED: {e}")
 
@@ -95,19 +99,13 @@ def iter_sources():
             yield u
 
 def fetch(u):
-    try:
-        r = requests.get(u,headers={"User-Agent":"Infinity/1.0"},timeout=20)
-        r.raise_for_status()
-        return r.text
-    except:
-        return None
+    # Shared page cache: unchanged sources are not downloaded again
+    return fetch_text(u,headers={"User-Agent":"Infinity/1.0"},timeout=20)
 
 def extract(html):
     if not html:
         return ""
-    soup = BeautifulSoup(html,"html.parser")
-    paras = soup.find_all("p")
-    return " ".join([p.get_text(" ",strip=True) for p in paras])
+    return paragraph_text(html)
 
 def split_sentences(text):
     text = re.sub(r"\s+"," ",text)
@@ -123,16 +121,66 @@ def tier_for(v):
             t = name
     return t
 
-def flush_batch(batch, idx):
+def page_sentences(html):
+    """The sentences a capsule keeps from a page (picklable, for extraction workers)."""
+    sents = [s for s in split_sentences(extract(html)) if s]
+    if not sents:
+        sents = ["No extractable text was found at fetch time."]
+    return sents[:MAX_SENTENCES]
+
+def token_path(capsule):
+    return os.path.join(TOKENS_DIR,f"{capsule['hash']}.json")
+
+def make_capsule(url, sents):
+    toks = sum(token_est(s) for s in sents)
+    val = int(toks * VALUE_MULTIPLIER)
+    title = url.rsplit("/",1)[-1].replace("_"," ").upper()
+    return {
+        "hash":uuid.uuid4().hex,
+        "source":url,
+        "timestamp":datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC"),
+        "title":f"{title} – RESEARCH PAGE",
+        "sentences":sents,
+        "approx_tokens":toks,
+        "value":val,
+        "tier":tier_for(val)
+    }
+
+def record_capsule(capsule, counter, store, batch):
+    """Write the token, count it and add it to the batch; True once the batch should be sealed."""
+    before = counter["total_tokens"]
+    counter["total_capsules"] += 1
+    counter["total_tokens"] += capsule["approx_tokens"]
+
+    # write token json (frontend) + store (indexers)
+    with open(token_path(capsule),"w") as f:
+        json.dump(capsule,f,indent=2)
+    store.put(capsule)
+
+    batch.append(capsule)
+    # seal scroll each time the total crosses a TOKENS_PER_BATCH boundary
+    return counter["total_tokens"] // TOKENS_PER_BATCH > before // TOKENS_PER_BATCH
+
+def flush_batch(batch, idx, push=True):
     if not batch:
         return
     name = f"infinity_batch_{idx:05d}.zip"
     path = os.path.join(ZIPS_DIR,name)
-    with zipfile.ZipFile(path,"w",zipfile.ZIP_DEFLATED) as z:
+    if BLOBS_ENABLED:
+        # Manifest only; capsule JSON goes to the shared blob store
+        writer = ManifestWriter(path)
         for c in batch:
-            z.writestr(f"{c['hash']}.json",json.dumps(c,indent=2))
+            writer.add(f"{c['hash']}.json",json.dumps(c,indent=2))
+        changed = [writer.close()] + writer.new_objects
+    else:
+        changed = [path]
+        with ArchiveWriter(path) as z:
+            for c in batch:
+                z.writestr(f"{c['hash']}.json",json.dumps(c,indent=2))
     print(Fore.GREEN + f"[SCROLL SEALED] {name}")
-    git_push()
+    if push:
+        # The scroll, plus its tokens and the counter in case no one queued them yet
+        git_push(changed + [token_path(c) for c in batch] + [COUNTER_FILE])
 
 def pretty(c, counter, nxt):
     print(Fore.CYAN + "-"*72)
@@ -160,41 +208,16 @@ def pretty(c, counter, nxt):
 def main():
     ensure_dirs()
     counter = load_counter()
+    store = store_for(TOKENS_DIR)
     batch = []
 
     print(Fore.GREEN + "\n∞ Infinity Research Engine — ONLINE ∞\n")
 
     for url in iter_sources():
-        html = fetch(url)
-        text = extract(html)
-        sents = split_sentences(text)
-
-        if not sents:
-            sents = ["No extractable text was found at fetch time."]
-
-        sents = sents[:MAX_SENTENCES]
-
-        h = uuid.uuid4().hex
-        ts = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
-
-        toks = sum(token_est(s) for s in sents)
-        val = int(toks * VALUE_MULTIPLIER)
-        tier = tier_for(val)
-
-        title = url.rsplit("/",1)[-1].replace("_"," ").upper()
-
-        capsule = {
-            "hash":h,
-            "source":url,
-            "timestamp":ts,
-            "title":f"{title} – RESEARCH PAGE",
-            "sentences":sents,
-            "approx_tokens":toks,
-            "value":val,
-            "tier":tier
-        }
+        capsule = make_capsule(url, page_sentences(fetch(url)))
 
         try:
+            title = url.rsplit("/",1)[-1].replace("_"," ").upper()
             print(Fore.BLUE + f"\nAdd Infinity notes for {title} (Enter to skip):")
             notes = input("> ").strip()
             if notes:
@@ -202,27 +225,18 @@ def main():
         except:
             pass
 
-        counter["total_capsules"] += 1
-        counter["total_tokens"] += toks
-
+        seal = record_capsule(capsule, counter, store, batch)
         next_cutoff = ((counter["total_tokens"] // TOKENS_PER_BATCH)+1)*TOKENS_PER_BATCH
-
-        # write token json
-        path = os.path.join(TOKENS_DIR,f"{h}.json")
-        with open(path,"w") as f:
-            json.dump(capsule,f,indent=2)
-
-        batch.append(capsule)
         pretty(capsule,counter,next_cutoff)
 
         # seal scroll
-        if counter["total_tokens"] >= next_cutoff:
+        if seal:
             flush_batch(batch,counter["batch_index"])
             batch = []
             counter["batch_index"] += 1
 
         save_counter(counter)
-        git_push()
+        git_push([token_path(capsule), COUNTER_FILE])
         time.sleep(1)
 
     # flush remaining
@@ -231,8 +245,133 @@ def main():
         counter["batch_index"] += 1
 
     save_counter(counter)
+    git_push([COUNTER_FILE])
+    print(Fore.GREEN + "\n∞ Infinity Research Engine — COMPLETE ∞\n")
+
+# ====================================================
+# HEADLESS PIPELINE
+# ====================================================
+# Fetch (thread pool with per-host limits) -> extract (process pool) ->
+# write tokens -> seal batches, all overlapping. Nothing waits on stdin or
+# git per URL: notes come from NOTES_FILE and the repo is synced once per
+# sealed batch.
+
+# Stands in for a failed fetch, which still becomes a capsule
+FETCH_FAILED = "<!-- fetch failed -->"
+
+class NotesFile:
+    """Notes per source URL from a side file, re-read whenever it changes."""
+
+    def __init__(self, path=NOTES_FILE):
+        self.path = path
+        self.mtime = None
+        self.notes = {}
+
+    def get(self, url):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+        if mtime != self.mtime:
+            self.mtime = mtime
+            self.notes = {}
+            with open(self.path,"r") as f:
+                for line in f:
+                    u, _, text = line.rstrip("\n").partition("\t")
+                    if u.strip() and text.strip():
+                        self.notes[u.strip()] = text.strip()  # later lines win
+        return self.notes.get(url)
+
+def headless_main(concurrency=CONCURRENCY, per_host=PER_HOST, workers=1, notes_path=NOTES_FILE):
+    ensure_dirs()
+    counter = load_counter()
+    store = store_for(TOKENS_DIR)
+    notes = NotesFile(notes_path)
+    urls = list(iter_sources())
+    batch = []
+
+    print(Fore.GREEN + f"\n∞ Infinity Research Engine — HEADLESS ({len(urls)} sources) ∞\n")
+
+    def write(url, sents):
+        capsule = make_capsule(url, sents)
+        text = notes.get(url)
+        if text:
+            capsule["notes"] = text
+        seal = record_capsule(capsule, counter, store, batch)
+        print(Fore.CYAN + f"[{counter['total_capsules']}] {capsule['tier']} ${capsule['value']} {url}")
+        if seal:
+            flush_batch(batch,counter["batch_index"])
+            batch.clear()
+            counter["batch_index"] += 1
+        save_counter(counter)
+
+    pool = None
+    if workers > 1:
+        # spawn, not fork: the first page arrives while the crawler's fetch
+        # threads hold session, cache and stdio locks
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    in_flight = {}
+
+    def drain(block):
+        if block:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        else:
+            done = [fut for fut in in_flight if fut.done()]
+        for fut in done:
+            write(in_flight.pop(fut), fut.result())
+
+    def on_page(url, html):
+        if pool is None:
+            write(url, page_sentences(html))
+            return
+        # Keep the workers busy, but don't let pages pile up in memory
+        while len(in_flight) >= workers * 2:
+            drain(block=True)
+        in_flight[pool.submit(page_sentences, html)] = url
+        drain(block=False)
+
+    try:
+        crawler = Crawler(
+            fetch=lambda u: fetch(u) or FETCH_FAILED,
+            get_links=lambda html: (),
+            max_pages=len(urls),
+            concurrency=concurrency,
+            per_host=per_host,
+            on_page=on_page,
+            keep_pages=False
+        )
+        crawler.crawl(urls)
+        while in_flight:
+            drain(block=True)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    # flush remaining
+    if batch:
+        flush_batch(batch,counter["batch_index"])
+        counter["batch_index"] += 1
+
+    save_counter(counter)
+    git_push([COUNTER_FILE])
     print(Fore.GREEN + "\n∞ Infinity Research Engine — COMPLETE ∞\n")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Cart 1000 - Infinity research engine")
+    parser.add_argument("--headless", action="store_true",
+                        help="pipelined run: no notes prompt, git sync only when a scroll is sealed")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY,
+                        help="headless: fetches in flight overall (env CRAWL_CONCURRENCY)")
+    parser.add_argument("--per-host", type=int, default=PER_HOST,
+                        help="headless: fetches in flight per host (env CRAWL_PER_HOST)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="headless: extract pages in a pool of N processes (1 = inline)")
+    parser.add_argument("--notes", default=NOTES_FILE,
+                        help="headless: notes file, one \"<url><TAB><notes>\" per line")
+    args = parser.parse_args()
+
+    if args.headless:
+        headless_main(args.concurrency, args.per_host, args.workers, args.notes)
+    else:
+        main()
@@ -1,5 +1,12 @@
 #!/usr/bin/env python3
-import os, hashlib, zipfile, requests, time, random
+import os, io, hashlib, time, random, argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from crawl_engine import CONCURRENCY
+from fetch_cache import fetch_text
+from blob_store import ManifestWriter, BLOBS_ENABLED
+from archive_writer import ArchiveWriter
 
 # ---- CONFIG ----
 MASTER_DIR = "zipcoins"
@@ -27,52 +34,131 @@ def ensure_dirs():
     os.makedirs(MICRO_DIR, exist_ok=True)
 
 def fetch(url):
-    try:
-        ua = random.choice([
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64)",
-            "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)",
-            "Mozilla/5.0 (Linux; Android 10)",
-        ])
-        r = requests.get(url, timeout=TIMEOUT, headers={"User-Agent": ua})
-        if r.status_code == 200:
-            return r.text
-        return None
-    except:
-        return None
-
-def make_micro_zip(i, url, html):
-    path = os.path.join(MICRO_DIR, f"micro_{i:04d}.zip")
-    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
-        zf.writestr("source.txt", url)
-        zf.writestr("page.html", html)
-    return path
+    ua = random.choice([
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64)",
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)",
+        "Mozilla/5.0 (Linux; Android 10)",
+    ])
+    # The same few sources are asked for again and again: the shared cache
+    # answers repeats from disk and revalidates them once FETCH_TTL is up
+    return fetch_text(url, headers={"User-Agent": ua}, timeout=TIMEOUT)
 
-def main():
-    ensure_dirs()
-    micro_paths = []
-    print("∞ Building micro-research packets… ∞")
+def micro_members(url, html):
+    return [("source.txt", url), ("page.html", html)]
+
+def micro_zip_bytes(url, html):
+    buf = io.BytesIO()
+    with ArchiveWriter(buf) as zf:
+        for name, data in micro_members(url, html):
+            zf.writestr(name, data)
+    return buf.getvalue()
+
+def fetch_all(count, concurrency):
+    """Yield (i, url, html) in order, keeping up to ``concurrency`` fetches ahead."""
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pending = deque()
+        for i in range(1, count + 1):
+            url = random.choice(SOURCES)
+            pending.append((i, url, pool.submit(fetch, url)))
+            if len(pending) >= concurrency:
+                i0, url0, future = pending.popleft()
+                yield i0, url0, future.result()
+        while pending:
+            i0, url0, future = pending.popleft()
+            yield i0, url0, future.result()
+
+class MasterWriter:
+    """
+    Appends micro packets to the master zip as they arrive.
+
+    The master hash is SHA-256 over the hex of every micro zip in order, as
+    before, but fed incrementally; the master is written under a temp name
+    and renamed to <sha>.zip on close. With blobs enabled the micros become
+    nested entries of <sha>.zip.manifest.json, so repeated pages are stored
+    once.
+    """
 
-    for i in range(1, MICRO_COUNT + 1):
-        url = random.choice(SOURCES)
-        html = fetch(url)
+    def __init__(self, master_dir=MASTER_DIR, blobs=BLOBS_ENABLED):
+        self.master_dir = master_dir
+        self.sha = hashlib.sha256()
+        self.count = 0
+        self.manifest = self.zf = None
+        if blobs:
+            self.manifest = ManifestWriter()
+        else:
+            self.tmp_path = os.path.join(master_dir, f".fusing-{os.getpid()}.zip.tmp")
+            # Micro zips are stored as they are; html inside them is already deflated
+            self.zf = ArchiveWriter(self.tmp_path)
 
-        if not html:
-            print(f"[{i}/{MICRO_COUNT}] FAIL {url}")
-            continue
+    def add(self, name, data, members):
+        """Add micro zip ``data``, built from ``members`` (name, content) pairs."""
+        self.sha.update(data.hex().encode())
+        if self.manifest is not None:
+            self.manifest.add_zip(name, members)
+        else:
+            self.zf.writestr(name, data)
+        self.count += 1
 
-        z = make_micro_zip(i, url, html)
-        micro_paths.append(z)
-        print(f"[{i}/{MICRO_COUNT}] OK  {url}")
+    def close(self):
+        """Finish the master; returns (sha, master_path)."""
+        sha = self.sha.hexdigest()
+        master_path = os.path.join(self.master_dir, f"{sha}.zip")
+        if self.manifest is not None:
+            return sha, self.manifest.close(master_path)
+        self.zf.close()
+        os.replace(self.tmp_path, master_path)
+        return sha, master_path
 
-    print("\n∞ Fusing 1000 micro-zips into master token… ∞")
+    def abort(self):
+        # Blobs already stored stay unreferenced until gc
+        if self.zf is not None:
+            self.zf.close()
+            os.remove(self.tmp_path)
+
+def write_micro(name, members, data, manifest=None):
+    """Write a micro packet to MICRO_DIR, as a manifest if ``manifest`` (the master's) is one."""
+    path = os.path.join(MICRO_DIR, name)
+    if manifest is None:
+        with open(path, "wb") as f:
+            f.write(data)
+        return
+    micro = ManifestWriter(path, store=manifest.store)
+    for member, content in members:
+        micro.add(member, content)
+    micro.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Cart 1000 - Infinity master research fuser")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY,
+                        help="fetches in flight (env CRAWL_CONCURRENCY)")
+    parser.add_argument("--direct", action="store_true",
+                        help=f"write micro packets straight into the master, not {MICRO_DIR}/")
+    args = parser.parse_args()
+
+    ensure_dirs()
+    print("∞ Building micro-research packets… ∞")
+
+    # Fetch -> micro zip -> hash + append to master, one packet at a time
+    master = MasterWriter()
+    try:
+        for i, url, html in fetch_all(MICRO_COUNT, max(1, args.concurrency)):
+            if not html:
+                print(f"[{i}/{MICRO_COUNT}] FAIL {url}")
+                continue
 
-    combined = "".join(open(p, "rb").read().hex() for p in micro_paths)
-    sha = hashlib.sha256(combined.encode()).hexdigest()
-    master_path = os.path.join(MASTER_DIR, f"{sha}.zip")
+            members = micro_members(url, html)
+            data = micro_zip_bytes(url, html)
+            name = f"micro_{i:04d}.zip"
+            if not args.direct:
+                write_micro(name, members, data, master.manifest)
+            master.add(name, data, members)
+            print(f"[{i}/{MICRO_COUNT}] OK  {url}")
+    except BaseException:
+        master.abort()
+        raise
 
-    with zipfile.ZipFile(master_path, "w", zipfile.ZIP_DEFLATED) as zf:
-        for p in micro_paths:
-            zf.write(p, arcname=os.path.basename(p))
+    print(f"\n∞ Fused {master.count} micro-zips into master token ∞")
+    sha, master_path = master.close()
 
     print("\n=== TOKEN READY ===")
     print("Master Hash:", sha)
@@ -1,12 +1,11 @@
 #!/usr/bin/env python3
-import os, hashlib, zipfile, random, time, json
+import os, hashlib, random, time, json, argparse
 
-try:
-    import requests
-    from bs4 import BeautifulSoup
-except:
-    print("Run: pip install requests beautifulsoup4")
-    raise SystemExit(1)
+from crawl_engine import Crawler, CONCURRENCY, PER_HOST
+import fetch_cache
+from blob_store import ManifestWriter, BLOBS_ENABLED
+from archive_writer import ArchiveWriter
+from html_extract import page_links
 
 SAVE_DIR = "zipcoins"
 MAX_PAGES = 1000
@@ -40,10 +39,11 @@ def ensure_dirs():
 def fetch(url):
     try:
         print(f"[FETCH] {url}")
-        r = requests.get(url, headers=HEADERS(), timeout=TIMEOUT)
-        if r.status_code != 200:
+        # keep-alive sessions and the shared page cache
+        r = fetch_cache.fetch(url, headers=HEADERS(), timeout=TIMEOUT)
+        if r.status_code != 200 and not r.from_cache:
             print(f"[STATUS {r.status_code}] retrying with new User-Agent")
-            r = requests.get(url, headers=HEADERS(), timeout=TIMEOUT)
+            r = fetch_cache.fetch(url, headers=HEADERS(), timeout=TIMEOUT, refresh=True)
         if r.status_code == 200:
             return r.text
         print(f"[ERR] {url} -> status {r.status_code}")
@@ -53,69 +53,109 @@ def fetch(url):
         return None
 
 def get_links(html):
-    soup = BeautifulSoup(html, "html.parser")
-    links = []
-    for a in soup.find_all("a", href=True):
-        href = a["href"]
-        if href.startswith("http"):
-            links.append(href)
+    links = page_links(html)
     random.shuffle(links)
     return links[:15]
 
-def scrape():
-    pages = []
-    seen = set()
-    queue = list(SEED_SOURCES)
-
-    while len(pages) < MAX_PAGES and queue:
-        url = queue.pop(0)
-        if url in seen: 
-            continue
-        seen.add(url)
-
-        html = fetch(url)
-        if not html:
-            continue
-
-        pages.append((url, html))
-        print(f"[OK] {len(pages)}/{MAX_PAGES}")
-
-        for l in get_links(html):
-            if l not in seen:
-                queue.append(l)
-
-    return pages
-
-def build_zip(pages):
-    joined = "".join([html for (_, html) in pages])
-    sha = hashlib.sha256(joined.encode("utf-8")).hexdigest()
-    token_id = sha
-
-    zip_path = os.path.join(SAVE_DIR, f"{token_id}.zip")
-
-    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zf:
-        for i, (url, html) in enumerate(pages, start=1):
-            zf.writestr(f"page_{i:04d}.html", html)
-
+def scrape(concurrency=CONCURRENCY, per_host=PER_HOST, on_page=None):
+    """Crawl from SEED_SOURCES; pages go to on_page(url, html) if given, else are returned."""
+    def page(url, html):
+        if on_page:
+            on_page(url, html)
+        print(f"[OK] {crawler.count}/{MAX_PAGES}")
+
+    crawler = Crawler(
+        fetch, get_links, MAX_PAGES,
+        concurrency=concurrency, per_host=per_host,
+        on_page=page, keep_pages=on_page is None,
+    )
+    return crawler.crawl(SEED_SOURCES)
+
+class ZipPackager:
+    """
+    Writes pages into a zipcoin as they are fetched.
+
+    The token id is the SHA-256 of all pages in order, fed incrementally, so
+    no page has to stay in memory. The archive is built under a temp name and
+    renamed to <token_id>.zip on close; with blobs enabled, pages go to the
+    blob store and only <token_id>.zip.manifest.json is written.
+    """
+
+    def __init__(self, save_dir=SAVE_DIR, blobs=BLOBS_ENABLED, store=None):
+        self.save_dir = save_dir
+        self.sha = hashlib.sha256()
+        self.count = 0
+        self.manifest = self.zf = None
+        if blobs:
+            self.manifest = ManifestWriter(store=store)
+        else:
+            self.tmp_path = os.path.join(save_dir, f".building-{os.getpid()}.zip.tmp")
+            self.zf = ArchiveWriter(self.tmp_path)
+
+    def add(self, url, html):
+        data = html.encode("utf-8")
+        self.sha.update(data)
+        self.count += 1
+        self._write(f"page_{self.count:04d}.html", data)
+
+    def _write(self, name, data):
+        if self.manifest is not None:
+            self.manifest.add(name, data)
+        else:
+            self.zf.writestr(name, data)
+
+    def close(self):
+        """Finish the archive; returns (token_id, zip_path)."""
+        token_id = self.sha.hexdigest()
         manifest = {
             "token_id": token_id,
             "created_at": int(time.time()),
-            "count": len(pages)
+            "count": self.count
         }
-        zf.writestr("manifest.json", json.dumps(manifest, indent=2))
-
-    return token_id, zip_path
+        self._write("manifest.json", json.dumps(manifest, indent=2))
+
+        zip_path = os.path.join(self.save_dir, f"{token_id}.zip")
+        if self.manifest is not None:
+            return token_id, self.manifest.close(zip_path)
+        self.zf.close()
+        os.replace(self.tmp_path, zip_path)
+        return token_id, zip_path
+
+    def abort(self):
+        # Blobs already stored stay unreferenced until gc
+        if self.zf is not None:
+            self.zf.close()
+            os.remove(self.tmp_path)
+
+def build_zip(pages, **kwargs):
+    packager = ZipPackager(**kwargs)
+    for url, html in pages:
+        packager.add(url, html)
+    return packager.close()
 
 def main():
+    parser = argparse.ArgumentParser(description="Cart 1000 - Infinity research scraper")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY,
+                        help="fetches in flight overall (env CRAWL_CONCURRENCY)")
+    parser.add_argument("--per-host", type=int, default=PER_HOST,
+                        help="fetches in flight per host (env CRAWL_PER_HOST)")
+    args = parser.parse_args()
+
     ensure_dirs()
     print("∞ Infinity 403-Bypass Scraper Online ∞")
 
-    pages = scrape()
-    if not pages:
+    packager = ZipPackager()
+    try:
+        scrape(args.concurrency, args.per_host, on_page=packager.add)
+    except BaseException:
+        packager.abort()
+        raise
+    if not packager.count:
+        packager.abort()
         print("[!] No pages scraped. Aborting.")
         return
 
-    token, path = build_zip(pages)
+    token, path = packager.close()
 
     print("\n=== TOKEN READY ===")
     print("Token:", token)
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 import subprocess, os, time, sys
 
+import git_sync
+
 # Your REAL repo path
 REPO_PATH = "/data/data/com.termux/files/home/z"
 
@@ -21,17 +23,15 @@ def main():
     print("\n→ Checking git status…")
     run("git status")
 
-    print("\n→ Adding all files…")
-    run("git add -A")
-
     ts = time.strftime("%Y-%m-%d %H:%M:%S")
     commit_msg = f"AUTO-PUSH: {ts}"
 
-    print("\n→ Committing…")
-    run(f"git commit -m '{commit_msg}'")
-
-    print("\n→ Pushing to GitHub (origin/main)…")
-    run("git push origin main")
+    # Through the sync queue, so this never races the git_sync.py daemon;
+    # anything the carts queued goes into the same commit
+    print("\n→ Adding all files, committing and pushing…")
+    git_sync.submit([REPO_PATH], repo=REPO_PATH)
+    commit = git_sync.sync_now(REPO_PATH, commit_msg)
+    print(f"[GIT] {commit[:12]} committed" if commit else "[GIT] nothing to commit")
 
     print("\n∞ COMPLETE — Everything synced to GitHub ∞")
 
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Commit Log - Append-only, month-partitioned login commit log
+Part of the Pewpi Login / Infinity Research Portal
+
+Replaces the read-modify-write login_commits.json:
+
+    login_commits/2026-10.jsonl      one commit per line, for that UTC month
+    login_commits/users/<id>.idx     per-user index: (partition, offset, length)
+                                     records of 16 bytes, in append order
+    login_commits/archive/           partitions rotated out, gzipped
+
+Appending writes one line and one index record. "Latest N commits for a
+user" reads the last N index records from the end of that user's index
+and fetches just those lines, so both are independent of how many commits
+exist. Partitions older than keep_months are gzipped into archive/ when a
+new month starts, and the user indexes are rewritten without them.
+"""
+
+import os
+import json
+import gzip
+import shutil
+import struct
+import hashlib
+import datetime
+from datetime import timezone
+
+from pending_queue import FileLock
+
+# ------------------------------ CONFIG ------------------------------
+Z_ROOT = os.path.abspath(os.path.dirname(__file__))
+LOGIN_COMMITS_DIR = os.path.join(Z_ROOT, "login_commits")
+LEGACY_COMMITS_FILE = os.path.join(Z_ROOT, "login_commits.json")
+
+# Live months kept in the log; older partitions are archived
+KEEP_MONTHS = int(os.getenv("LOGIN_COMMITS_KEEP_MONTHS", 12))
+
+# partition (yyyymm), offset, length
+INDEX_RECORD = struct.Struct("<IQI")
+
+
+class CommitLog:
+    """Login commits partitioned by month with a per-user secondary index."""
+
+    def __init__(self, root=LOGIN_COMMITS_DIR, legacy_path=LEGACY_COMMITS_FILE,
+                 keep_months=KEEP_MONTHS, fsync=False):
+        """
+        Args:
+            root: Log directory
+            legacy_path: login_commits.json to import once, or None
+            keep_months: Months of partitions to keep live (0 keeps everything)
+            fsync: fsync partition and index after every append
+        """
+        self.root = root
+        self.users_dir = os.path.join(root, "users")
+        self.archive_dir = os.path.join(root, "archive")
+        self.lock_path = os.path.join(root, "lock")
+        self.keep_months = keep_months
+        self.fsync = fsync
+
+        os.makedirs(self.users_dir, exist_ok=True)
+        if legacy_path:
+            self._migrate_json(legacy_path)
+
+    # ------------------------------ PUBLIC API ------------------------------
+    def append(self, commit):
+        """Append a commit dict (with "username" and an ISO "timestamp")."""
+        self.append_many([commit])
+        return commit
+
+    def append_many(self, commits):
+        """Append commits in order, taking the lock once."""
+        with FileLock(self.lock_path):
+            self._append_commits(commits)
+
+    def latest(self, username, limit=50):
+        """Return the user's most recent commits, newest first."""
+        path = self._index_path(username)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return []
+
+        commits = []
+        partitions = {}
+        with f:
+            end = os.fstat(f.fileno()).st_size // INDEX_RECORD.size * INDEX_RECORD.size
+            while end > 0 and len(commits) < limit:
+                # Read the index backwards a batch of records at a time
+                start = max(0, end - (limit - len(commits)) * INDEX_RECORD.size)
+                f.seek(start)
+                data = f.read(end - start)
+                for pos in range(len(data) - INDEX_RECORD.size, -1, -INDEX_RECORD.size):
+                    partition, offset, length = INDEX_RECORD.unpack_from(data, pos)
+                    commit = self._read_commit(partitions, partition, offset, length)
+                    if commit is not None and commit.get("username") == username:
+                        commits.append(commit)
+                end = start
+        for pf in partitions.values():
+            if pf is not None:
+                pf.close()
+        return commits[:limit]
+
+    def iter_commits(self):
+        """Yield every live commit, oldest first."""
+        for name in sorted(os.listdir(self.root)):
+            if not name.endswith(".jsonl"):
+                continue
+            with open(os.path.join(self.root, name), "rb") as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue  # torn last line
+
+    def rotate(self, now=None):
+        """Archive partitions older than keep_months; returns the archived partitions."""
+        with FileLock(self.lock_path):
+            return self._rotate(self._partition_of(now))
+
+    # ------------------------------ INTERNALS ------------------------------
+    def _append_commits(self, commits, rotate=True):
+        """Append commits; caller holds the lock."""
+        for commit in commits:
+            partition = self._partition_of(commit.get("timestamp"))
+            if rotate and not os.path.exists(self._partition_path(partition)):
+                self._rotate(partition)
+
+            line = (json.dumps(commit, separators=(",", ":")) + "\n").encode("utf-8")
+            offset = self._append_bytes(self._partition_path(partition), line)
+            self._append_bytes(self._index_path(commit.get("username", "")),
+                               INDEX_RECORD.pack(partition, offset, len(line)))
+
+    def _rotate(self, current):
+        """Archive old partitions relative to ``current``; caller holds the lock."""
+        if not self.keep_months:
+            return []
+        year, month = divmod(current, 100)
+        months = year * 12 + month - 1 - self.keep_months
+        cutoff = (months // 12) * 100 + months % 12 + 1
+
+        old = sorted(p for p in self._partitions() if p <= cutoff)
+        if not old:
+            return []
+
+        os.makedirs(self.archive_dir, exist_ok=True)
+        for partition in old:
+            src = self._partition_path(partition)
+            dst = os.path.join(self.archive_dir, os.path.basename(src) + ".gz")
+            with open(src, "rb") as fin, gzip.open(dst + ".tmp", "wb") as fout:
+                shutil.copyfileobj(fin, fout)
+            os.replace(dst + ".tmp", dst)
+
+        # Drop index records into archived partitions before removing them
+        old_set = set(old)
+        for name in os.listdir(self.users_dir):
+            path = os.path.join(self.users_dir, name)
+            with open(path, "rb") as f:
+                data = f.read()
+            keep = b"".join(
+                data[pos:pos + INDEX_RECORD.size]
+                for pos in range(0, len(data) - INDEX_RECORD.size + 1, INDEX_RECORD.size)
+                if INDEX_RECORD.unpack_from(data, pos)[0] not in old_set
+            )
+            if not keep:
+                os.remove(path)
+            elif len(keep) != len(data):
+                with open(path + ".tmp", "wb") as f:
+                    f.write(keep)
+                os.replace(path + ".tmp", path)
+
+        for partition in old:
+            os.remove(self._partition_path(partition))
+        return old
+
+    def _read_commit(self, partitions, partition, offset, length):
+        if partition not in partitions:
+            try:
+                partitions[partition] = open(self._partition_path(partition), "rb")
+            except FileNotFoundError:
+                partitions[partition] = None  # archived meanwhile
+        pf = partitions[partition]
+        if pf is None:
+            return None
+        pf.seek(offset)
+        try:
+            return json.loads(pf.read(length))
+        except ValueError:
+            return None  # torn append
+
+    def _append_bytes(self, path, data):
+        """Append ``data`` and return the offset it was written at; caller holds the lock."""
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            offset = os.fstat(fd).st_size
+            os.write(fd, data)
+            if self.fsync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        return offset
+
+    def _partitions(self):
+        parts = []
+        for name in os.listdir(self.root):
+            if name.endswith(".jsonl"):
+                try:
+                    parts.append(int(name[:-6].replace("-", "")))
+                except ValueError:
+                    continue
+        return parts
+
+    @staticmethod
+    def _partition_of(timestamp):
+        """yyyymm of an ISO timestamp (or now)."""
+        if timestamp:
+            try:
+                return int(str(timestamp)[:4]) * 100 + int(str(timestamp)[5:7])
+            except ValueError:
+                pass
+        now = datetime.datetime.now(timezone.utc)
+        return now.year * 100 + now.month
+
+    def _partition_path(self, partition):
+        return os.path.join(self.root, f"{partition // 100:04d}-{partition % 100:02d}.jsonl")
+
+    def _index_path(self, username):
+        digest = hashlib.sha1(str(username).encode("utf-8")).hexdigest()
+        return os.path.join(self.users_dir, f"{digest}.idx")
+
+    # ------------------------------ MIGRATION ------------------------------
+    def _migrate_json(self, legacy_path):
+        """Import commits from a legacy login_commits.json once."""
+        marker = os.path.join(self.root, ".migrated")
+        if os.path.exists(marker) or not os.path.exists(legacy_path):
+            return
+
+        with FileLock(self.lock_path):
+            if os.path.exists(marker):
+                return
+            try:
+                with open(legacy_path, "r") as f:
+                    commits = json.load(f).get("commits", [])
+            except (OSError, ValueError, AttributeError):
+                commits = []
+            commits = sorted((c for c in commits if isinstance(c, dict)),
+                             key=lambda c: c.get("timestamp", ""))
+
+            # Legacy commits are imported as-is, without rotating them away
+            self._append_commits(commits, rotate=False)
+            with open(marker, "w") as f:
+                f.write(legacy_path + "\n")
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Crawl Engine - Concurrent breadth-first crawler with per-host limits
+Part of the Pewpi Login / Infinity Research Portal
+
+Replaces the serial fetch loop in cart1000_research_scraper. The frontier
+is a deque walked in BFS order; up to ``concurrency`` fetches run at once on
+a thread pool, but never more than ``per_host`` against the same host.
+URLs whose host is busy are parked and resumed as soon as a slot on that
+host frees up, so a slow site does not hold the other workers hostage.
+
+Semantics match the serial loop: a URL is added to ``seen`` when it is
+taken off the frontier (whether or not the fetch succeeds), links are only
+queued if not yet seen, and no more than ``max_pages`` pages are fetched
+or returned.
+
+Each worker thread keeps its own requests.Session (see get_session), so
+connections to a host are reused across pages instead of reopened.
+"""
+
+import os
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+    REQUESTS_AVAILABLE = True
+except ImportError:
+    REQUESTS_AVAILABLE = False
+
+# ------------------------------ CONFIG ------------------------------
+# Fetches in flight across all hosts
+CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", 16))
+# Fetches in flight against any one host
+PER_HOST = int(os.getenv("CRAWL_PER_HOST", 2))
+
+_local = threading.local()
+
+
+def get_session():
+    """Return this thread's keep-alive requests.Session."""
+    if not REQUESTS_AVAILABLE:
+        raise RuntimeError("crawl_engine.get_session requires requests (pip install requests)")
+    s = getattr(_local, "session", None)
+    if s is None:
+        s = requests.Session()
+        adapter = HTTPAdapter(pool_connections=PER_HOST * 4, pool_maxsize=PER_HOST)
+        s.mount("http://", adapter)
+        s.mount("https://", adapter)
+        _local.session = s
+    return s
+
+
+def host_of(url):
+    """Politeness key of a URL: its scheme and network location."""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc.lower()}"
+
+
+class Crawler:
+    """Breadth-first crawl over a thread pool."""
+
+    def __init__(self, fetch, get_links, max_pages, concurrency=CONCURRENCY,
+                 per_host=PER_HOST, on_page=None, keep_pages=True):
+        """
+        Args:
+            fetch: Callable(url) -> page text, or None on failure; called from worker threads
+            get_links: Callable(text) -> iterable of absolute URLs to queue
+            max_pages: Stop after this many pages were fetched successfully
+            concurrency: Fetches in flight overall
+            per_host: Fetches in flight per host
+            on_page: Optional callable(url, text) for each page, in fetch order
+            keep_pages: Collect (url, text) pages; turn off when on_page consumes
+                them, so memory stays flat however long the crawl
+        """
+        self.fetch = fetch
+        self.get_links = get_links
+        self.max_pages = max_pages
+        self.concurrency = max(1, concurrency)
+        self.per_host = max(1, per_host)
+        self.on_page = on_page
+        self.keep_pages = keep_pages
+
+        self.seen = set()
+        self.pages = []
+        self.count = 0
+        self.frontier = deque()
+        self._parked = defaultdict(deque)
+        self._active = defaultdict(int)
+
+    def crawl(self, seeds):
+        """Crawl from ``seeds``; returns the (url, text) pages in fetch order if keep_pages."""
+        self.frontier.extend(seeds)
+        in_flight = {}
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            while True:
+                # Never have more fetches out than pages still wanted
+                while (len(in_flight) < self.concurrency
+                       and self.count + len(in_flight) < self.max_pages):
+                    nxt = self._next_url()
+                    if nxt is None:
+                        break
+                    url, host = nxt
+                    self.seen.add(url)
+                    self._active[host] += 1
+                    in_flight[pool.submit(self.fetch, url)] = (url, host)
+
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url, host = in_flight.pop(future)
+                    self._release(host)
+                    try:
+                        text = future.result()
+                    except Exception:
+                        text = None  # fetch is expected to report its own errors
+                    if text and self.count < self.max_pages:
+                        self._keep(url, text)
+
+        return self.pages
+
+    # ------------------------------ INTERNALS ------------------------------
+    def _next_url(self):
+        """Pop the next unseen URL whose host has a free slot, parking the rest."""
+        while self.frontier:
+            url = self.frontier.popleft()
+            if url in self.seen:
+                continue
+            host = host_of(url)
+            if self._active[host] >= self.per_host:
+                self._parked[host].append(url)
+                continue
+            return url, host
+        return None
+
+    def _release(self, host):
+        self._active[host] -= 1
+        parked = self._parked.get(host)
+        # Resume the host where it left off, ahead of newer links
+        while parked:
+            url = parked.popleft()
+            if url not in self.seen:
+                self.frontier.appendleft(url)
+                break
+        if host in self._parked and not parked:
+            del self._parked[host]
+
+    def _keep(self, url, text):
+        self.count += 1
+        if self.keep_pages:
+            self.pages.append((url, text))
+        if self.on_page:
+            self.on_page(url, text)
+        for link in self.get_links(text):
+            if link not in self.seen:
+                self.frontier.append(link)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Dir Watcher - Wait for files to appear in a directory tree
+Part of the Pewpi Login / Infinity Research Portal
+
+On Linux (including Termux) this uses inotify through libc, so an idle
+watcher costs nothing: wait() blocks until a file is finished (closed after
+writing or renamed into place) or removed anywhere under the root, and
+returns those paths. New subdirectories are watched as they appear.
+
+Without inotify, or when the kernel's event queue overflowed, wait() sleeps
+for the poll interval and returns None, meaning "rescan the tree"; callers
+must be able to work from a full scan anyway.
+"""
+
+import os
+import time
+import errno
+import select
+import struct
+
+# inotify is Linux-only; CDLL(None) resolves symbols from the already-loaded libc
+try:
+    import ctypes
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _libc.inotify_init1.argtypes = [ctypes.c_int]
+    _libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    INOTIFY_AVAILABLE = True
+except (ImportError, OSError, AttributeError):
+    INOTIFY_AVAILABLE = False
+
+# ------------------------------ CONFIG ------------------------------
+POLL_INTERVAL = 3.0
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, name length
+
+
+class DirWatcher:
+    """Reports files finished or removed under a directory tree."""
+
+    def __init__(self, root, poll_interval=POLL_INTERVAL, use_inotify=True):
+        """
+        Args:
+            root: Directory to watch, recursively
+            poll_interval: Seconds between rescans when inotify is unavailable
+            use_inotify: Set False to force the polling fallback
+        """
+        self.root = root
+        self.poll_interval = poll_interval
+        self.fd = None
+        self._dirs = {}
+
+        if use_inotify and INOTIFY_AVAILABLE:
+            fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd >= 0:
+                self.fd = fd
+                for dirpath, _, _ in os.walk(root):
+                    self._watch(dirpath)
+
+    @property
+    def polling(self):
+        return self.fd is None
+
+    def wait(self, timeout=None):
+        """
+        Block until something changes or ``timeout`` seconds pass.
+
+        Returns:
+            A list of changed file paths (possibly empty on timeout), or None
+            if the caller should rescan the whole tree
+        """
+        if self.fd is None:
+            delay = self.poll_interval if timeout is None else min(timeout, self.poll_interval)
+            time.sleep(max(0.0, delay))
+            return None
+
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        return self._read_events()
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    # ------------------------------ INTERNALS ------------------------------
+    def _watch(self, dirpath):
+        if self.fd is None:
+            return
+        wd = _libc.inotify_add_watch(self.fd, os.fsencode(dirpath), WATCH_MASK)
+        if wd >= 0:
+            self._dirs[wd] = dirpath
+        elif ctypes.get_errno() not in (errno.ENOENT, errno.ENOTDIR):
+            # Out of watches (fs.inotify.max_user_watches): fall back to polling
+            self.close()
+
+    def _read_events(self):
+        changed = []
+        rescan = False
+        while self.fd is not None:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, pos)
+                pos += EVENT_HEADER.size
+                name = os.fsdecode(data[pos:pos + length].rstrip(b"\0"))
+                pos += length
+
+                if mask & IN_Q_OVERFLOW:
+                    rescan = True
+                    continue
+                if mask & IN_IGNORED:
+                    self._dirs.pop(wd, None)
+                    continue
+                dirpath = self._dirs.get(wd)
+                if dirpath is None or not name:
+                    continue
+
+                path = os.path.join(dirpath, name)
+                if mask & IN_ISDIR:
+                    if mask & (IN_MOVED_FROM | IN_DELETE):
+                        rescan = True  # files under it went with it
+                    elif mask & (IN_CREATE | IN_MOVED_TO):
+                        # Files may have landed before the watch was in place
+                        for sub, _, files in os.walk(path):
+                            self._watch(sub)
+                            changed.extend(os.path.join(sub, f) for f in files)
+                    continue
+                if mask & IN_CREATE:
+                    continue  # still being written; IN_CLOSE_WRITE follows
+                changed.append(path)
+
+        if rescan or self.fd is None:
+            return None
+        return changed
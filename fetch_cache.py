@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Fetch Cache - Shared, on-disk HTTP cache for the scraper carts
+Part of the Pewpi Login / Infinity Research Portal
+
+Every cart fetched with a bare requests.get: a fresh connection per page
+and the full page every time, although the fuser alone asks the same ten
+sources for their pages about a hundred times a run. FetchCache sits in
+front of crawl_engine's keep-alive sessions:
+
+    fresh      fetched or revalidated less than ttl seconds ago: served
+               from disk, no request at all
+    stale      revalidated with If-None-Match / If-Modified-Since; a 304
+               costs a round trip but no body
+    failed     non-200 answers and errors are remembered for negative_ttl
+               seconds, so a dead source is not retried on every call
+
+Entries live under fetch_cache/<ab>/<sha256(url)>.json (status, validators,
+encoding, times) with the zlib-compressed body next to it in .body. Writes
+are atomic renames, so threads and processes can share one cache. Threads
+asking for the same URL at once wait for the first one's answer instead of
+all fetching it. A stale page is still served when refreshing it fails.
+
+    python fetch_cache.py {stats|prune DAYS|clear}
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import shutil
+import hashlib
+import threading
+
+from crawl_engine import get_session
+
+# ------------------------------ CONFIG ------------------------------
+Z_ROOT = os.path.abspath(os.path.dirname(__file__))
+FETCH_CACHE_DIR = os.getenv("FETCH_CACHE_DIR", os.path.join(Z_ROOT, "fetch_cache"))
+# Set FETCH_CACHE=0 to always go to the network
+FETCH_CACHE_ENABLED = os.getenv("FETCH_CACHE", "1") != "0"
+# Seconds a page is served without asking the server again
+FETCH_TTL = int(os.getenv("FETCH_TTL", 3600))
+# Seconds a failed URL is not retried
+FETCH_NEGATIVE_TTL = int(os.getenv("FETCH_NEGATIVE_TTL", 300))
+# Locks shared out between URLs; two URLs rarely wait on the same one
+FETCH_LOCK_STRIPES = 64
+
+
+class CachedResponse:
+    """The parts of a requests.Response the carts use."""
+
+    def __init__(self, url, status_code, content=b"", encoding=None, from_cache=False):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.encoding = encoding
+        self.from_cache = from_cache
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or "utf-8", "replace")
+
+
+class FetchCache:
+    """Conditional-GET page cache with negative caching."""
+
+    def __init__(self, root=FETCH_CACHE_DIR, ttl=FETCH_TTL, negative_ttl=FETCH_NEGATIVE_TTL,
+                 enabled=FETCH_CACHE_ENABLED):
+        """
+        Args:
+            root: Cache directory
+            ttl: Seconds a cached page is served without revalidating
+            negative_ttl: Seconds a failure is served without retrying
+            enabled: False passes every call straight to the network
+        """
+        self.root = root
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.enabled = enabled
+        self.stats = {"fresh": 0, "revalidated": 0, "fetched": 0, "failed": 0, "negative": 0}
+        # A fixed set, so a long crawl does not grow one lock per URL
+        self._locks = [threading.Lock() for _ in range(FETCH_LOCK_STRIPES)]
+
+    def get(self, url, headers=None, timeout=20, refresh=False):
+        """
+        GET ``url`` through the cache.
+
+        Args:
+            refresh: Skip the ttl and negative_ttl windows and ask the server
+
+        Returns:
+            CachedResponse; status_code is 0 when the request raised
+        """
+        if not self.enabled:
+            return self._request(url, headers, timeout)
+        with self._locks[zlib.crc32(url.encode("utf-8")) % len(self._locks)]:
+            return self._get(url, headers, timeout, refresh)
+
+    def prune(self, max_age):
+        """Remove entries not checked for ``max_age`` seconds; returns how many."""
+        removed = 0
+        cutoff = time.time() - max_age
+        for path in self._meta_paths():
+            try:
+                with open(path, "r") as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                meta = {}
+            if max(meta.get("checked_at") or 0, meta.get("failed_at") or 0) < cutoff:
+                for p in (path, path[:-5] + ".body"):
+                    if os.path.exists(p):
+                        os.remove(p)
+                removed += 1
+        return removed
+
+    # ------------------------------ INTERNALS ------------------------------
+    def _get(self, url, headers, timeout, refresh):
+        now = time.time()
+        meta = self._load(url)
+        if meta and not refresh:
+            if meta.get("failed_at") and now - meta["failed_at"] < self.negative_ttl:
+                self.stats["negative"] += 1
+                if meta.get("checked_at"):
+                    return self._cached(url, meta)  # stale, but better than nothing
+                return CachedResponse(url, meta["failed_status"], from_cache=True)
+            if meta.get("checked_at") and now - meta["checked_at"] < self.ttl:
+                self.stats["fresh"] += 1
+                return self._cached(url, meta)
+
+        headers = dict(headers or {})
+        if meta and meta.get("checked_at"):
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        try:
+            r = get_session().get(url, headers=headers, timeout=timeout)
+        except Exception:
+            return self._failed(url, meta, 0, now)
+
+        if r.status_code == 304 and meta and meta.get("checked_at"):
+            self.stats["revalidated"] += 1
+            meta["checked_at"] = now
+            meta.pop("failed_at", None)
+            self._save_meta(url, meta)
+            return self._cached(url, meta)
+        if r.status_code != 200:
+            return self._failed(url, meta, r.status_code, now)
+
+        self.stats["fetched"] += 1
+        # What r.text would decode with, so cached and live text agree
+        encoding = r.encoding or r.apparent_encoding
+        meta = {
+            "url": url,
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+            "encoding": encoding,
+            "checked_at": now,
+        }
+        self._save_body(url, r.content)
+        self._save_meta(url, meta)
+        return CachedResponse(url, 200, r.content, encoding)
+
+    def _request(self, url, headers, timeout):
+        try:
+            r = get_session().get(url, headers=headers, timeout=timeout)
+        except Exception:
+            return CachedResponse(url, 0)
+        return CachedResponse(url, r.status_code, r.content, r.encoding or r.apparent_encoding)
+
+    def _failed(self, url, meta, status, now):
+        self.stats["failed"] += 1
+        meta = meta or {"url": url}
+        meta["failed_at"] = now
+        meta["failed_status"] = status
+        self._save_meta(url, meta)
+        if meta.get("checked_at"):
+            return self._cached(url, meta)
+        return CachedResponse(url, status)
+
+    def _cached(self, url, meta):
+        try:
+            with open(self._path(url, ".body"), "rb") as f:
+                content = zlib.decompress(f.read())
+        except (OSError, zlib.error):
+            return CachedResponse(url, 0, from_cache=True)
+        return CachedResponse(url, 200, content, meta.get("encoding"), from_cache=True)
+
+    def _path(self, url, suffix):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, key[:2], key + suffix)
+
+    def _load(self, url):
+        try:
+            with open(self._path(url, ".json"), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_meta(self, url, meta):
+        self._write(self._path(url, ".json"), json.dumps(meta).encode("utf-8"))
+
+    def _save_body(self, url, content):
+        self._write(self._path(url, ".body"), zlib.compress(content, 6))
+
+    @staticmethod
+    def _write(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{time.monotonic_ns()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _meta_paths(self):
+        if not os.path.isdir(self.root):
+            return
+        for shard in sorted(os.listdir(self.root)):
+            shard_dir = os.path.join(self.root, shard)
+            if os.path.isdir(shard_dir):
+                for name in os.listdir(shard_dir):
+                    if name.endswith(".json"):
+                        yield os.path.join(shard_dir, name)
+
+
+_cache = None
+
+
+def get_cache():
+    """Process-wide FetchCache (recreated if FETCH_CACHE_DIR changes)."""
+    global _cache
+    if _cache is None or _cache.root != FETCH_CACHE_DIR:
+        _cache = FetchCache(FETCH_CACHE_DIR)
+    return _cache
+
+
+def fetch(url, headers=None, timeout=20, refresh=False):
+    """GET ``url`` through the shared cache; returns a CachedResponse."""
+    return get_cache().get(url, headers, timeout, refresh)
+
+
+def fetch_text(url, headers=None, timeout=20):
+    """Page text of ``url`` through the shared cache, or None unless it answered 200."""
+    r = fetch(url, headers, timeout)
+    return r.text if r.status_code == 200 else None
+
+
+# ------------------------------ CLI ------------------------------
+def main(argv=None):
+    """python fetch_cache.py {stats|prune DAYS|clear}"""
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] not in ("stats", "prune", "clear"):
+        print(f"Usage: {os.path.basename(__file__)} {{stats|prune DAYS|clear}}")
+        return 1
+
+    cache = get_cache()
+    if argv[0] == "stats":
+        entries = size = 0
+        for path in cache._meta_paths():
+            entries += 1
+            body = path[:-5] + ".body"
+            size += os.path.getsize(path) + (os.path.getsize(body) if os.path.exists(body) else 0)
+        print(f"[∞] {entries} URLs, {size / 1e6:.1f} MB in {cache.root}")
+    elif argv[0] == "prune":
+        days = float(argv[1]) if len(argv) > 1 else 30
+        print(f"[∞] {cache.prune(days * 86400)} entries removed")
+    else:
+        shutil.rmtree(cache.root, ignore_errors=True)
+        print(f"[∞] {cache.root} cleared")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
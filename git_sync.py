@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Git Sync - Batched commits and pushes for the carts
+Part of the Pewpi Login / Infinity Research Portal
+
+The carts used to run `git add .`, `git commit` and `git push` themselves,
+some after every token, and every `git add .` rescanned the whole tree.
+Now they post the paths they changed (files or directories, including
+removed ones):
+
+    git_sync.submit([token_path, zip_path], repo=BASE_DIR)
+
+to a PendingQueue in the repo's .git directory, and one daemon per repo
+
+    python git_sync.py [--repo DIR] [--window SECONDS] [--max-paths N]
+
+turns everything submitted within a window, or as soon as max_paths are
+waiting, into a single commit that stages only those paths, then pushes.
+One-shot carts call sync_now() to commit what they queued right away; it
+takes the same lock as the daemon.
+
+A path is acknowledged just before it is staged, so a change submitted
+while a commit is being made is queued again rather than lost; if staging
+or committing fails the paths are put back. A failed push is retried
+every window until it goes through.
+"""
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+from datetime import datetime
+from urllib.parse import quote, unquote
+
+from pending_queue import PendingQueue, FileLock
+
+# ------------------------------ CONFIG ------------------------------
+Z_ROOT = os.path.abspath(os.path.dirname(__file__))
+SYNC_REPO = os.getenv("GIT_SYNC_REPO", Z_ROOT)
+# Seconds from the first queued path to the commit
+WINDOW = float(os.getenv("GIT_SYNC_WINDOW", 30))
+# Commit early once this many paths are queued
+MAX_PATHS = int(os.getenv("GIT_SYNC_MAX_PATHS", 500))
+# Remote to push to after each commit ("" to only commit)
+REMOTE = os.getenv("GIT_SYNC_REMOTE", "origin")
+POLL_INTERVAL = 1.0
+
+_queues = {}
+
+
+def queue_path(repo):
+    """Where ``repo``'s submission queue lives: inside .git, so it is never committed."""
+    git_dir = os.path.join(repo, ".git")
+    if os.path.isdir(git_dir):
+        return os.path.join(git_dir, "sync_queue.log")
+    return os.path.join(repo, ".git_sync_queue.log")
+
+
+def open_queue(repo):
+    repo = os.path.abspath(repo)
+    queue = _queues.get(repo)
+    if queue is None:
+        queue = _queues[repo] = PendingQueue(queue_path(repo))
+    return queue
+
+
+def submit(paths, repo=SYNC_REPO):
+    """
+    Queue changed or removed paths for the next sync commit of ``repo``.
+
+    Paths outside the repo are skipped, as `git add .` would. Returns the
+    number of paths queued.
+    """
+    repo = os.path.abspath(repo)
+    records = []
+    for path in paths:
+        rel = os.path.relpath(os.path.abspath(path), repo)
+        if rel == ".." or rel.startswith(".." + os.sep):
+            continue
+        # Queue records are ASCII lines
+        records.append(quote(rel.replace(os.sep, "/"), safe="/"))
+    return open_queue(repo).enqueue(records)
+
+
+def sync_now(repo=SYNC_REPO, message=None, remote=REMOTE):
+    """Commit (and push) whatever is queued for ``repo`` now; returns the commit id or None."""
+    return GitSync(repo, remote=remote).sync(message)
+
+
+class GitSync:
+    """Turns queued paths into batched commits of just those paths."""
+
+    def __init__(self, repo=SYNC_REPO, window=WINDOW, max_paths=MAX_PATHS, remote=REMOTE):
+        """
+        Args:
+            repo: Work tree to commit in
+            window: Seconds to gather paths after the first one is queued
+            max_paths: Commit before the window ends once this many are queued
+            remote: Remote to push HEAD to after committing, or "" / None
+        """
+        self.repo = os.path.abspath(repo)
+        self.window = window
+        self.max_paths = max_paths
+        self.remote = remote
+        self.queue = open_queue(self.repo)
+        self.lock_path = self.queue.path + ".sync"
+
+        self.first_seen = None
+        self.unpushed = False
+        self.retry_at = 0.0
+
+    def poll(self, now=None):
+        """Commit if the window is over or enough paths wait; returns the commit id, if one was made."""
+        now = time.time() if now is None else now
+        pending = self.queue.pending()
+        if not pending:
+            self.first_seen = None
+            if self.unpushed and now >= self.retry_at:
+                self.push(now)
+            return None
+
+        if self.first_seen is None:
+            self.first_seen = now
+        if len(pending) < self.max_paths and now - self.first_seen < self.window:
+            return None
+        return self.sync(now=now)
+
+    def sync(self, message=None, now=None):
+        """Commit everything queued, then push; returns the commit id or None."""
+        with FileLock(self.lock_path):
+            pending = self.queue.pending()
+            self.first_seen = None
+            commit = None
+            if pending:
+                self.queue.ack(pending)
+                try:
+                    commit = self._commit([unquote(p) for p in pending], message)
+                except BaseException:
+                    self.queue.enqueue(pending)
+                    raise
+            if commit:
+                self.unpushed = True
+
+        if self.unpushed:
+            self.push(now)
+        return commit
+
+    def push(self, now=None):
+        """Push HEAD to the remote; True once it is there."""
+        if not self.remote:
+            self.unpushed = False
+            return True
+        result = self._git(["push", "-q", self.remote, "HEAD"], check=False)
+        if result.returncode != 0:
+            self.retry_at = (time.time() if now is None else now) + self.window
+            print(f"[GIT] push failed, retrying in {self.window:g}s: {result.stderr.strip()}")
+            return False
+        self.unpushed = False
+        return True
+
+    def run(self, poll_interval=POLL_INTERVAL):
+        """Sync forever; whatever is queued is committed on Ctrl-C."""
+        print(f"∞ Git sync online: {self.repo} (window {self.window:g}s, max {self.max_paths} paths)")
+        try:
+            while True:
+                try:
+                    commit = self.poll()
+                    if commit:
+                        print(f"[GIT] {commit[:12]} committed")
+                except RuntimeError as e:
+                    print(f"[GIT] {e}")
+                time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            self.sync()
+
+    # ------------------------------ INTERNALS ------------------------------
+    def _commit(self, paths, message):
+        present, removed = [], []
+        for p in paths:
+            (present if os.path.lexists(os.path.join(self.repo, p)) else removed).append(p)
+
+        if present:
+            result = self._git(["add", "-A", "--pathspec-from-file=-", "--pathspec-file-nul"],
+                               stdin="\0".join(present), check=False)
+            # Explicitly listed ignored files are skipped, everything else is an error
+            if result.returncode != 0 and "ignored by one of your .gitignore" not in result.stderr:
+                raise RuntimeError(f"git add failed: {result.stderr.strip()}")
+        if removed:
+            self._git(["rm", "-r", "-q", "--cached", "--ignore-unmatch",
+                       "--pathspec-from-file=-", "--pathspec-file-nul"], stdin="\0".join(removed))
+
+        if self._git(["diff", "--cached", "--quiet"], check=False).returncode == 0:
+            return None
+        message = message or f"∞ Sync {len(paths)} paths {datetime.now().isoformat(timespec='seconds')}"
+        self._git(["commit", "-q", "-m", message])
+        return self._git(["rev-parse", "HEAD"]).stdout.strip()
+
+    def _git(self, args, stdin=None, check=True):
+        # Queued paths are file names, never globs
+        result = subprocess.run(["git", "--literal-pathspecs", "-C", self.repo, *args],
+                                input=stdin, capture_output=True, text=True)
+        if check and result.returncode != 0:
+            raise RuntimeError(f"git {args[0]} failed: {result.stderr.strip()}")
+        return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Commit and push the paths carts queue, in batches")
+    parser.add_argument("--repo", default=SYNC_REPO, help="work tree (env GIT_SYNC_REPO)")
+    parser.add_argument("--window", type=float, default=WINDOW,
+                        help="seconds to gather paths per commit (env GIT_SYNC_WINDOW)")
+    parser.add_argument("--max-paths", type=int, default=MAX_PATHS,
+                        help="commit early at this many paths (env GIT_SYNC_MAX_PATHS)")
+    parser.add_argument("--remote", default=REMOTE, help="remote to push to, '' to only commit")
+    parser.add_argument("--once", action="store_true", help="commit what is queued now and exit")
+    args = parser.parse_args(argv)
+
+    sync = GitSync(args.repo, args.window, args.max_paths, args.remote)
+    if args.once:
+        commit = sync.sync()
+        print(f"[GIT] {commit[:12]} committed" if commit else "[GIT] nothing to commit")
+        return 0
+    sync.run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
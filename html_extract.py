@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+HTML Extract - One-pass paragraph, link and text extraction
+Part of the Pewpi Login / Infinity Research Portal
+
+The scrapers used to build a full BeautifulSoup tree per page just to read
+the <p> text and the <a href> links back out of it. PageExtractor is an
+html.parser event handler that collects both while the page streams
+through it, with no tree at all:
+
+    paragraphs   text of each <p>, as p.get_text(" ", strip=True)
+    links        <a href> values that are absolute http(s) URLs, in page
+                 order; with a base_url, relative ones are resolved too
+    text()       visible text outside <script>/<style>, one line per block
+
+Script and style contents never count as text. A <p> opened inside another
+ends it, as browsers do.
+
+    python html_extract.py [PATH...]
+
+benchmarks the extractor on the .html members of the archives under PATH
+(default zipcoins/), and against BeautifulSoup when it is installed.
+"""
+
+import sys
+import time
+import argparse
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+try:
+    from bs4 import BeautifulSoup
+    BS4_AVAILABLE = True
+except ImportError:
+    BS4_AVAILABLE = False
+
+# ------------------------------ CONFIG ------------------------------
+# Pages are fed to the parser in chunks of this many characters, so
+# extraction that only needs the start of a page can stop early
+CHUNK_SIZE = 64 * 1024
+
+SKIP_TAGS = {"script", "style", "template", "noscript"}
+BLOCK_TAGS = {"p", "div", "br", "li", "ul", "ol", "tr", "table", "section", "article",
+              "header", "footer", "h1", "h2", "h3", "h4", "h5", "h6", "blockquote",
+              "pre", "title", "dd", "dt", "hr"}
+
+
+class PageExtractor(HTMLParser):
+    """Collects paragraphs, links and visible text from HTML fed to it."""
+
+    def __init__(self, base_url=None, max_text=None):
+        """
+        Args:
+            base_url: Resolve relative links against this URL; without it only
+                absolute http(s) links are kept
+            max_text: Stop once this many characters of visible text were seen
+        """
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.max_text = max_text
+        self.paragraphs = []
+        self.links = []
+        self.done = False
+
+        self._skip = 0
+        self._para = None
+        self._text = []
+        self._text_len = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self._skip += 1
+            return
+        if tag in BLOCK_TAGS:
+            self._break()
+        if tag == "p":
+            self._end_paragraph()
+            self._para = []
+        elif tag == "a":
+            for name, value in attrs:
+                if name == "href" and value:
+                    self._add_link(value)
+                    break
+
+    def handle_startendtag(self, tag, attrs):
+        # <br/>, <a href=... /> and friends never hold text
+        self.handle_starttag(tag, attrs)
+        if tag in SKIP_TAGS:
+            self._skip -= 1
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self._skip = max(0, self._skip - 1)
+            return
+        if tag == "p":
+            self._end_paragraph()
+        if tag in BLOCK_TAGS:
+            self._break()
+
+    def handle_data(self, data):
+        if self._skip:
+            return
+        stripped = data.strip()
+        if not stripped:
+            return
+        if self._para is not None:
+            self._para.append(stripped)
+        self._text.append(data)
+        self._text_len += len(data)
+        if self.max_text is not None and self._text_len >= self.max_text:
+            self.done = True
+
+    def close(self):
+        super().close()
+        self._end_paragraph()
+
+    def text(self):
+        """Visible text, whitespace collapsed within lines, one line per block."""
+        lines = (" ".join(line.split()) for line in "".join(self._text).split("\n"))
+        text = "\n".join(line for line in lines if line)
+        return text[:self.max_text] if self.max_text is not None else text
+
+    # ------------------------------ INTERNALS ------------------------------
+    def _end_paragraph(self):
+        if self._para is not None:
+            self.paragraphs.append(" ".join(self._para))
+            self._para = None
+
+    def _break(self):
+        if self._text and self._text[-1] != "\n":
+            self._text.append("\n")
+
+    def _add_link(self, href):
+        href = href.strip()
+        if self.base_url:
+            href = urljoin(self.base_url, href)
+        if href.startswith(("http://", "https://")):
+            self.links.append(href)
+
+
+def extract_page(html, base_url=None, max_text=None):
+    """Run ``html`` through a PageExtractor and return it."""
+    page = PageExtractor(base_url, max_text)
+    if html:
+        for start in range(0, len(html), CHUNK_SIZE):
+            page.feed(html[start:start + CHUNK_SIZE])
+            if page.done:
+                break
+    page.close()
+    return page
+
+
+def paragraph_text(html):
+    """All <p> text of a page joined by spaces."""
+    return " ".join(extract_page(html).paragraphs)
+
+
+def page_links(html, base_url=None):
+    """Absolute http(s) links of a page, in order."""
+    return extract_page(html, base_url).links
+
+
+def visible_text(html, limit=None):
+    """Visible text of a page, at most ``limit`` characters."""
+    return extract_page(html, max_text=limit).text()
+
+
+# ------------------------------ BENCHMARK ------------------------------
+def soup_extract(html):
+    """The BeautifulSoup path this module replaces: (paragraph text, absolute links)."""
+    soup = BeautifulSoup(html, "html.parser")
+    text = " ".join(p.get_text(" ", strip=True) for p in soup.find_all("p"))
+    links = [a["href"] for a in soup.find_all("a", href=True) if a["href"].startswith("http")]
+    return text, links
+
+
+def fast_extract(html):
+    page = extract_page(html)
+    return " ".join(page.paragraphs), page.links
+
+
+def benchmark(pages, repeat=1):
+    """
+    Time both extractors over ``pages``.
+
+    Returns:
+        {name: (seconds, matches)}; matches counts pages whose paragraph text
+        and links equal the BeautifulSoup result (None without bs4)
+    """
+    extractors = {"html_extract": fast_extract}
+    if BS4_AVAILABLE:
+        extractors["beautifulsoup"] = soup_extract
+
+    results, outputs = {}, {}
+    for name, fn in extractors.items():
+        start = time.perf_counter()
+        for _ in range(repeat):
+            outputs[name] = [fn(html) for html in pages]
+        results[name] = time.perf_counter() - start
+
+    reference = outputs.get("beautifulsoup")
+    return {
+        name: (seconds, None if reference is None else
+               sum(a == b for a, b in zip(outputs[name], reference)))
+        for name, seconds in results.items()
+    }
+
+
+def main(argv=None):
+    from archive_writer import iter_payloads
+
+    parser = argparse.ArgumentParser(description="Benchmark HTML extraction against BeautifulSoup")
+    parser.add_argument("paths", nargs="*", default=["zipcoins"], help="archives or directories")
+    parser.add_argument("--repeat", type=int, default=1, help="passes over the pages")
+    args = parser.parse_args(argv)
+
+    pages = [data.decode("utf-8", "replace") for name, data in iter_payloads(args.paths)
+             if name.lower().endswith((".html", ".htm"))]
+    if not pages:
+        print("No .html pages found")
+        return 1
+
+    size = sum(len(p) for p in pages) * args.repeat
+    print(f"{len(pages)} pages, {size / 1e6:.2f} MB")
+    if not BS4_AVAILABLE:
+        print("(beautifulsoup4 not installed: timing html_extract only)")
+    for name, (seconds, matches) in benchmark(pages, args.repeat).items():
+        same = "" if matches is None else f"  same result on {matches}/{len(pages)} pages"
+        print(f"{name:<14} {seconds:8.2f}s {size / 1e6 / seconds:8.1f} MB/s{same}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
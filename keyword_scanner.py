@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Keyword Scanner - Compiled multi-keyword matcher shared by the token scorers
+Part of the Pewpi Login / Infinity Research Portal
+
+Built once from a keyword table, then used to count every keyword in a text
+with a single scan. Counts follow ``str.count`` semantics (non-overlapping
+occurrences per keyword, scanned left to right) so swapping it in for the old
+per-keyword loops leaves scores unchanged.
+"""
+
+# Try to import pyahocorasick, fall back to per-keyword counting if not available
+try:
+    import ahocorasick
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    AHOCORASICK_AVAILABLE = False
+
+
+class KeywordScanner:
+    """Counts occurrences of a fixed keyword set in lower-cased text."""
+
+    def __init__(self, keywords, use_automaton=None):
+        """
+        Compile the scanner.
+
+        Args:
+            keywords: Iterable of keywords (dict keys are fine); matched lower-cased
+            use_automaton: Force the Aho-Corasick automaton on/off, defaults to
+                using it whenever pyahocorasick is installed
+        """
+        self.keywords = tuple(dict.fromkeys(k.lower() for k in keywords if k))
+        self.max_length = max((len(k) for k in self.keywords), default=0)
+        # Keywords whose hits can overlap each other ("aa" in "aaa") need
+        # positional tracking when counted across chunk boundaries
+        self._self_overlapping = frozenset(
+            k for k in self.keywords
+            if any(k[:i] == k[-i:] for i in range(1, len(k)))
+        )
+
+        if use_automaton is None:
+            use_automaton = AHOCORASICK_AVAILABLE
+        self._automaton = None
+        if use_automaton and self.keywords:
+            self._automaton = ahocorasick.Automaton()
+            for keyword in self.keywords:
+                self._automaton.add_word(keyword, keyword)
+            self._automaton.make_automaton()
+
+    def count(self, text):
+        """
+        Count keyword occurrences in ``text``.
+
+        Args:
+            text: Lower-cased text to scan
+
+        Returns:
+            Dict of keyword -> count for keywords that occur, in keyword order
+        """
+        if self._automaton is None:
+            counts = {}
+            for keyword in self.keywords:
+                n = text.count(keyword)
+                if n:
+                    counts[keyword] = n
+            return counts
+
+        found = {}
+        next_start = {}
+        for end, keyword in self._automaton.iter(text):
+            start = end - len(keyword) + 1
+            # str.count never lets two hits of the same keyword overlap
+            if start >= next_start.get(keyword, 0):
+                found[keyword] = found.get(keyword, 0) + 1
+                next_start[keyword] = end + 1
+
+        return {k: found[k] for k in self.keywords if k in found}
+
+    def present(self, text):
+        """
+        Return the set of keywords that occur at least once in ``text``.
+
+        Args:
+            text: Lower-cased text to scan
+        """
+        if self._automaton is None:
+            return {k for k in self.keywords if k in text}
+
+        seen = set()
+        for _, keyword in self._automaton.iter(text):
+            seen.add(keyword)
+            if len(seen) == len(self.keywords):
+                break
+        return seen
+
+    def stream(self):
+        """Return a KeywordStream that counts keywords over text fed in chunks."""
+        return KeywordStream(self)
+
+
+class KeywordStream:
+    """
+    Incremental keyword counter for text that arrives in chunks.
+
+    Keeps the last ``max_length - 1`` characters of the previous chunk so that
+    keywords straddling a chunk boundary are still counted exactly once.
+    """
+
+    def __init__(self, scanner):
+        self.scanner = scanner
+        self._found = {}
+        self._next_start = {}
+        self._tail = ""
+        self._offset = 0
+
+    def feed(self, chunk):
+        """Scan the next lower-cased chunk of text."""
+        if not chunk:
+            return
+
+        window = self._tail + chunk
+        window_start = self._offset - len(self._tail)
+        boundary = len(self._tail)
+
+        if self.scanner._automaton is not None:
+            for end, keyword in self.scanner._automaton.iter(window):
+                if end < boundary:
+                    continue  # seen in full with the previous chunk
+                start = window_start + end - len(keyword) + 1
+                if start >= self._next_start.get(keyword, 0):
+                    self._found[keyword] = self._found.get(keyword, 0) + 1
+                    self._next_start[keyword] = start + len(keyword)
+        else:
+            for keyword in self.scanner.keywords:
+                pos = max(boundary - len(keyword) + 1, 0)
+                if keyword not in self.scanner._self_overlapping:
+                    n = window.count(keyword, pos)
+                else:
+                    pos = max(pos, self._next_start.get(keyword, 0) - window_start)
+                    n = 0
+                    while True:
+                        i = window.find(keyword, pos)
+                        if i < 0:
+                            break
+                        n += 1
+                        pos = i + len(keyword)
+                    if n:
+                        self._next_start[keyword] = window_start + pos
+                if n:
+                    self._found[keyword] = self._found.get(keyword, 0) + n
+
+        keep = self.scanner.max_length - 1
+        self._tail = window[-keep:] if keep > 0 else ""
+        self._offset += len(chunk)
+
+    def counts(self):
+        """Return keyword -> count for keywords seen so far, in keyword order."""
+        return {k: self._found[k] for k in self.scanner.keywords if k in self._found}
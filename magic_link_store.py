@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Magic Link Store - Expiry-indexed one-time login tokens
+Part of the Pewpi Login / Infinity Research Portal
+
+send_magic_link kept tokens in a dict with ISO expiry strings and parsed
+every one of them on every request to find the expired ones, so issuing a
+link cost O(outstanding links). Used tokens were only flagged, never
+removed. Here expiry is an epoch float, and expired tokens are found
+through an index ordered by expiry:
+
+    MemoryMagicLinkStore   dict + min-heap of (expires_at, token); one process
+    SQLiteMagicLinkStore   table indexed on expires_at, shared by every
+                           worker process using the file; it keeps only a
+                           SHA-256 of each token, as tokens are credentials
+
+issue and consume are O(log n) and take expired tokens off the front of
+the index as they go. A consumed token is deleted at once, so a second use
+is simply an unknown token.
+
+The auth server picks one through shared_state.SharedState (STATE_BACKEND).
+"""
+
+import os
+import time
+import heapq
+import hashlib
+import secrets
+import threading
+
+from shared_state import sqlite_connection
+
+# ------------------------------ CONFIG ------------------------------
+# Seconds a link stays valid
+MAGIC_LINK_TTL = int(os.getenv("MAGIC_LINK_TTL", 15 * 60))
+# Expired tokens removed per issue at most, so a burst of expiries is spread out
+PURGE_BATCH = 64
+
+# consume() outcomes
+VALID = "valid"
+INVALID = "invalid"
+EXPIRED = "expired"
+
+
+def new_token():
+    return secrets.token_urlsafe(32)
+
+
+class MemoryMagicLinkStore:
+    """Outstanding magic-link tokens of one process."""
+
+    def __init__(self, ttl=MAGIC_LINK_TTL, clock=time.time):
+        """
+        Args:
+            ttl: Seconds a token stays valid
+            clock: Epoch seconds source (injectable for tests)
+        """
+        self.ttl = ttl
+        self.clock = clock
+        self._tokens = {}   # token -> (email, expires_at)
+        self._expiry = []   # heap of (expires_at, token); consumed tokens linger until popped
+        self._lock = threading.Lock()
+
+    def issue(self, email, ttl=None):
+        """Create a token for ``email``; returns (token, expires_at)."""
+        with self._lock:
+            now = self.clock()
+            self._purge(now, PURGE_BATCH)
+            token = new_token()
+            expires_at = now + (self.ttl if ttl is None else ttl)
+            self._tokens[token] = (email, expires_at)
+            heapq.heappush(self._expiry, (expires_at, token))
+            return token, expires_at
+
+    def consume(self, token):
+        """
+        Use up ``token``.
+
+        Returns:
+            (VALID, email), (EXPIRED, email) or (INVALID, None); the token is
+            gone afterwards in every case
+        """
+        with self._lock:
+            entry = self._tokens.pop(token, None)
+            if entry is None:
+                return INVALID, None
+            email, expires_at = entry
+            if self.clock() > expires_at:
+                return EXPIRED, email
+            return VALID, email
+
+    def purge(self):
+        """Remove every expired token; returns how many."""
+        with self._lock:
+            return self._purge(self.clock())
+
+    def __len__(self):
+        return len(self._tokens)
+
+    # ------------------------------ INTERNALS ------------------------------
+    def _purge(self, now, limit=None):
+        removed = 0
+        expiry, tokens = self._expiry, self._tokens
+        while expiry and expiry[0][0] < now and (limit is None or removed < limit):
+            expires_at, token = heapq.heappop(expiry)
+            entry = tokens.get(token)
+            if entry is not None and entry[1] == expires_at:
+                del tokens[token]
+                removed += 1
+        # Consumed tokens leave stale heap entries behind; rebuild once they dominate
+        if len(expiry) > 2 * len(tokens) + 1024:
+            self._expiry = [(expires_at, t) for t, (_, expires_at) in tokens.items()]
+            heapq.heapify(self._expiry)
+        return removed
+
+
+class SQLiteMagicLinkStore:
+    """Outstanding magic-link tokens in a SQLite table shared between processes."""
+
+    def __init__(self, path, ttl=MAGIC_LINK_TTL, clock=time.time, timeout=5.0):
+        """
+        Args:
+            path: Database file; created if missing
+            ttl: Seconds a token stays valid
+            clock: Epoch seconds source, the same for every process
+            timeout: Seconds to wait for another process's write
+        """
+        self.path = path
+        self.ttl = ttl
+        self.clock = clock
+        self.timeout = timeout
+        self._local = threading.local()
+
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS magic_links "
+                       "(token_hash BLOB PRIMARY KEY, email TEXT NOT NULL, expires_at REAL NOT NULL) "
+                       "WITHOUT ROWID")
+            db.execute("CREATE INDEX IF NOT EXISTS magic_links_expiry ON magic_links (expires_at)")
+
+    def issue(self, email, ttl=None):
+        """Create a token for ``email``; returns (token, expires_at)."""
+        now = self.clock()
+        token = new_token()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            self._purge(db, now, PURGE_BATCH)
+            db.execute("INSERT INTO magic_links (token_hash, email, expires_at) VALUES (?, ?, ?)",
+                       (self._hash(token), email, expires_at))
+        return token, expires_at
+
+    def consume(self, token):
+        """As MemoryMagicLinkStore.consume; only one process can use a token."""
+        with self._connect() as db:
+            row = db.execute("DELETE FROM magic_links WHERE token_hash = ? RETURNING email, expires_at",
+                             (self._hash(token),)).fetchone()
+        if row is None:
+            return INVALID, None
+        email, expires_at = row
+        if self.clock() > expires_at:
+            return EXPIRED, email
+        return VALID, email
+
+    def purge(self):
+        """Remove every expired token; returns how many."""
+        with self._connect() as db:
+            return self._purge(db, self.clock())
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM magic_links").fetchone()[0]
+
+    # ------------------------------ INTERNALS ------------------------------
+    def _connect(self):
+        return sqlite_connection(self._local, self.path, self.timeout)
+
+    @staticmethod
+    def _hash(token):
+        return hashlib.sha256(token.encode("utf-8")).digest()
+
+    @staticmethod
+    def _purge(db, now, limit=-1):
+        return db.execute("DELETE FROM magic_links WHERE token_hash IN (SELECT token_hash FROM magic_links "
+                          "WHERE expires_at < ? ORDER BY expires_at LIMIT ?)", (now, limit)).rowcount
+
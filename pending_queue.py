@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Pending Queue - Append-only log of token hashes waiting for valuation
+Part of the Pewpi Login / Infinity Research Portal
+
+Replaces the read-modify-write session_buffer.json shared by build_token and
+the router -> buffer -> valuator carts (080, 081, 082).
+
+Log format, one record per line:
+    +<hash>   token queued
+    -<hash>   token valuated (acknowledged)
+
+Writers append whole records under an exclusive lock and fsync, so
+concurrent builders never lose entries and a crash can at worst leave one
+torn last record, which readers skip and the next writer truncates. A cursor file remembers the byte offset
+before which every queued hash has been acknowledged; compaction rewrites
+the log as just the pending records. The cursor is only an optimisation: replaying the log from offset 0
+always gives the same pending set.
+"""
+
+import os
+import json
+
+# fcntl is POSIX-only; without it writers are not serialised across processes
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+# ------------------------------ CONFIG ------------------------------
+Z_ROOT = os.path.abspath(os.path.dirname(__file__))
+SESSION_LOG = os.path.join(Z_ROOT, "session_buffer.log")
+
+# Only consider compaction once the log is at least this many bytes
+COMPACT_THRESHOLD = 1 << 20
+
+
+class PendingQueue:
+    """Durable FIFO of token hashes shared by token builders and the valuator."""
+
+    def __init__(self, path=SESSION_LOG, fsync=True, compact_threshold=COMPACT_THRESHOLD):
+        """
+        Open (or create) the queue.
+
+        Args:
+            path: Log file path; the cursor and lock live next to it
+            fsync: fsync after every append (disable only for tests/scratch queues)
+            compact_threshold: Log size from which mostly-acknowledged logs are compacted
+        """
+        self.path = path
+        self.cursor_path = path + ".cursor"
+        self.lock_path = path + ".lock"
+        self.fsync = fsync
+        self.compact_threshold = compact_threshold
+        self._maintained_size = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._migrate_json_buffer()
+
+    # ------------------------------ PUBLIC API ------------------------------
+    def enqueue(self, token_hashes):
+        """
+        Queue token hashes for valuation with a single append.
+
+        Returns:
+            Number of records written
+        """
+        return self._append("+", token_hashes)
+
+    def ack(self, token_hashes):
+        """
+        Mark token hashes as valuated so they leave the pending set.
+
+        Every compact_threshold / 4 bytes of log growth this also advances the
+        cursor past the fully acknowledged prefix and compacts the log once it
+        is past compact_threshold and mostly acknowledged.
+
+        Returns:
+            Number of records written
+        """
+        written = self._append("-", token_hashes)
+        # Replaying is O(log), so only do upkeep once the log has grown a bit
+        if written and self._size() - self._maintained_size >= max(self.compact_threshold // 4, 1):
+            with self._locked():
+                pending, first_offset = self._replay()
+                size = self._size()
+                cursor = first_offset if pending else size
+                if cursor > self._read_cursor():
+                    self._write_cursor(cursor)
+
+                # Compact once most of the log is acknowledged records
+                live = sum(len(h) + 2 for h in pending)
+                if size >= self.compact_threshold and size - live >= size // 2:
+                    self._compact(pending)
+                self._maintained_size = self._size()
+        return written
+
+    def pending(self):
+        """Return queued hashes not yet acknowledged, oldest first, without duplicates."""
+        with self._locked():
+            pending, _ = self._replay()
+        return list(pending)
+
+    def __len__(self):
+        return len(self.pending())
+
+    def compact(self):
+        """Rewrite the log keeping only pending hashes."""
+        with self._locked():
+            self._compact(self._replay()[0])
+
+    # ------------------------------ LOG I/O ------------------------------
+    def _append(self, op, token_hashes):
+        records = []
+        for token_hash in token_hashes:
+            token_hash = str(token_hash).strip()
+            if not token_hash or "\n" in token_hash:
+                raise ValueError(f"Invalid token hash: {token_hash!r}")
+            records.append(f"{op}{token_hash}\n")
+        if not records:
+            return 0
+
+        with self._locked():
+            self._write_records("".join(records).encode("ascii"))
+        return len(records)
+
+    def _write_records(self, data):
+        """Append encoded records; caller holds the lock."""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            # Drop a record torn by an earlier crash before appending after it
+            size = os.fstat(fd).st_size
+            if size and os.pread(fd, 1, size - 1) != b"\n":
+                os.ftruncate(fd, self._last_record_end(fd, size))
+            os.write(fd, data)
+            if self.fsync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _last_record_end(fd, size):
+        """Offset just past the last complete record in the log."""
+        end = size
+        while end > 0:
+            start = max(0, end - 4096)
+            pos = os.pread(fd, end - start, start).rfind(b"\n")
+            if pos >= 0:
+                return start + pos + 1
+            end = start
+        return 0
+
+    def _replay(self):
+        """
+        Replay the log from the cursor; caller holds the lock.
+
+        Returns:
+            (pending, first_offset): ordered dict of pending hashes and the byte
+            offset of the oldest pending record
+        """
+        pending = {}
+        offsets = {}
+        if not os.path.exists(self.path):
+            return pending, 0
+
+        with open(self.path, "rb") as f:
+            offset = self._read_cursor()
+            f.seek(offset)
+            for line in f:
+                line_offset = offset
+                offset += len(line)
+                if not line.endswith(b"\n") or len(line) < 3:
+                    continue  # torn or empty record
+                op, token_hash = line[:1], line[1:-1].decode("ascii", "replace")
+                if op == b"+":
+                    if token_hash not in pending:
+                        pending[token_hash] = True
+                        offsets[token_hash] = line_offset
+                elif op == b"-":
+                    pending.pop(token_hash, None)
+                    offsets.pop(token_hash, None)
+
+        first_offset = min(offsets.values()) if offsets else 0
+        return pending, first_offset
+
+    def _compact(self, pending):
+        """Rewrite the log as just the pending records; caller holds the lock."""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write("".join(f"+{h}\n" for h in pending).encode("ascii"))
+            f.flush()
+            os.fsync(f.fileno())
+
+        # Reset the cursor first: offset 0 is valid for both old and new log
+        self._write_cursor(0)
+        os.replace(tmp_path, self.path)
+        self._fsync_dir()
+
+    def _size(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def _read_cursor(self):
+        try:
+            with open(self.cursor_path, "r") as f:
+                cursor = int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+        # A cursor past the end belongs to a log that has since been replaced
+        return cursor if cursor <= self._size() else 0
+
+    def _write_cursor(self, cursor):
+        tmp_path = self.cursor_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(cursor))
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self.cursor_path)
+
+    def _fsync_dir(self):
+        if not self.fsync or not hasattr(os, "O_DIRECTORY"):
+            return
+        fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _locked(self):
+        return FileLock(self.lock_path)
+
+    # ------------------------------ MIGRATION ------------------------------
+    def _migrate_json_buffer(self):
+        """Move hashes from a legacy session_buffer.json next to the log into it."""
+        legacy_path = os.path.splitext(self.path)[0] + ".json"
+        if legacy_path == self.path or not os.path.exists(legacy_path):
+            return
+
+        with self._locked():
+            if not os.path.exists(legacy_path):
+                return
+            try:
+                with open(legacy_path, "r") as f:
+                    pending = json.load(f).get("pending", [])
+            except (OSError, ValueError, AttributeError):
+                return
+            records = "".join(f"+{str(h).strip()}\n" for h in pending if str(h).strip())
+            if records:
+                self._write_records(records.encode("ascii"))
+            os.replace(legacy_path, legacy_path + ".migrated")
+
+
+class FileLock:
+    """Exclusive advisory lock on a side file (flock is per open file, so threads serialise too)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def __enter__(self):
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        if FCNTL_AVAILABLE:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if FCNTL_AVAILABLE:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
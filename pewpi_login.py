@@ -255,6 +255,7 @@ if __name__ == "__main__":
 
 """
 pewpi_login.py - Pewpi Infinity Research Portal Login and Token Management
+"""
 
 
 # ============================================================================
@@ -271,6 +272,10 @@ import re
 import html
 from typing import Dict, List, Optional, Tuple, Any
 
+from keyword_scanner import KeywordScanner
+from research_indexer import IncrementalIndexer, IndexSource
+from token_store import iter_tokens, export_token
+
 # ------------------------------ CONFIG ------------------------------
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 CATEGORY_TOKENS_FILE = os.path.join(ROOT_DIR, "category_tokens.json")
@@ -378,6 +383,7 @@ class TokenHashManager:
         self.categories: Dict[str, Dict] = {}
         self.color_map: Dict[str, str] = {}
         self.token_to_category: Dict[str, str] = {}
+        self._keyword_scanner: Optional[KeywordScanner] = None
         self._load_config()
     
     def _load_config(self) -> None:
@@ -577,19 +583,31 @@ class TokenHashManager:
         Returns:
             Best matching category name, defaults to 'data'
         """
-        text_lower = text.lower()
+        found = self._get_keyword_scanner().present(text.lower())
         best_match = "data"
         best_score = 0
         
         for cat_name, cat_data in self.categories.items():
             keywords = cat_data.get("keywords", [])
-            score = sum(1 for kw in keywords if kw.lower() in text_lower)
+            score = sum(1 for kw in keywords if kw.lower() in found)
             if score > best_score:
                 best_score = score
                 best_match = cat_name
         
         logger.debug(f"Text categorized as '{best_match}' with score {best_score}")
         return best_match
+    
+    def _get_keyword_scanner(self) -> KeywordScanner:
+        """Return a scanner over all category keywords, recompiled if they changed."""
+        keywords = tuple(dict.fromkeys(
+            kw.lower()
+            for cat_data in self.categories.values()
+            for kw in cat_data.get("keywords", [])
+            if kw
+        ))
+        if self._keyword_scanner is None or self._keyword_scanner.keywords != keywords:
+            self._keyword_scanner = KeywordScanner(keywords)
+        return self._keyword_scanner
 
 
 # ------------------------------ BUTTON GENERATOR ------------------------------
@@ -1088,18 +1106,13 @@ class ResearchIndexSyncer:
             logger.warning(f"Tokens directory not found: {self.tokens_dir}")
             return tokens
         
-        for fname in os.listdir(self.tokens_dir):
-            if not fname.endswith(".json"):
+        # Tokens packed in the store are read sequentially; only loose files are parsed
+        for fname, data in iter_tokens(self.tokens_dir):
+            if data is None:
+                logger.warning(f"Failed to load token {fname}")
                 continue
-            
-            fpath = os.path.join(self.tokens_dir, fname)
-            try:
-                with open(fpath, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                tokens.append(data)
-                logger.debug(f"Loaded token: {fname}")
-            except (json.JSONDecodeError, IOError) as e:
-                logger.warning(f"Failed to load token {fname}: {e}")
+            tokens.append(data)
+            logger.debug(f"Loaded token: {fname}")
         
         logger.info(f"Scanned {len(tokens)} tokens from {self.tokens_dir}")
         return tokens
@@ -1134,51 +1147,73 @@ class ResearchIndexSyncer:
         
         return category
     
-    def sync_index(self) -> List[Dict]:
+    def sync_index(self, full: bool = False) -> List[Dict]:
         """
         Synchronize tokens with research index.
         
+        Only tokens added or changed since the last sync are read and
+        categorized (see research_indexer); their records are merged into the
+        existing index, leaving records from other directories untouched.
+        
+        Args:
+            full: Re-read every token instead of just the changed ones
+        
         Returns:
             Updated research index records
         """
         logger.info("Starting research index synchronization")
         
-        tokens = self.scan_tokens()
-        records = []
+        indexer = IncrementalIndexer(self.research_index_path, [
+            IndexSource("tokens", self.tokens_dir, self.make_record)
+        ])
+        records, stats = indexer.update(full=full)
         
-        for token in tokens:
-            token_hash = token.get("hash", "")
-            category = self.categorize_token(token)
-            
-            # Extract title from research content
-            research = token.get("research", "")
-            title_match = re.search(r'\[.*?\]\s*(.+?)(?:\n|$)', research)
-            title = title_match.group(1).strip() if title_match else f"Token {token_hash[:8]}…"
-            
-            record = {
-                "hash": token_hash,
-                "role": category,
-                "title": title,
-                "url": f"tokens/{token_hash}.json",
-                "source_url": token.get("source_url", ""),
-                "timestamp": token.get("timestamp", ""),
-                "notes": token.get("notes", ""),
-                "value": token.get("value", 0)
-            }
-            records.append(record)
+        # Save updated category mappings
+        if stats["parsed"]:
+            self.token_manager.save_config()
         
-        # Sort by timestamp
-        records.sort(key=lambda r: (r.get("timestamp", ""), r.get("hash", "")))
+        logger.info(f"Synchronized {len(records)} records to research index "
+                    f"({stats['parsed']} tokens read, {stats['dropped']} records dropped)")
+        return records
+    
+    def make_record(self, fname: str, token: Optional[Dict]) -> Optional[Dict]:
+        """
+        Build the research index record for a token.
         
-        # Save updated index
-        with open(self.research_index_path, "w", encoding="utf-8") as f:
-            json.dump(records, f, indent=2)
+        Args:
+            fname: Token file name
+            token: Token data dictionary, None if unreadable
         
-        # Save updated category mappings
-        self.token_manager.save_config()
+        Returns:
+            Record dictionary, or None to leave the token out
+        """
+        if token is None:
+            logger.warning(f"Failed to load token {fname}")
+            return None
         
-        logger.info(f"Synchronized {len(records)} records to research index")
-        return records
+        # Tokens built with TOKEN_JSON_EXPORT=0 are only in the store: publish
+        # the file this record links to
+        if not os.path.exists(os.path.join(self.tokens_dir, fname)):
+            export_token(self.tokens_dir, os.path.splitext(fname)[0], token)
+        
+        token_hash = token.get("hash", "")
+        category = self.categorize_token(token)
+        
+        # Extract title from research content
+        research = token.get("research", "")
+        title_match = re.search(r'\[.*?\]\s*(.+?)(?:\n|$)', research)
+        title = title_match.group(1).strip() if title_match else f"Token {token_hash[:8]}…"
+        
+        return {
+            "hash": token_hash,
+            "role": category,
+            "title": title,
+            "url": f"tokens/{fname}",
+            "source_url": token.get("source_url", ""),
+            "timestamp": token.get("timestamp", ""),
+            "notes": token.get("notes", ""),
+            "value": token.get("value", 0)
+        }
 
 
 # ------------------------------ MAIN FACADE ------------------------------
@@ -1207,9 +1242,9 @@ class PewpiLogin:
         
         logger.info("PewpiLogin initialized successfully")
     
-    def sync(self) -> List[Dict]:
-        """Synchronize tokens and research index."""
-        return self.index_syncer.sync_index()
+    def sync(self, full: bool = False) -> List[Dict]:
+        """Synchronize tokens and research index (incrementally unless full)."""
+        return self.index_syncer.sync_index(full=full)
     
     def get_categories(self) -> List[Dict]:
         """Get all available categories."""
@@ -1292,7 +1327,7 @@ def main():
     parser.add_argument(
         "--generate-index",
         action="store_true",
-        help="Generate research index from tokens"
+        help="Regenerate research index from all tokens (full rebuild)"
     )
     parser.add_argument(
         "--validate",
@@ -1326,7 +1361,7 @@ def main():
         pewpi = PewpiLogin()
         
         if args.sync or args.generate_index:
-            records = pewpi.sync()
+            records = pewpi.sync(full=args.generate_index)
             print(f"Synchronized {len(records)} research records")
         
         if args.validate:
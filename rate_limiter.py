@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Rate Limiter - Token-bucket rate limits for the auth endpoints
+Part of the Pewpi Login / Infinity Research Portal
+
+check_rate_limit used to count requests per calendar minute in a dict and
+clear the whole dict once it held 1000 keys, handing every client a fresh
+budget at once. Each limiter here is a token bucket in its GCRA form: per
+key it keeps one number, the time at which the bucket will be full again
+(tat). A bucket holds ``limit`` tokens and refills one every per / limit
+seconds, so a client gets a burst of ``limit`` and then a steady rate, with
+no minute boundary to game. A hit is O(1).
+
+A key whose tat has passed holds a full bucket, which is what an unknown key
+gets, so such keys are dropped. Memory is bounded by the clients throttled
+right now, and max_keys caps it even in a storm by evicting the least
+recently seen keys first.
+
+    MemoryRateLimiter   one process (thread-safe)
+    SQLiteRateLimiter   every worker process sharing one database file
+
+The auth server picks one through shared_state.SharedState (STATE_BACKEND).
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from shared_state import sqlite_connection
+
+# ------------------------------ CONFIG ------------------------------
+# Most keys a limiter tracks; the least recently seen are evicted beyond it
+MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 100000))
+# SQLiteRateLimiter drops refilled buckets every this many hits
+PRUNE_EVERY = 256
+
+
+def gcra(tat, now, limit, per):
+    """
+    One hit against a bucket that is full again at ``tat``.
+
+    Returns:
+        (new tat, seconds to wait); the hit is allowed when the wait is 0 and
+        then the new tat must be stored
+    """
+    interval = per / limit
+    tat = max(tat or 0.0, now)
+    wait = tat + interval - per - now
+    if wait > 0:
+        return tat, wait
+    return tat + interval, 0.0
+
+
+class MemoryRateLimiter:
+    """Token buckets in an LRU-ordered dict."""
+
+    def __init__(self, max_keys=MAX_KEYS, clock=time.monotonic):
+        """
+        Args:
+            max_keys: Keys tracked at most
+            clock: Seconds source (injectable for tests)
+        """
+        self.max_keys = max_keys
+        self.clock = clock
+        self._tats = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key, limit, per=60.0):
+        """
+        Take a token from ``key``'s bucket of ``limit`` per ``per`` seconds.
+
+        Returns:
+            0.0 if allowed, otherwise seconds until a token is available
+        """
+        with self._lock:
+            now = self.clock()
+            tat, wait = gcra(self._tats.get(key), now, limit, per)
+            self._tats[key] = tat
+            self._tats.move_to_end(key)
+            self._evict(now)
+            return wait
+
+    def allow(self, key, limit, per=60.0):
+        """True if ``key`` may make another request now (and count it)."""
+        return self.hit(key, limit, per) == 0.0
+
+    def reset(self, key=None):
+        """Forget ``key``'s bucket, or every bucket."""
+        with self._lock:
+            if key is None:
+                self._tats.clear()
+            else:
+                self._tats.pop(key, None)
+
+    def __len__(self):
+        return len(self._tats)
+
+    # ------------------------------ INTERNALS ------------------------------
+    def _evict(self, now):
+        tats = self._tats
+        while len(tats) > self.max_keys:
+            tats.popitem(last=False)
+        # Keys seen longest ago are the likeliest to be full again
+        while tats:
+            key, tat = next(iter(tats.items()))
+            if tat > now:
+                break
+            del tats[key]
+
+
+class SQLiteRateLimiter:
+    """Token buckets in a SQLite table shared by every process using the file."""
+
+    def __init__(self, path, max_keys=MAX_KEYS, clock=time.time, timeout=5.0):
+        """
+        Args:
+            path: Database file; created if missing
+            max_keys: Rows kept at most after each prune
+            clock: Wall-clock seconds source, the same for every process
+            timeout: Seconds to wait for another process's write
+        """
+        self.path = path
+        self.max_keys = max_keys
+        self.clock = clock
+        self.timeout = timeout
+        self._local = threading.local()
+        self._hits = 0
+
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS rate_limits "
+                       "(key TEXT PRIMARY KEY, tat REAL NOT NULL) WITHOUT ROWID")
+            db.execute("CREATE INDEX IF NOT EXISTS rate_limits_tat ON rate_limits (tat)")
+
+    def hit(self, key, limit, per=60.0):
+        """As MemoryRateLimiter.hit, atomically across processes."""
+        db = self._connect()
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            now = self.clock()
+            row = db.execute("SELECT tat FROM rate_limits WHERE key = ?", (key,)).fetchone()
+            tat, wait = gcra(row[0] if row else None, now, limit, per)
+            if not wait:
+                db.execute("INSERT OR REPLACE INTO rate_limits (key, tat) VALUES (?, ?)", (key, tat))
+            self._hits += 1
+            if self._hits % PRUNE_EVERY == 0:
+                self._prune(db, now)
+        return wait
+
+    def allow(self, key, limit, per=60.0):
+        """True if ``key`` may make another request now (and count it)."""
+        return self.hit(key, limit, per) == 0.0
+
+    def reset(self, key=None):
+        """Forget ``key``'s bucket, or every bucket."""
+        with self._connect() as db:
+            if key is None:
+                db.execute("DELETE FROM rate_limits")
+            else:
+                db.execute("DELETE FROM rate_limits WHERE key = ?", (key,))
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM rate_limits").fetchone()[0]
+
+    # ------------------------------ INTERNALS ------------------------------
+    def _connect(self):
+        return sqlite_connection(self._local, self.path, self.timeout)
+
+    def _prune(self, db, now):
+        db.execute("DELETE FROM rate_limits WHERE tat <= ?", (now,))
+        excess = db.execute("SELECT COUNT(*) FROM rate_limits").fetchone()[0] - self.max_keys
+        if excess > 0:
+            # Least throttled first: the nearest to full again
+            db.execute("DELETE FROM rate_limits WHERE key IN "
+                       "(SELECT key FROM rate_limits ORDER BY tat LIMIT ?)", (excess,))
+
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Research Indexer - Incremental research_index.json builds
+Part of the Pewpi Login / Infinity Research Portal
+
+Keeps a journal next to the index recording what every source directory
+looked like at the last build: the token store's index position (its
+append-only index doubles as a change log) and the mtime/size of loose
+files. An update only parses tokens that were added or changed since, drops
+records for removed ones and merges the result into the existing sorted
+index, so build time follows the size of the change rather than the corpus.
+
+Each source owns the records whose url starts with "<name>/"; records from
+other sources (or written by hand) are left in place.
+"""
+
+import os
+import json
+import bisect
+
+from pending_queue import FileLock
+from token_store import store_for
+
+JOURNAL_VERSION = 1
+
+
+def record_sort_key(record):
+    """Index order: by timestamp, then hash."""
+    return (str(record.get("timestamp") or ""), str(record.get("hash") or ""))
+
+
+class IndexSource:
+    """A directory of token files (plus its token store) feeding the index."""
+
+    def __init__(self, name, directory, make_record, suffixes=(".json",), parse=True, use_store=True):
+        """
+        Args:
+            name: url prefix of this source's records, e.g. "infinity_tokens"
+            directory: Directory holding the token files
+            make_record: Callable(fname, data) -> record dict or None to skip;
+                data is the parsed token, or None if parse is off or it is unreadable
+            suffixes: File name suffixes that belong to the source
+            parse: Load files as JSON before calling make_record
+            use_store: Also read tokens packed in the directory's token store
+        """
+        self.name = name
+        self.directory = directory
+        self.make_record = make_record
+        self.suffixes = tuple(suffixes)
+        self.parse = parse
+        self.store = store_for(directory) if use_store else None
+
+    def url(self, fname):
+        return f"{self.name}/{fname}"
+
+    def load(self, fname):
+        """Return the token for ``fname``, preferring the store; None if unreadable."""
+        if self.store is not None and fname.endswith(".json"):
+            token = self.store.get(fname[:-5])
+            if token is not None:
+                return token
+        if not self.parse:
+            return None
+        try:
+            with open(os.path.join(self.directory, fname), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def scan_files(self, exclude=()):
+        """Return {fname: [mtime_ns, size]} for loose files not in ``exclude``."""
+        files = {}
+        if not os.path.isdir(self.directory):
+            return files
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(self.suffixes) or entry.name in exclude:
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files[entry.name] = [st.st_mtime_ns, st.st_size]
+        return files
+
+
+class IncrementalIndexer:
+    """Rebuilds a research index from its sources, reparsing only what changed."""
+
+    def __init__(self, index_path, sources, journal_path=None):
+        """
+        Args:
+            index_path: research_index.json path
+            sources: IndexSource objects whose records this indexer maintains
+            journal_path: Journal file, defaults to <index>.journal.json
+        """
+        self.index_path = index_path
+        self.sources = list(sources)
+        self.journal_path = journal_path or os.path.splitext(index_path)[0] + ".journal.json"
+        self.lock_path = self.journal_path + ".lock"
+
+    def update(self, full=False):
+        """
+        Bring the index up to date with the sources.
+
+        Args:
+            full: Ignore the journal and reparse every source
+
+        Returns:
+            (records, stats): the full sorted index and a dict with
+            "parsed" and "dropped" record counts, "total" and "written"
+        """
+        with FileLock(self.lock_path):
+            journal = self._load_journal()
+            if full or journal.get("index_sig") != self._index_sig():
+                journal["sources"] = {}  # index changed behind our back
+            states = journal.setdefault("sources", {})
+
+            full_sources = []
+            drop = set()
+            dirty = []
+            for source in self.sources:
+                state = states.get(source.name)
+                new_state, source_full, source_drop, source_dirty = self._diff(source, state)
+                states[source.name] = new_state
+                if source_full:
+                    full_sources.append(source)
+                drop.update(source_drop)
+                dirty.extend((source, fname) for fname in source_dirty)
+
+            if not (full_sources or drop or dirty):
+                records = self._load_index()
+                return records, {"parsed": 0, "dropped": 0, "total": len(records), "written": False}
+
+            records = self._load_index()
+            prefixes = tuple(f"{s.name}/" for s in full_sources)
+            before = len(records)
+            records = [r for r in records
+                       if r.get("url") not in drop
+                       and not (prefixes and str(r.get("url", "")).startswith(prefixes))]
+            dropped = before - len(records)
+
+            added = []
+            for source, fname in dirty:
+                record = source.make_record(fname, source.load(fname))
+                if record is not None:
+                    record["url"] = source.url(fname)
+                    added.append(record)
+
+            # Merge: insort a few records, re-sort when most of the index changed
+            if len(added) * 8 < len(records):
+                for record in added:
+                    bisect.insort(records, record, key=record_sort_key)
+            else:
+                records.extend(added)
+                records.sort(key=record_sort_key)
+
+            self._write_index(records)
+            journal["index_sig"] = self._index_sig()
+            self._save_journal(journal)
+            return records, {"parsed": len(added), "dropped": dropped, "total": len(records), "written": True}
+
+    # ------------------------------ DIFF ------------------------------
+    def _diff(self, source, state):
+        """
+        Compare a source with its journal state.
+
+        Returns:
+            (new_state, full, drop_urls, dirty_fnames)
+        """
+        full = state is None
+        state = state or {}
+        drop = set()
+        dirty = set()
+
+        stored = set()
+        store_pos = None
+        if source.store is not None:
+            store_pos, changed, deleted = source.store.changes(None if full else state.get("store"))
+            stored = {f"{key}.json" for key in source.store.keys()}
+            if changed is None:
+                full = True
+            else:
+                dirty.update(f"{key}.json" for key in changed)
+                drop.update(source.url(f"{key}.json") for key in deleted)
+
+        files = source.scan_files(exclude=stored)
+        if full:
+            dirty = stored | set(files)
+        else:
+            old_files = state.get("files", {})
+            for fname, sig in files.items():
+                if old_files.get(fname) != sig:
+                    dirty.add(fname)
+            for fname in old_files:
+                if fname not in files and fname not in stored:
+                    drop.add(source.url(fname))
+
+        # A reparsed record replaces the old one
+        drop.update(source.url(fname) for fname in dirty)
+        return {"store": store_pos, "files": files}, full, drop, sorted(dirty)
+
+    # ------------------------------ FILES ------------------------------
+    def _index_sig(self):
+        try:
+            st = os.stat(self.index_path)
+        except FileNotFoundError:
+            return None
+        return [st.st_mtime_ns, st.st_size]
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                records = json.load(f)
+        except (OSError, ValueError):
+            return []
+        return records if isinstance(records, list) else []
+
+    def _write_index(self, records):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(records, f, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+    def _load_journal(self):
+        try:
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                journal = json.load(f)
+        except (OSError, ValueError):
+            return {"version": JOURNAL_VERSION}
+        if not isinstance(journal, dict) or journal.get("version") != JOURNAL_VERSION:
+            return {"version": JOURNAL_VERSION}
+        return journal
+
+    def _save_journal(self, journal):
+        tmp_path = self.journal_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(journal, f, separators=(",", ":"))
+        os.replace(tmp_path, self.journal_path)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Serve Portal - Run auth_server with one worker process per core
+Part of the Pewpi Login / Infinity Research Portal
+
+`python auth_server.py` is a single process, so the portal used one core.
+This launcher sizes the worker count to the cores the process may run on
+and sets the workers up to act as one server:
+
+    STATE_BACKEND=sqlite     rate limits, magic links and job results in
+                             STATE_DB, and users.json in shared mode
+    SESSION_SECRET           one cookie key for all of them (a random one for
+                             this run if unset: logins then end on restart)
+    TOKEN_JOB_WORKERS        background build processes split between workers
+
+    python serve_portal.py [--workers N] [--host H] [--port P] [--builtin]
+
+It runs gunicorn when it is installed; otherwise (or with --builtin) it
+binds the port itself and forks werkzeug workers that accept on the same
+socket, restarting any that die.
+"""
+
+import os
+import sys
+import time
+import signal
+import shutil
+import secrets
+import socket
+import argparse
+import multiprocessing
+
+from dotenv import load_dotenv
+
+# The workers load .env as well, but the launcher must see SESSION_SECRET and STATE_BACKEND first
+load_dotenv()
+
+# ------------------------------ CONFIG ------------------------------
+HOST = os.getenv("FLASK_HOST", "0.0.0.0")
+PORT = int(os.getenv("FLASK_PORT", 5000))
+# Worker processes; 0 = one per available core
+PORTAL_WORKERS = int(os.getenv("PORTAL_WORKERS", 0))
+
+
+def available_cores():
+    """Cores this process may run on (its affinity mask, not just the machine's count)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def worker_env(workers, env=None, cores=None):
+    """
+    The environment changes the workers need; raises ValueError for a
+    configuration that cannot work with ``workers`` processes.
+    """
+    env = os.environ if env is None else env
+    cores = cores or available_cores()
+    changes = {}
+    if workers > 1:
+        backend = env.get("STATE_BACKEND", "sqlite")
+        if backend == "memory":
+            raise ValueError("STATE_BACKEND=memory keeps state per process; use sqlite with several workers")
+        changes["STATE_BACKEND"] = backend
+        if not env.get("SESSION_SECRET"):
+            changes["SESSION_SECRET"] = secrets.token_hex(32)
+            print("⚠️  SESSION_SECRET is not set: using a random one, so logins end when the portal restarts")
+    if "TOKEN_JOB_WORKERS" not in env:
+        changes["TOKEN_JOB_WORKERS"] = str(max(1, cores // workers))
+    return changes
+
+
+def serve_worker(host, port, fd=None):
+    """Import the app in this process and serve it (on the inherited socket ``fd``, if given)."""
+    from werkzeug.serving import make_server
+    from auth_server import app
+
+    server = make_server(host, port, app, threaded=True, fd=fd)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    server.serve_forever()
+
+
+def run_builtin(host, port, workers):
+    """Pre-fork ``workers`` werkzeug servers on one listening socket and keep them running."""
+    if workers <= 1:
+        serve_worker(host, port)
+        return
+
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+    sock.set_inheritable(True)
+
+    # fork: the workers inherit the socket and have not imported the app yet
+    context = multiprocessing.get_context("fork")
+
+    def start():
+        proc = context.Process(target=serve_worker, args=(host, port, sock.fileno()), daemon=True)
+        proc.start()
+        return proc
+
+    procs = [start() for _ in range(workers)]
+    print(f"∞ Serving http://{host}:{port} with {workers} workers (pids {', '.join(str(p.pid) for p in procs)})")
+    try:
+        while True:
+            time.sleep(1)
+            for i, proc in enumerate(procs):
+                if not proc.is_alive():
+                    print(f"[PORTAL] worker {proc.pid} exited ({proc.exitcode}), restarting")
+                    procs[i] = start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.join(5)
+        sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the portal with one worker per core")
+    parser.add_argument("--workers", type=int, default=PORTAL_WORKERS,
+                        help="worker processes (env PORTAL_WORKERS; default one per available core)")
+    parser.add_argument("--host", default=HOST, help="bind address (env FLASK_HOST)")
+    parser.add_argument("--port", type=int, default=PORT, help="port (env FLASK_PORT)")
+    parser.add_argument("--builtin", action="store_true", help="use the built-in pre-fork server even if gunicorn is installed")
+    args = parser.parse_args(argv)
+
+    workers = args.workers or available_cores()
+    try:
+        os.environ.update(worker_env(workers))
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+
+    gunicorn = shutil.which("gunicorn")
+    if gunicorn and not args.builtin:
+        print(f"∞ Starting gunicorn with {workers} workers on {args.host}:{args.port}")
+        os.execv(gunicorn, [gunicorn, "-w", str(workers), "--threads", "4",
+                            "-b", f"{args.host}:{args.port}", "auth_server:app"])
+    run_builtin(args.host, args.port, workers)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
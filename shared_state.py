@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Shared State - Where the auth server keeps state between requests
+Part of the Pewpi Login / Infinity Research Portal
+
+Rate-limit buckets, outstanding magic links and background job results
+used to live in module-level dicts, so under a multi-process server each
+worker enforced its own limits and rejected links issued by the others.
+SharedState puts them behind one object with one backend:
+
+    memory   in-process structures; fine for a single worker
+    sqlite   one SQLite file (WAL) that every worker opens; each update is
+             a single transaction, so the workers act as one server
+
+    state = SharedState("sqlite", "/var/lib/portal/state.db")
+    state.rate_limiter.allow(key, limit)
+    state.magic_links.issue(email)
+    state.job_registry      # None for memory: jobs are only asked for locally
+
+users.json is not part of it: UserStore has its own shared mode, enabled
+when the backend is multi-process.
+
+Select with STATE_BACKEND=memory|sqlite and STATE_DB.
+"""
+
+import os
+import sqlite3
+
+# ------------------------------ CONFIG ------------------------------
+Z_ROOT = os.path.abspath(os.path.dirname(__file__))
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+STATE_DB = os.getenv("STATE_DB", os.path.join(Z_ROOT, "portal_state.db"))
+
+BACKENDS = ("memory", "sqlite")
+
+
+def sqlite_connection(local, path, timeout):
+    """The calling thread's connection to ``path``, opened on first use.
+
+    Args:
+        local: threading.local() owned by the store; holds the connection
+        path: Database file; created if missing
+        timeout: Seconds to wait for another process's write
+    """
+    # sqlite3 connections must stay on the thread that opened them
+    db = getattr(local, "db", None)
+    if db is None:
+        db = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        local.db = db
+    return db
+
+
+class SharedState:
+    """The auth server's cross-request state, from one backend."""
+
+    def __init__(self, backend=STATE_BACKEND, path=STATE_DB):
+        """
+        Args:
+            backend: "memory" or "sqlite"
+            path: Database file of the sqlite backend
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown state backend: {backend!r} (have {', '.join(BACKENDS)})")
+        # The stores import sqlite_connection from here
+        from rate_limiter import MemoryRateLimiter, SQLiteRateLimiter
+        from magic_link_store import MemoryMagicLinkStore, SQLiteMagicLinkStore
+        from token_jobs import SQLiteJobRegistry
+
+        self.backend = backend
+        self.path = path
+        # True when several processes can serve the same users
+        self.multi_process = backend == "sqlite"
+
+        if backend == "sqlite":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.rate_limiter = SQLiteRateLimiter(path)
+            self.magic_links = SQLiteMagicLinkStore(path)
+            self.job_registry = SQLiteJobRegistry(path)
+        else:
+            self.rate_limiter = MemoryRateLimiter()
+            self.magic_links = MemoryMagicLinkStore()
+            self.job_registry = None
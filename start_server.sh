@@ -21,7 +21,8 @@ if [ $? -ne 0 ]; then
     pip install -r requirements.txt
 fi
 
-# Build research index
+# Build research index (incremental: only new/changed tokens are read;
+# run `python3 build_research_index.py --full` to rebuild from scratch)
 echo "Building research index..."
 python3 build_research_index.py
 
@@ -32,5 +33,5 @@ echo ""
 echo "Press Ctrl+C to stop the server"
 echo "=============================================="
 
-# Start the server
-python3 auth_server.py
+# Start the server: one worker per core (PORTAL_WORKERS=1 for a single process)
+python3 serve_portal.py
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Static Variants - Precompressed, ETag-validated portal files
+Part of the Pewpi Login / Infinity Research Portal
+
+The portal page fetched research_index.json and category_tokens.json with
+cache: "no-store", and the server sent them (and index.html) uncompressed,
+so every page view downloaded the whole index again. The index build now
+writes next to each served file:
+
+    research_index.json.gz     gzip -9
+    research_index.json.br     brotli (when the brotli package is installed)
+    research_index.json.etag   content hash, plus the size and mtime it describes
+
+StaticFile serves a file from them: a request whose If-None-Match carries
+the current hash gets 304 and no body, otherwise the smallest variant the
+client accepts (br > gzip > identity), with Vary: Accept-Encoding and
+Cache-Control: no-cache so browsers keep the copy but revalidate it.
+
+A file changed after its variants were written (the .etag no longer matches
+its size and mtime) is still served correctly: StaticFile hashes it and
+gzips it in memory once per version.
+
+    python static_variants.py FILE...    # write the variants of FILE
+"""
+
+import os
+import sys
+import gzip
+import hashlib
+import mimetypes
+import threading
+
+# Try to import brotli, fall back to gzip only if not available
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+# ------------------------------ CONFIG ------------------------------
+# Content encodings in order of preference, with the suffix of their variant file
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+ETAG_SUFFIX = ".etag"
+# Files smaller than this are not worth compressing
+MIN_SIZE = 256
+CACHE_CONTROL = "no-cache"
+
+
+def content_etag(data):
+    """ETag (without quotes) of a file's content."""
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def compress(data, encoding, fast=False):
+    """``data`` in ``encoding`` ("gzip" or "br"); deterministic output."""
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=6 if fast else 9, mtime=0)
+    if encoding == "br" and BROTLI_AVAILABLE:
+        return brotli.compress(data, quality=5 if fast else 11)
+    raise ValueError(f"Unsupported encoding: {encoding!r}")
+
+
+def _atomic_write(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def write_variants(path):
+    """
+    Write the compressed variants and the .etag of ``path``.
+
+    Returns:
+        {"etag": ..., "size": ..., encoding: compressed size, ...}
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+        st = os.fstat(f.fileno())
+    etag = content_etag(data)
+    written = {"etag": etag, "size": len(data)}
+
+    for encoding, suffix in ENCODINGS:
+        body = None
+        if len(data) >= MIN_SIZE and (encoding != "br" or BROTLI_AVAILABLE):
+            body = compress(data, encoding)
+        if body is None or len(body) >= len(data):
+            # Leave no variant of an older version behind
+            _remove(path + suffix)
+            continue
+        _atomic_write(path + suffix, body)
+        written[encoding] = len(body)
+
+    # Last: the variants are trusted only once this matches the file
+    _atomic_write(path + ETAG_SUFFIX, f"{etag} {st.st_size} {st.st_mtime_ns}\n".encode("ascii"))
+    return written
+
+
+def variants_fresh(path):
+    """True if the .etag written with the variants of ``path`` still describes it."""
+    try:
+        st = os.stat(path)
+        return _read_etag(path, st) is not None
+    except FileNotFoundError:
+        return False
+
+
+def _read_etag(path, st):
+    try:
+        with open(path + ETAG_SUFFIX, encoding="ascii") as f:
+            etag, size, mtime_ns = f.read().split()
+    except (OSError, ValueError):
+        return None
+    if int(size) != st.st_size or int(mtime_ns) != st.st_mtime_ns:
+        return None
+    return etag
+
+
+def parse_accept_encoding(header):
+    """Encodings a client accepts (q > 0), from an Accept-Encoding header."""
+    accepted = set()
+    for item in (header or "").split(","):
+        name, _, params = item.partition(";")
+        name = name.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name and q > 0:
+            accepted.add(name)
+    return accepted
+
+
+def etag_matches(header, etag):
+    """True if an If-None-Match header names ``etag`` in any of its encodings."""
+    for item in (header or "").split(","):
+        item = item.strip()
+        if item == "*":
+            return True
+        if item.startswith("W/"):
+            item = item[2:]
+        # Encoded variants carry the same hash with a -<encoding> suffix
+        if item.strip('"').split("-", 1)[0] == etag:
+            return True
+    return False
+
+
+class StaticFile:
+    """One file served with its precompressed variants, ETag and 304s."""
+
+    def __init__(self, path, mimetype=None, cache_control=CACHE_CONTROL):
+        """
+        Args:
+            path: File to serve
+            mimetype: Content-Type; guessed from the name if None
+            cache_control: Cache-Control header of every response
+        """
+        self.path = path
+        self.mimetype = mimetype or mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.cache_control = cache_control
+        self._entry = None
+        self._lock = threading.Lock()
+
+    def negotiate(self, if_none_match=None, accept_encoding=None):
+        """
+        Pick the response to a GET for this file.
+
+        Args:
+            if_none_match: The request's If-None-Match header
+            accept_encoding: The request's Accept-Encoding header
+
+        Returns:
+            (status, body, headers): status 304 with body None, or 200 with
+            the path of the file to send or the bytes of an in-memory variant
+
+        Raises:
+            FileNotFoundError: The file does not exist
+        """
+        entry = self._current()
+        etag = entry["etag"]
+        headers = {"Vary": "Accept-Encoding", "Cache-Control": self.cache_control}
+
+        accepted = parse_accept_encoding(accept_encoding)
+        encoding = next((enc for enc, _ in ENCODINGS if enc in accepted and enc in entry["variants"]), None)
+        # The ETag a 200 would carry, which a 304 must repeat
+        if encoding is None:
+            headers["ETag"] = f'"{etag}"'
+        else:
+            headers["ETag"] = f'"{etag}-{encoding}"'
+
+        if etag_matches(if_none_match, etag):
+            return 304, None, headers
+        if encoding is None:
+            return 200, self.path, headers
+        headers["Content-Encoding"] = encoding
+        return 200, entry["variants"][encoding], headers
+
+    # ------------------------------ INTERNALS ------------------------------
+    def _current(self):
+        st = os.stat(self.path)
+        sig = (st.st_ino, st.st_size, st.st_mtime_ns)
+        with self._lock:
+            if self._entry is not None and self._entry["sig"] == sig:
+                return self._entry
+
+            etag = _read_etag(self.path, st)
+            if etag is not None:
+                variants = {encoding: self.path + suffix for encoding, suffix in ENCODINGS
+                            if os.path.exists(self.path + suffix)}
+            else:
+                # Changed since the build wrote its variants: hash it and gzip it here
+                with open(self.path, "rb") as f:
+                    data = f.read()
+                    st = os.fstat(f.fileno())
+                sig = (st.st_ino, st.st_size, st.st_mtime_ns)
+                etag = content_etag(data)
+                variants = {}
+                if len(data) >= MIN_SIZE:
+                    body = compress(data, "gzip", fast=True)
+                    if len(body) < len(data):
+                        variants["gzip"] = body
+
+            self._entry = {"sig": sig, "etag": etag, "variants": variants}
+            return self._entry
+
+
+def main(argv=None):
+    paths = sys.argv[1:] if argv is None else argv
+    if not paths:
+        print("Usage: python static_variants.py FILE...")
+        return 1
+    for path in paths:
+        written = write_variants(path)
+        sizes = ", ".join(f"{enc} {written[enc]}" for enc, _ in ENCODINGS if enc in written)
+        print(f"{os.path.basename(path)}: {written['size']} bytes -> {sizes or 'not compressed'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
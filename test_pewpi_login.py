@@ -17,6 +17,19 @@ import json
 import unittest
 import tempfile
 import shutil
+import threading
+import io
+import re
+import time
+import hashlib
+import zipfile
+import gzip
+import base64
+import contextlib
+import subprocess
+import urllib.request
+from dotenv import dotenv_values
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 
 # Add parent directory to path for imports
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -33,9 +46,48 @@ from pewpi_login import (
 from build_token import (
     score_content, calculate_value, format_value,
     build_token, generate_mega_hash, infinity_hash,
+    score_stream, build_token_stream, build_tokens, load_token,
+    process_file_upload, iter_base64_chunks,
     MIN_VALUE, MAX_VALUE
 )
 
+from keyword_scanner import KeywordScanner, AHOCORASICK_AVAILABLE
+from pending_queue import PendingQueue
+import cart082_infinity_token_valuator as valuator
+from token_store import TokenStore, iter_tokens, store_for
+from research_indexer import IncrementalIndexer, IndexSource
+from user_store import UserStore
+from commit_log import CommitLog
+from rate_limiter import MemoryRateLimiter, SQLiteRateLimiter
+import magic_link_store
+from magic_link_store import MemoryMagicLinkStore, SQLiteMagicLinkStore
+import token_jobs
+from token_jobs import TokenJobs
+from shared_state import SharedState
+from serve_portal import worker_env
+import static_variants
+from static_variants import StaticFile, write_variants, variants_fresh
+from crawl_engine import Crawler
+import cart1000_fast_token_engine as fast_engine
+import cart1000_master_research_fuser as fuser
+import cart1000_research_scraper as research_scraper
+# The research engine prints with colorama, which only that cart needs
+try:
+    import cart1000_infinity_research_engine as research_engine
+except ImportError:
+    research_engine = None
+import blob_store
+from blob_store import BlobStore, ManifestWriter
+from dir_watcher import DirWatcher, INOTIFY_AVAILABLE
+import archive_writer
+from archive_writer import ArchiveWriter, load_policy
+from html_extract import extract_page, paragraph_text, page_links, visible_text
+import git_sync
+from git_sync import GitSync
+import fetch_cache
+from fetch_cache import FetchCache
+import cart083_infinity_zip_bundler as zip_bundler
+
 
 class TestPewpiLogin(unittest.TestCase):
     """Test user authentication functionality."""
@@ -219,6 +271,20 @@ class TestBuildToken(unittest.TestCase):
         self.assertEqual(token["source_type"], "text")
         self.assertEqual(len(token["hash"]), 64)
 
+    def test_build_tokens_batch(self):
+        """Test batch creation queues every token once."""
+        from build_token import SESSION_LOG
+        texts = ["quantum batch one", "hydrogen batch two", "plain batch three"]
+        tokens = build_tokens(texts, filenames=["a.txt", None, "c.txt"])
+
+        self.assertEqual([t["raw_text"] for t in tokens], texts)
+        self.assertEqual(tokens[0]["filename"], "a.txt")
+        self.assertEqual(tokens[1]["score"], score_content(texts[1])[0])
+
+        pending = PendingQueue(SESSION_LOG).pending()
+        for token in tokens:
+            self.assertEqual(pending.count(token["hash"]), 1)
+
     def test_infinity_hash(self):
         """Test hash generation."""
         text = "Test content"
@@ -232,6 +298,1614 @@ class TestBuildToken(unittest.TestCase):
         self.assertNotEqual(hash1, hash3)  # Different input = different hash
 
 
+class TestKeywordScanner(unittest.TestCase):
+    """Test the compiled keyword scanner against str.count semantics."""
+
+    TEXT = "ainfinity aaaa quantumquantum hydrahydrogen ai-ai plain"
+    KEYWORDS = ["ai", "infinity", "aa", "quantum", "hydra", "hydrogen", "missing"]
+
+    def expected(self):
+        return {k: self.TEXT.count(k) for k in self.KEYWORDS if self.TEXT.count(k)}
+
+    def test_count_fallback_matches_str_count(self):
+        """Test per-keyword counting matches str.count."""
+        scanner = KeywordScanner(self.KEYWORDS, use_automaton=False)
+        self.assertEqual(scanner.count(self.TEXT), self.expected())
+
+    @unittest.skipUnless(AHOCORASICK_AVAILABLE, "pyahocorasick not installed")
+    def test_count_automaton_matches_str_count(self):
+        """Test the automaton keeps non-overlapping per-keyword counts."""
+        scanner = KeywordScanner(self.KEYWORDS, use_automaton=True)
+        counts = scanner.count(self.TEXT)
+        self.assertEqual(counts, self.expected())
+        self.assertEqual(list(counts), list(self.expected()))
+
+    def test_present(self):
+        """Test keyword presence lookup."""
+        scanner = KeywordScanner(self.KEYWORDS)
+        self.assertEqual(scanner.present(self.TEXT), set(self.expected()))
+
+    def test_score_content_keyword_matches(self):
+        """Test score_content reports the same counts as str.count."""
+        from build_token import BOOST_KEYWORDS
+        text = "AInfinity quantum QUANTUM secretsecret data-database"
+        _, analysis = score_content(text)
+        lowered = text.lower()
+        for keyword, bonus in BOOST_KEYWORDS.items():
+            count = lowered.count(keyword)
+            if count:
+                self.assertEqual(analysis["keyword_matches"][keyword],
+                                 {"count": count, "bonus": count * bonus})
+            else:
+                self.assertNotIn(keyword, analysis["keyword_matches"])
+
+
+class TestStreamingScore(unittest.TestCase):
+    """Test streaming scoring against score_content."""
+
+    TEXT = ("Quantum research\n  on hydrogen fusion  data\n" * 7
+            + "ainfinity secretsecret   plain\tword\n\n end")
+
+    def chunked(self, text, size):
+        return [text[i:i + size] for i in range(0, len(text), size)]
+
+    def test_score_stream_matches_score_content(self):
+        """Test chunked scoring gives the same score and analysis."""
+        expected = score_content(self.TEXT)
+        for size in (1, 2, 3, 7, 64, len(self.TEXT)):
+            self.assertEqual(score_stream(self.chunked(self.TEXT, size)), expected)
+
+    def test_score_stream_file_object(self):
+        """Test scoring a binary file-like object."""
+        source = io.BytesIO(self.TEXT.encode("utf-8"))
+        self.assertEqual(score_stream(source), score_content(self.TEXT))
+
+    def test_keyword_straddling_chunks(self):
+        """Test keywords split across chunk boundaries are counted."""
+        _, analysis = score_stream(["qua", "ntum hydro", "gen"])
+        self.assertEqual(analysis["keyword_matches"]["quantum"]["count"], 1)
+        self.assertEqual(analysis["keyword_matches"]["hydrogen"]["count"], 1)
+
+    def test_base64_chunks_match_b64decode(self):
+        """Test chunked base64 decoding equals b64decode, with line breaks and bad padding."""
+        encoded = base64.encodebytes(self.TEXT.encode("utf-8")).decode()
+        for size in (1, 3, 5, 64, len(encoded)):
+            self.assertEqual(b"".join(iter_base64_chunks(encoded, size)), base64.b64decode(encoded))
+        with self.assertRaises(ValueError):
+            list(iter_base64_chunks("QUJDR", 2))
+
+    def test_process_file_upload(self):
+        """Test base64 uploads are decoded and plain text is used as-is."""
+        for content, text in ((base64.b64encode(self.TEXT.encode("utf-8")).decode(), self.TEXT),
+                              ("plain text, not base64!", "plain text, not base64!")):
+            token = process_file_upload(content, "notes.txt")
+            self.assertNotIn("raw_text", token)
+            self.assertEqual(load_token(token["hash"])["raw_text"], text)
+            self.assertEqual(token["score"], score_content(text)[0])
+
+    def test_build_token_stream_writes_full_token(self):
+        """Test the streamed token file holds the raw text and score."""
+        token = build_token_stream(self.chunked(self.TEXT, 5), filename="notes.txt")
+        self.assertNotIn("raw_text", token)
+
+        saved = load_token(token["hash"])
+        self.assertEqual(saved["raw_text"], self.TEXT)
+        self.assertEqual(saved["score"], score_content(self.TEXT)[0])
+        self.assertEqual(saved["filename"], "notes.txt")
+
+
+class TestPendingQueue(unittest.TestCase):
+    """Test the append-only pending token queue."""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.test_dir, "session_buffer.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_enqueue_and_ack(self):
+        """Test pending order, de-duplication and acknowledgement."""
+        queue = PendingQueue(self.log_path, fsync=False)
+        queue.enqueue(["a1", "b2", "a1"])
+        queue.enqueue(["c3"])
+        self.assertEqual(queue.pending(), ["a1", "b2", "c3"])
+
+        queue.ack(["a1", "c3"])
+        self.assertEqual(queue.pending(), ["b2"])
+        self.assertEqual(PendingQueue(self.log_path).pending(), ["b2"])
+
+    def test_compaction_keeps_pending(self):
+        """Test the log is compacted once mostly acknowledged."""
+        queue = PendingQueue(self.log_path, fsync=False, compact_threshold=256)
+        hashes = [f"{i:064x}" for i in range(20)]
+        queue.enqueue(hashes)
+        queue.ack(hashes[:-1])
+
+        self.assertEqual(queue.pending(), hashes[-1:])
+        self.assertLess(os.path.getsize(self.log_path), 100)
+
+    def test_torn_record_is_skipped(self):
+        """Test a partially written last record does not corrupt the queue."""
+        queue = PendingQueue(self.log_path, fsync=False)
+        queue.enqueue(["a1"])
+        with open(self.log_path, "a") as f:
+            f.write("+half")
+        queue.enqueue(["b2"])
+        self.assertEqual(queue.pending(), ["a1", "b2"])
+
+    def test_migrates_json_buffer(self):
+        """Test a legacy session_buffer.json is imported once."""
+        legacy = os.path.join(self.test_dir, "session_buffer.json")
+        with open(legacy, "w") as f:
+            json.dump({"pending": ["old1", "old2"]}, f)
+
+        queue = PendingQueue(self.log_path, fsync=False)
+        self.assertEqual(queue.pending(), ["old1", "old2"])
+        self.assertFalse(os.path.exists(legacy))
+
+
+class TestTokenValuator(unittest.TestCase):
+    """Test the cart082 valuator, inline and in a process pool."""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.saved = valuator.TOKENS_DIR, valuator.BUFFER
+        valuator.TOKENS_DIR = os.path.join(self.test_dir, "tokens")
+        valuator.BUFFER = os.path.join(self.test_dir, "session_buffer.log")
+        valuator._store = None
+        os.makedirs(valuator.TOKENS_DIR)
+
+        # Half the tokens are JSON files, half only in the token store
+        self.tokens = [{"hash": f"{i:064x}", "raw_text": "quantum plasma " * (i % 40 + 1)} for i in range(300)]
+        for token in self.tokens[::2]:
+            with open(os.path.join(valuator.TOKENS_DIR, f"{token['hash']}.json"), "w") as f:
+                json.dump(token, f)
+        store = store_for(valuator.TOKENS_DIR, fsync=False)
+        store.put_many(self.tokens[1::2])
+        store.close()
+
+        self.missing = "f" * 64
+        self.queue = PendingQueue(valuator.BUFFER, fsync=False)
+        self.queue.enqueue([t["hash"] for t in self.tokens[:150]] + [self.missing] +
+                           [t["hash"] for t in self.tokens[150:]])
+
+    def tearDown(self):
+        valuator.TOKENS_DIR, valuator.BUFFER = self.saved
+        valuator._store = None
+        shutil.rmtree(self.test_dir)
+
+    def run_valuator(self, *args):
+        with contextlib.redirect_stdout(io.StringIO()):
+            valuator.main(list(args))
+        valuator._store = None
+
+    def assert_valuated(self):
+        store = store_for(valuator.TOKENS_DIR)
+        for i, token in enumerate(self.tokens):
+            if i % 2 == 0:
+                with open(os.path.join(valuator.TOKENS_DIR, f"{token['hash']}.json")) as f:
+                    saved = json.load(f)
+            else:
+                saved = store.get(token["hash"])
+            score = valuator.score_text(token["raw_text"])
+            self.assertEqual((saved["score"], saved["value"]), (score, valuator.scale_value(score)))
+        # Only the hash with no token file is left queued
+        self.assertEqual(PendingQueue(valuator.BUFFER).pending(), [self.missing])
+
+    def test_inline(self):
+        """Test serial valuation rescores every token and acks all but the missing one."""
+        self.run_valuator("--chunk-size", "32")
+        self.assert_valuated()
+
+    def test_pool(self):
+        """Test pool valuation gives the same values and the same partial ack."""
+        self.run_valuator("--workers", "4", "--chunk-size", "16")
+        self.assert_valuated()
+
+    def test_pool_results_match_inline(self):
+        """Test valuate_pending reports the same results with and without a pool."""
+        pending = self.queue.pending()
+        pooled = [r for chunk in valuator.valuate_pending(pending, workers=4, chunk_size=16) for r in chunk]
+        valuator._store = None
+        inline = [r for chunk in valuator.valuate_pending(pending, chunk_size=16) for r in chunk]
+        self.assertEqual(sorted(pooled), sorted(inline))
+        self.assertEqual(len(inline), 301)
+        self.assertIn((self.missing, None, "missing token file"), inline)
+
+
+class TestTokenStore(unittest.TestCase):
+    """Test the segment-file token store."""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.store_dir = os.path.join(self.test_dir, "tokens.store")
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_put_get_and_reopen(self):
+        """Test rewrites and deletes are visible after reopening."""
+        store = TokenStore(self.store_dir, fsync=False)
+        store.put_many([{"hash": "a1", "v": 1}, {"hash": "b2", "v": 2}, {"hash": "c3", "v": 3}])
+        store.put({"hash": "a1", "v": 10})
+        store.delete("b2")
+
+        reopened = TokenStore(self.store_dir, use_mmap=True)
+        self.assertEqual(reopened.get("a1"), {"hash": "a1", "v": 10})
+        self.assertIsNone(reopened.get("b2"))
+        self.assertEqual(dict(reopened.scan()), {"c3": {"hash": "c3", "v": 3}, "a1": {"hash": "a1", "v": 10}})
+
+        # Writes from another handle are picked up without reopening
+        store.put({"hash": "d4"})
+        self.assertIn("d4", reopened)
+
+    def test_torn_index_and_compaction(self):
+        """Test a torn index tail is ignored and compaction keeps live tokens."""
+        store = TokenStore(self.store_dir, fsync=False, segment_size=64)
+        for i in range(10):
+            store.put({"hash": f"t{i}", "v": i})
+            store.put({"hash": f"t{i}", "v": -i})
+        with open(store.index_path, "ab") as f:
+            f.write(b"\x05\x00torn")
+
+        store = TokenStore(self.store_dir, fsync=False, segment_size=64)
+        store.put({"hash": "t10", "v": -10})
+        store.compact()
+        self.assertEqual(len(store), 11)
+        self.assertEqual(TokenStore(self.store_dir).get("t7"), {"hash": "t7", "v": -7})
+
+    def test_iter_tokens_and_export(self):
+        """Test stored tokens and loose files are listed once each and exported."""
+        tokens_dir = os.path.join(self.test_dir, "tokens")
+        os.makedirs(tokens_dir)
+        with open(os.path.join(tokens_dir, "loose.json"), "w") as f:
+            json.dump({"hash": "loose"}, f)
+        store = store_for(tokens_dir, fsync=False)
+        store.put({"hash": "packed"})
+
+        found = dict(iter_tokens(tokens_dir))
+        self.assertEqual(found, {"packed.json": {"hash": "packed"}, "loose.json": {"hash": "loose"}})
+
+        self.assertEqual(store.export_json(tokens_dir), 1)
+        with open(os.path.join(tokens_dir, "packed.json")) as f:
+            self.assertEqual(json.load(f), {"hash": "packed"})
+        self.assertEqual(len(dict(iter_tokens(tokens_dir))), 2)
+
+
+class TestResearchIndexer(unittest.TestCase):
+    """Test incremental research index builds."""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.tokens_dir = os.path.join(self.test_dir, "tokens")
+        self.index_path = os.path.join(self.test_dir, "research_index.json")
+        os.makedirs(self.tokens_dir)
+        self.parsed = []
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def make_record(self, fname, data):
+        self.parsed.append(fname)
+        return {"hash": data["hash"], "title": data.get("title", ""), "timestamp": data["timestamp"]}
+
+    def write_token(self, token_hash, timestamp, title=""):
+        with open(os.path.join(self.tokens_dir, f"{token_hash}.json"), "w") as f:
+            json.dump({"hash": token_hash, "timestamp": timestamp, "title": title}, f)
+
+    def update(self, full=False):
+        indexer = IncrementalIndexer(self.index_path, [IndexSource("tokens", self.tokens_dir, self.make_record)])
+        self.parsed = []
+        return indexer.update(full=full)
+
+    def test_only_changes_are_reparsed(self):
+        """Test adds, edits and removals are merged without rereading the rest."""
+        with open(self.index_path, "w") as f:
+            json.dump([{"hash": "other", "url": "infinity_tokens/other.json", "timestamp": "125"}], f)
+        for i in range(5):
+            self.write_token(f"t{i}", f"1{i}")
+        self.update()
+        self.assertEqual(len(self.parsed), 5)
+
+        records, stats = self.update()
+        self.assertEqual(self.parsed, [])
+        self.assertFalse(stats["written"])
+
+        self.write_token("t1", "30", title="edited")
+        os.remove(os.path.join(self.tokens_dir, "t2.json"))
+        store_for(self.tokens_dir, fsync=False).put({"hash": "s1", "timestamp": "00"})
+        records, stats = self.update()
+        self.assertEqual(sorted(self.parsed), ["s1.json", "t1.json"])
+
+        # Same result as a full rebuild, and other sources' records are kept
+        self.assertEqual(records, self.update(full=True)[0])
+        self.assertEqual([r["hash"] for r in records], ["s1", "t0", "other", "t3", "t4", "t1"])
+        self.assertEqual(records[-1]["url"], "tokens/t1.json")
+
+    def test_syncer_exports_stored_tokens(self):
+        """Test the portal index sync writes the JSON file of a token that is only in the store."""
+        token = {"hash": "s1", "timestamp": "1", "research": "[x] Quantum notes"}
+        store_for(self.tokens_dir, fsync=False).put(token)
+        self.write_token("t0", "0")
+        syncer = ResearchIndexSyncer(TokenHashManager(os.path.join(self.test_dir, "category_tokens.json")))
+        syncer.tokens_dir = self.tokens_dir
+        syncer.research_index_path = self.index_path
+
+        records = syncer.sync_index()
+        self.assertEqual([r["url"] for r in records], ["tokens/t0.json", "tokens/s1.json"])
+        with open(os.path.join(self.tokens_dir, "s1.json")) as f:
+            self.assertEqual(json.load(f), token)
+        self.assertEqual(syncer.sync_index(), records)
+
+    def test_external_index_write_forces_rebuild(self):
+        """Test an index rewritten by something else is rebuilt from the sources."""
+        self.write_token("t0", "1")
+        self.update()
+        with open(self.index_path, "w") as f:
+            json.dump([], f)
+        records, _ = self.update()
+        self.assertEqual([r["hash"] for r in records], ["t0"])
+
+
+class TestUserStore(unittest.TestCase):
+    """Test the write-behind users/sessions store."""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.users_path = os.path.join(self.test_dir, "users.json")
+        with open(self.users_path, "w") as f:
+            json.dump({"users": {"bob": {"token_count": 0, "tokens_created": []}}, "sessions": {}}, f)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def open_store(self):
+        return UserStore(self.users_path, snapshot_interval=0, fsync=False)
+
+    def test_log_replay_is_idempotent(self):
+        """Test unsaved ops survive a restart and replaying them twice changes nothing."""
+        store = self.open_store()
+        store.put_session("s1", {"username": "bob"})
+        self.assertEqual(store.add_user_tokens("bob", [{"hash": "h1"}]), 1)
+        self.assertEqual(store.add_user_tokens("bob", [{"hash": "h2"}, {"hash": "h3"}]), 3)
+        self.assertEqual(store.add_user_tokens("nobody", [{"hash": "h4"}]), 0)
+
+        # Snapshot written but log not truncated, as after a crash in between
+        with open(store.log_path) as f:
+            log = f.read()
+        store.snapshot()
+        with open(store.log_path, "w") as f:
+            f.write(log)
+
+        restarted = self.open_store()
+        bob = restarted.get_user("bob")
+        self.assertEqual(bob["token_count"], 3)
+        self.assertEqual([t["hash"] for t in bob["tokens_created"]], ["h1", "h2", "h3"])
+        self.assertEqual(restarted.get_session("s1"), {"username": "bob"})
+
+    def test_external_rewrite_is_merged(self):
+        """Test users.json rewritten by another program is reloaded with our ops on top."""
+        store = self.open_store()
+        store.put_session("s1", {"username": "bob"})
+        with open(self.users_path) as f:
+            data = json.load(f)
+        data["users"]["cli"] = {"token_count": 0}
+        with open(self.users_path, "w") as f:
+            json.dump(data, f)
+
+        self.assertIsNotNone(store.get_user("cli"))
+        self.assertIsNotNone(store.get_session("s1"))
+        store.delete_session("s1")
+        store.snapshot()
+        with open(self.users_path) as f:
+            saved = json.load(f)
+        self.assertIn("cli", saved["users"])
+        self.assertEqual(saved["sessions"], {})
+
+
+    def test_shared_stores_see_each_other(self):
+        """Test two shared stores on one file (two workers) see each other's ops at once."""
+        first = UserStore(self.users_path, snapshot_interval=0, fsync=False, shared=True)
+        second = UserStore(self.users_path, snapshot_interval=0, fsync=False, shared=True)
+        first.put_session("s1", {"username": "bob"})
+        self.assertEqual(second.get_session("s1"), {"username": "bob"})
+
+        self.assertEqual(second.add_user_tokens("bob", [{"hash": "h1"}]), 1)
+        self.assertEqual(first.add_user_tokens("bob", [{"hash": "h2"}]), 2)
+        first.snapshot()
+        second.put_session("s2", {"username": "bob"})
+        self.assertIsNotNone(first.get_session("s2"))
+        second.snapshot()
+
+        bob = self.open_store().get_user("bob")
+        self.assertEqual([t["hash"] for t in bob["tokens_created"]], ["h1", "h2"])
+        self.assertEqual(set(first.export()["sessions"]), {"s1", "s2"})
+
+
+class TestSharedState(unittest.TestCase):
+    """Test the state shared between auth server workers."""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.test_dir, "state.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_sqlite_backend_is_one_server(self):
+        """Test limits, magic links and job results are visible to every worker."""
+        first, second = SharedState("sqlite", self.path), SharedState("sqlite", self.path)
+        self.assertTrue(first.multi_process)
+        self.assertTrue(first.rate_limiter.allow("ip:1", 1))
+        self.assertFalse(second.rate_limiter.allow("ip:1", 1))
+
+        token, _ = first.magic_links.issue("a@b.c")
+        self.assertEqual(second.magic_links.consume(token), (magic_link_store.VALID, "a@b.c"))
+
+        jobs = TokenJobs(workers=1, registry=first.job_registry)
+        try:
+            job = jobs.submit("bob", ["shared job"])
+            for _ in range(500):
+                seen = second.job_registry.get(job["id"])
+                if seen["status"] == "done":
+                    break
+                time.sleep(0.01)
+        finally:
+            jobs.shutdown()
+        self.assertEqual(seen["owner"], "bob")
+        self.assertEqual(len(seen["result"]["tokens"]), 1)
+
+    def test_running_status_is_shared(self):
+        """Test another worker sees a job go from queued to running to done."""
+        first, second = SharedState("sqlite", self.path), SharedState("sqlite", self.path)
+        started, release = threading.Event(), threading.Event()
+
+        def blocked_build(texts, source_type, filenames):
+            started.set()
+            release.wait(5)
+            return [{"hash": "h"}]
+
+        original = token_jobs.run_build
+        token_jobs.run_build = blocked_build
+        jobs = TokenJobs(workers=1, registry=first.job_registry)
+        try:
+            job = jobs.submit("bob", ["slow job"])
+            self.assertTrue(started.wait(5))
+            self.assertEqual(second.job_registry.get(job["id"])["status"], "running")
+            release.set()
+            for _ in range(500):
+                if second.job_registry.get(job["id"])["status"] == "done":
+                    break
+                time.sleep(0.01)
+        finally:
+            release.set()
+            token_jobs.run_build = original
+            jobs.shutdown()
+        self.assertEqual(second.job_registry.get(job["id"])["status"], "done")
+
+    def test_memory_backend_and_launcher_env(self):
+        """Test the memory backend stays local and the launcher refuses it for several workers."""
+        state = SharedState("memory")
+        self.assertFalse(state.multi_process)
+        self.assertIsNone(state.job_registry)
+        with self.assertRaises(ValueError):
+            SharedState("redis")
+
+        with self.assertRaises(ValueError):
+            worker_env(4, {"STATE_BACKEND": "memory"}, cores=4)
+        with contextlib.redirect_stdout(io.StringIO()):
+            env = worker_env(4, {}, cores=8)
+        self.assertEqual(env["STATE_BACKEND"], "sqlite")
+        self.assertEqual(env["TOKEN_JOB_WORKERS"], "2")
+        self.assertEqual(len(env["SESSION_SECRET"]), 64)
+        self.assertEqual(worker_env(1, {"SESSION_SECRET": "x"}, cores=2), {"TOKEN_JOB_WORKERS": "2"})
+
+    def test_env_example_starts_several_workers(self):
+        """Test the .env that start_server.sh copies from .env.example works with one worker per core."""
+        example = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env.example")
+        env = {k: v for k, v in dotenv_values(example).items() if v is not None}
+        self.assertEqual(worker_env(4, env, cores=4)["STATE_BACKEND"], "sqlite")
+
+
+class TestCommitLog(unittest.TestCase):
+    """Test the month-partitioned login commit log."""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.test_dir, "login_commits")
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def commit(self, username, timestamp, action="login"):
+        return {"username": username, "timestamp": timestamp, "action": action}
+
+    def test_latest_newest_first(self):
+        """Test latest returns only the user's commits, newest first, up to the limit."""
+        log = CommitLog(self.root, legacy_path=None)
+        log.append_many([
+            self.commit("alice", f"2026-09-{day:02d}T00:00:00Z", f"a{day}") for day in range(1, 21)
+        ])
+        log.append(self.commit("bob", "2026-10-01T00:00:00Z"))
+        log.append(self.commit("alice", "2026-10-02T00:00:00Z", "latest"))
+
+        latest = log.latest("alice", limit=5)
+        self.assertEqual([c["action"] for c in latest], ["latest", "a20", "a19", "a18", "a17"])
+        self.assertEqual(len(log.latest("alice", limit=100)), 21)
+        self.assertEqual(len(log.latest("bob")), 1)
+        self.assertEqual(log.latest("nobody"), [])
+
+    def test_rotation_archives_old_months(self):
+        """Test partitions older than keep_months are gzipped and dropped from the indexes."""
+        log = CommitLog(self.root, legacy_path=None, keep_months=2)
+        log.append(self.commit("alice", "2026-01-15T00:00:00Z", "old"))
+        log.append(self.commit("alice", "2026-03-15T00:00:00Z", "kept"))
+        log.append(self.commit("alice", "2026-04-01T00:00:00Z", "new"))
+
+        self.assertTrue(os.path.exists(os.path.join(self.root, "archive", "2026-01.jsonl.gz")))
+        self.assertFalse(os.path.exists(os.path.join(self.root, "2026-01.jsonl")))
+        self.assertEqual([c["action"] for c in log.latest("alice")], ["new", "kept"])
+        self.assertEqual([c["action"] for c in log.iter_commits()], ["kept", "new"])
+
+    def test_legacy_json_imported_once(self):
+        """Test login_commits.json is imported on first open and not again."""
+        legacy = os.path.join(self.test_dir, "login_commits.json")
+        with open(legacy, "w") as f:
+            json.dump({"commits": [
+                self.commit("alice", "2025-01-02T00:00:00Z", "second"),
+                self.commit("alice", "2025-01-01T00:00:00Z", "first"),
+            ]}, f)
+
+        log = CommitLog(self.root, legacy_path=legacy)
+        self.assertEqual([c["action"] for c in log.latest("alice")], ["second", "first"])
+        CommitLog(self.root, legacy_path=legacy)
+        self.assertEqual(len(list(log.iter_commits())), 2)
+
+
+class TestRateLimiter(unittest.TestCase):
+    """Test the token-bucket rate limiters."""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.now = 1000.0
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def clock(self):
+        return self.now
+
+    def check_bucket(self, limiter):
+        # A burst of the limit, then one token per per / limit seconds
+        self.assertEqual([limiter.allow("a", 5, 60) for _ in range(6)], [True] * 5 + [False])
+        self.assertAlmostEqual(limiter.hit("a", 5, 60), 12.0)
+        self.assertTrue(limiter.allow("b", 5, 60))
+        self.now += 12
+        self.assertTrue(limiter.allow("a", 5, 60))
+        self.assertFalse(limiter.allow("a", 5, 60))
+
+    def test_memory_bucket_and_eviction(self):
+        """Test the in-memory limiter refills steadily and only tracks throttled keys."""
+        limiter = MemoryRateLimiter(max_keys=3, clock=self.clock)
+        self.check_bucket(limiter)
+
+        self.now += 60
+        limiter.allow("c", 5, 60)
+        self.assertEqual(len(limiter), 1)  # a and b are full again
+        for key in "defg":
+            limiter.allow(key, 5, 60)
+        self.assertEqual(len(limiter), 3)
+        self.assertEqual(limiter.hit("c", 1, 60), 0.0)  # evicted, so a fresh bucket
+
+    def test_sqlite_bucket_is_shared(self):
+        """Test two SQLite limiters on one file enforce a single budget."""
+        path = os.path.join(self.test_dir, "limits.db")
+        self.check_bucket(SQLiteRateLimiter(path, clock=self.clock))
+
+        first = SQLiteRateLimiter(path, clock=self.clock)
+        second = SQLiteRateLimiter(path, clock=self.clock)
+        self.assertTrue(first.allow("x", 2, 60))
+        self.assertTrue(second.allow("x", 2, 60))
+        self.assertFalse(first.allow("x", 2, 60))
+        first.reset("x")
+        self.assertTrue(second.allow("x", 2, 60))
+
+
+class TestMagicLinkStore(unittest.TestCase):
+    """Test the expiry-indexed magic-link token stores."""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.now = 1000.0
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def clock(self):
+        return self.now
+
+    def check_store(self, store):
+        token, expires_at = store.issue("a@b.c")
+        self.assertEqual(expires_at, 1900.0)
+        self.assertEqual(store.consume(token), (magic_link_store.VALID, "a@b.c"))
+        self.assertEqual(store.consume(token), (magic_link_store.INVALID, None))
+        self.assertEqual(len(store), 0)
+
+        late, _ = store.issue("late@b.c", ttl=10)
+        self.now += 11
+        self.assertEqual(store.consume(late), (magic_link_store.EXPIRED, "late@b.c"))
+
+        for i in range(5):
+            store.issue(f"u{i}@b.c", ttl=i * 100)
+        self.now += 250
+        self.assertEqual(store.purge(), 3)
+        self.assertEqual(len(store), 2)
+        store.issue("new@b.c")
+        self.assertEqual(len(store), 3)
+
+    def test_memory_store(self):
+        """Test tokens are single-use and expire through the heap."""
+        self.check_store(MemoryMagicLinkStore(900, clock=self.clock))
+
+    def test_sqlite_store_is_shared(self):
+        """Test a token issued by one worker is consumed once by another."""
+        path = os.path.join(self.test_dir, "links.db")
+        self.check_store(SQLiteMagicLinkStore(path, 900, clock=self.clock))
+
+        token, _ = SQLiteMagicLinkStore(path, clock=self.clock).issue("x@b.c")
+        other = SQLiteMagicLinkStore(path, clock=self.clock)
+        self.assertEqual(other.consume(token), (magic_link_store.VALID, "x@b.c"))
+        self.assertEqual(other.consume(token)[0], magic_link_store.INVALID)
+
+
+class TestTokenJobs(unittest.TestCase):
+    """Test the background token build queue."""
+
+    def setUp(self):
+        self.jobs = TokenJobs(workers=1, max_queue=2, on_done=lambda job, tokens: {"tokens": tokens})
+
+    def tearDown(self):
+        self.jobs.shutdown()
+
+    def wait_for(self, job_id):
+        for _ in range(500):
+            job = self.jobs.get(job_id)
+            if job["status"] in ("done", "failed"):
+                return job
+            time.sleep(0.01)
+        self.fail("job did not finish")
+
+    def test_builds_in_both_lanes(self):
+        """Test small and large jobs both finish with token summaries."""
+        small = self.jobs.submit("bob", ["quantum notes"], "text", ["a.txt"])
+        large = self.jobs.submit("bob", ["x" * (token_jobs.SMALL_JOB_SIZE + 1)])
+        self.assertEqual(small["status"], "queued")
+
+        for job_id, count in ((small["id"], 1), (large["id"], 1)):
+            job = self.wait_for(job_id)
+            self.assertEqual(job["status"], "done")
+            tokens = job["result"]["tokens"]
+            self.assertEqual(len(tokens), count)
+            self.assertNotIn("raw_text", tokens[0])
+            self.assertGreater(tokens[0]["score"], 0)
+        self.assertEqual(self.jobs.pending(), 0)
+        self.assertIsNone(self.jobs.get("nope"))
+
+    def test_queue_depth_and_failures(self):
+        """Test submit refuses work past max_queue and failed builds report their error."""
+        release = threading.Event()
+
+        def blocked_build(texts, source_type, filenames):
+            release.wait(5)
+            raise ValueError("bad input")
+
+        original = token_jobs.run_build
+        token_jobs.run_build = blocked_build
+        try:
+            first = self.jobs.submit("bob", ["a"])
+            self.jobs.submit("bob", ["b"])
+            self.assertIsNone(self.jobs.submit("bob", ["c"]))
+            release.set()
+            job = self.wait_for(first["id"])
+        finally:
+            token_jobs.run_build = original
+        self.assertEqual(job["status"], "failed")
+        self.assertEqual(job["error"], "bad input")
+
+    def test_broken_large_pool_is_replaced(self):
+        """Test a large lane whose pool broke is rebuilt instead of failing every later job."""
+        class BrokenLane:
+            def submit(self, *args):
+                raise token_jobs.BrokenProcessPool("a worker died")
+
+            def shutdown(self, wait=True):
+                pass
+
+        self.jobs._large = BrokenLane()
+        with contextlib.redirect_stdout(io.StringIO()):
+            job = self.jobs.submit("bob", ["x" * (token_jobs.SMALL_JOB_SIZE + 1)])
+        self.assertEqual(self.wait_for(job["id"])["status"], "done")
+        self.assertNotIsInstance(self.jobs._large, BrokenLane)
+
+
+class TestStaticVariants(unittest.TestCase):
+    """Test precompressed, ETag-validated portal files."""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.test_dir, "research_index.json")
+        self.data = json.dumps([{"hash": str(i), "title": "Quantum notes"} for i in range(200)]).encode()
+        with open(self.path, "wb") as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_variants_and_negotiation(self):
+        """Test the build's variants are served by encoding, and a matching ETag gets 304."""
+        written = write_variants(self.path)
+        self.assertTrue(variants_fresh(self.path))
+        with open(self.path + ".gz", "rb") as f:
+            self.assertEqual(gzip.decompress(f.read()), self.data)
+        self.assertLess(written["gzip"], len(self.data))
+        self.assertEqual(os.path.exists(self.path + ".br"), static_variants.BROTLI_AVAILABLE)
+
+        static = StaticFile(self.path)
+        self.assertEqual(static.mimetype, "application/json")
+        status, body, headers = static.negotiate(None, "gzip, deflate")
+        self.assertEqual((status, body), (200, self.path + ".gz"))
+        self.assertEqual(headers["Content-Encoding"], "gzip")
+        self.assertEqual(headers["ETag"], f'"{written["etag"]}-gzip"')
+        self.assertEqual(headers["Vary"], "Accept-Encoding")
+
+        status, body, headers = static.negotiate(None, "gzip;q=0, identity")
+        self.assertEqual((status, body), (200, self.path))
+        self.assertNotIn("Content-Encoding", headers)
+
+        for etag in (f'"{written["etag"]}-gzip"', f'W/"{written["etag"]}"', '"other", *'):
+            status, body, _ = static.negotiate(etag, "gzip")
+            self.assertEqual((status, body), (304, None))
+        self.assertEqual(static.negotiate('"other"', "gzip")[0], 200)
+
+    def test_changed_file_without_variants(self):
+        """Test a file rewritten after its variants is hashed and gzipped in memory."""
+        write_variants(self.path)
+        static = StaticFile(self.path)
+        old_etag = static.negotiate()[2]["ETag"]
+
+        new_data = self.data.replace(b"Quantum", b"Photon!")
+        with open(self.path, "wb") as f:
+            f.write(new_data)
+        os.utime(self.path, ns=(1, 1))
+        self.assertFalse(variants_fresh(self.path))
+
+        status, body, headers = static.negotiate(old_etag, "gzip")
+        self.assertEqual(status, 200)
+        self.assertEqual(gzip.decompress(body), new_data)
+        self.assertNotEqual(headers["ETag"], old_etag)
+        self.assertEqual(static.negotiate(headers["ETag"], "gzip")[0], 304)
+
+
+class TestCrawler(unittest.TestCase):
+    """Test the concurrent crawler against a local HTTP server."""
+
+    def setUp(self):
+
+        self.lock = threading.Lock()
+        self.active = {}
+        self.peak = {}
+        self.hits = []
+        test = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                host = self.headers.get("Host", "").split(":")[0]
+                with test.lock:
+                    test.hits.append(self.path)
+                    test.active[host] = test.active.get(host, 0) + 1
+                    test.peak[host] = max(test.peak.get(host, 0), test.active[host])
+                time.sleep(0.01)
+                n = int(self.path.strip("/") or 0)
+                # Each page links to the next five on both host names
+                links = "".join(
+                    f'<a href="http://{h}:{test.port}/{m}">x</a>'
+                    for m in range(n + 1, n + 6) for h in ("127.0.0.1", "localhost")
+                )
+                body = f"<html>{links}</html>".encode() if n % 7 != 3 else b""
+                self.send_response(200 if body else 404)
+                self.end_headers()
+                self.wfile.write(body)
+                with test.lock:
+                    test.active[host] -= 1
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        def fetch(url):
+            try:
+                with urllib.request.urlopen(url, timeout=5) as r:
+                    return r.read().decode()
+            except OSError:
+                return None
+
+        self.fetch = fetch
+        self.get_links = lambda html: re.findall(r'href="([^"]+)"', html)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_page_limit_and_dedup(self):
+        """Test the crawl stops at max_pages and never fetches a URL twice."""
+        seed = f"http://127.0.0.1:{self.port}/0"
+        pages = Crawler(self.fetch, self.get_links, 40, concurrency=8, per_host=2).crawl([seed])
+
+        self.assertEqual(len(pages), 40)
+        self.assertEqual(pages[0][0], seed)
+        self.assertEqual(len({url for url, _ in pages}), 40)
+        self.assertTrue(all(html for _, html in pages))
+
+    def test_per_host_limit(self):
+        """Test no host ever sees more than per_host concurrent requests."""
+        seed = f"http://127.0.0.1:{self.port}/0"
+        Crawler(self.fetch, self.get_links, 60, concurrency=8, per_host=2).crawl([seed])
+
+        self.assertEqual(set(self.peak), {"127.0.0.1", "localhost"})
+        self.assertLessEqual(max(self.peak.values()), 2)
+
+    def test_streaming_pages(self):
+        """Test on_page receives every page when pages are not collected."""
+        seen = []
+        crawler = Crawler(self.fetch, self.get_links, 15, concurrency=4,
+                          on_page=lambda url, html: seen.append(url), keep_pages=False)
+        self.assertEqual(crawler.crawl([f"http://127.0.0.1:{self.port}/0"]), [])
+        self.assertEqual(crawler.count, 15)
+        self.assertEqual(len(set(seen)), 15)
+
+    def test_frontier_exhausted(self):
+        """Test the crawl ends when there is nothing left to fetch."""
+        pages = Crawler(self.fetch, lambda html: [], 10, concurrency=4).crawl(
+            [f"http://127.0.0.1:{self.port}/{n}" for n in (0, 1, 1, 3)])
+        self.assertEqual(sorted(url[-1] for url, _ in pages), ["0", "1"])
+        self.assertEqual(len(self.hits), 3)
+
+
+class TestZipPackager(unittest.TestCase):
+    """Test the streaming zipcoin packager of the research scraper."""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.pages = [(f"http://x/{i}", f"<html><p>page {i} ∞</p></html>" * (i + 1)) for i in range(25)]
+        # The token id the scraper used when it joined every page in memory
+        joined = "".join(html for _, html in self.pages)
+        self.token_id = hashlib.sha256(joined.encode("utf-8")).hexdigest()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def check_zip(self, path):
+        with zipfile.ZipFile(path) as zf:
+            for i, (_, html) in enumerate(self.pages, start=1):
+                self.assertEqual(zf.read(f"page_{i:04d}.html").decode("utf-8"), html)
+            manifest = json.loads(zf.read("manifest.json"))
+        self.assertEqual((manifest["token_id"], manifest["count"]), (self.token_id, len(self.pages)))
+
+    def test_build_zip_matches_joined_hash(self):
+        """Test the incremental token id equals the joined-content hash and the temp zip is renamed."""
+        token_id, path = research_scraper.build_zip(self.pages, save_dir=self.test_dir, blobs=False)
+        self.assertEqual(token_id, self.token_id)
+        self.assertEqual(path, os.path.join(self.test_dir, f"{token_id}.zip"))
+        self.assertEqual(os.listdir(self.test_dir), [f"{token_id}.zip"])
+        self.check_zip(path)
+
+    def test_abort_leaves_nothing(self):
+        """Test an aborted packager removes its .building-*.tmp file."""
+        packager = research_scraper.ZipPackager(self.test_dir, blobs=False)
+        packager.add(*self.pages[0])
+        self.assertTrue(os.listdir(self.test_dir)[0].startswith(".building-"))
+        packager.abort()
+        self.assertEqual(os.listdir(self.test_dir), [])
+
+    def test_blob_manifest(self):
+        """Test with blobs the packager writes only a manifest that materializes to the same zip."""
+        store = BlobStore(os.path.join(self.test_dir, "blobs"))
+        save_dir = os.path.join(self.test_dir, "zipcoins")
+        os.makedirs(save_dir)
+        token_id, path = research_scraper.build_zip(self.pages, save_dir=save_dir, blobs=True, store=store)
+        self.assertEqual(token_id, self.token_id)
+        self.assertEqual(os.listdir(save_dir), [f"{token_id}.zip.manifest.json"])
+        self.assertEqual(path, os.path.join(save_dir, f"{token_id}.zip.manifest.json"))
+        self.check_zip(blob_store.materialize(path, store=store))
+
+
+@unittest.skipIf(research_engine is None, "colorama not installed")
+class TestResearchEngine(unittest.TestCase):
+    """Test batch sealing, notes and the headless pipeline of the research engine."""
+
+    PATCHED = ("TOKENS_DIR", "ZIPS_DIR", "COUNTER_FILE", "SOURCES_FILE", "TOKENS_PER_BATCH",
+               "fetch", "flush_batch", "git_push")
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.saved = {name: getattr(research_engine, name) for name in self.PATCHED}
+        research_engine.TOKENS_DIR = os.path.join(self.test_dir, "infinity_tokens")
+        research_engine.ZIPS_DIR = os.path.join(self.test_dir, "infinity_zips")
+        research_engine.COUNTER_FILE = os.path.join(self.test_dir, "counter.json")
+        research_engine.SOURCES_FILE = os.path.join(self.test_dir, "sources.txt")
+        research_engine.TOKENS_PER_BATCH = 100
+
+        self.fetched = []
+        self.sealed = []
+        self.pushed = []
+
+        def fetch(url):
+            self.fetched.append(url)
+            if url.endswith("/down"):
+                return None
+            # 10 sentences of 4 words: 50 estimated tokens per page
+            return "<p>" + "Plasma lattice photon vector. " * 10 + "</p>"
+
+        research_engine.fetch = fetch
+        research_engine.flush_batch = lambda batch, idx, push=True: self.sealed.append((idx, list(batch)))
+        research_engine.git_push = self.pushed.append
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(research_engine, name, value)
+        shutil.rmtree(self.test_dir)
+
+    def write_sources(self, urls):
+        with open(research_engine.SOURCES_FILE, "w") as f:
+            f.write("\n".join(urls) + "\n")
+
+    def run_headless(self, notes_path=None, workers=1):
+        with contextlib.redirect_stdout(io.StringIO()):
+            research_engine.headless_main(concurrency=4, per_host=2, workers=workers,
+                                          notes_path=notes_path or os.path.join(self.test_dir, "none.tsv"))
+        with open(research_engine.COUNTER_FILE) as f:
+            return json.load(f)
+
+    def test_seal_when_total_crosses_boundary(self):
+        """Test record_capsule asks for a seal only when the total crosses a TOKENS_PER_BATCH boundary."""
+        os.makedirs(research_engine.TOKENS_DIR)
+        counter = {"total_tokens": 0, "total_capsules": 0, "batch_index": 0}
+        store = store_for(research_engine.TOKENS_DIR, fsync=False)
+        batch = []
+        seals = []
+        for _ in range(5):
+            capsule = research_engine.make_capsule("http://x/Page", ["word " * 46])  # 59 tokens
+            seals.append(research_engine.record_capsule(capsule, counter, store, batch))
+        self.assertEqual(seals, [False, True, False, True, False])
+        self.assertEqual(counter["total_tokens"], 295)
+        self.assertEqual(len(batch), 5)
+        self.assertIsNotNone(store.get(batch[0]["hash"]))
+
+    def test_headless_seals_batches_and_pushes_once(self):
+        """Test headless mode seals each full batch, flushes the rest and syncs git once at the end."""
+        self.write_sources([f"http://127.0.0.1/{n}" for n in range(5)])
+        counter = self.run_headless()
+
+        self.assertEqual(counter["total_capsules"], 5)
+        self.assertEqual(counter["total_tokens"], 250)
+        self.assertEqual([(idx, len(batch)) for idx, batch in self.sealed], [(0, 2), (1, 2), (2, 1)])
+        self.assertEqual(counter["batch_index"], 3)
+        self.assertEqual(self.pushed, [[research_engine.COUNTER_FILE]])
+        self.assertEqual(len(os.listdir(research_engine.TOKENS_DIR)), 5)
+
+    def test_headless_extraction_pool(self):
+        """Test pages extracted in a worker pool give the same capsules as inline."""
+        self.write_sources([f"http://127.0.0.1/{n}" for n in range(5)])
+        counter = self.run_headless(workers=2)
+        self.assertEqual((counter["total_capsules"], counter["total_tokens"]), (5, 250))
+        self.assertEqual([(idx, len(batch)) for idx, batch in self.sealed], [(0, 2), (1, 2), (2, 1)])
+
+    def test_notes_file_is_reread_when_changed(self):
+        """Test notes come from the side file and a rewrite of it is picked up."""
+        path = os.path.join(self.test_dir, "notes.tsv")
+        notes = research_engine.NotesFile(path)
+        self.assertIsNone(notes.get("http://a"))
+        with open(path, "w") as f:
+            f.write("http://a\tfirst\nhttp://b\tbee\nhttp://a\tsecond\n")
+        os.utime(path, ns=(1, 1))
+        self.assertEqual((notes.get("http://a"), notes.get("http://b")), ("second", "bee"))
+        with open(path, "w") as f:
+            f.write("http://a\tthird\n")
+        os.utime(path, ns=(2, 2))
+        self.assertEqual((notes.get("http://a"), notes.get("http://b")), ("third", None))
+
+        self.write_sources(["http://127.0.0.1/0"])
+        self.run_headless(path)
+        self.assertEqual(self.sealed[0][1][0].get("notes"), None)
+        with open(path, "a") as f:
+            f.write("http://127.0.0.1/0\tmy note\n")
+        self.sealed.clear()
+        self.run_headless(path)
+        self.assertEqual(self.sealed[0][1][0]["notes"], "my note")
+
+    def test_failed_fetch_and_duplicate_urls(self):
+        """Test a failed fetch becomes the placeholder capsule and repeated URLs are fetched once."""
+        self.write_sources(["http://127.0.0.1/down", "http://127.0.0.1/0", "http://127.0.0.1/0"])
+        counter = self.run_headless()
+
+        self.assertEqual(sorted(self.fetched), ["http://127.0.0.1/0", "http://127.0.0.1/down"])
+        self.assertEqual(counter["total_capsules"], 2)
+        capsules = {c["source"]: c for _, batch in self.sealed for c in batch}
+        self.assertEqual(capsules["http://127.0.0.1/down"]["sentences"],
+                         ["No extractable text was found at fetch time."])
+        self.assertEqual(len(capsules["http://127.0.0.1/0"]["sentences"]), 10)
+
+
+class TestFastTokenEngine(unittest.TestCase):
+    """Test bulk and virtual micro generation."""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.saved = fast_engine.MASTER_DIR, fast_engine.MICRO_DIR
+        fast_engine.MASTER_DIR = os.path.join(self.test_dir, "zipcoins")
+        fast_engine.MICRO_DIR = os.path.join(self.test_dir, "zipcoins", "micro")
+
+    def tearDown(self):
+        fast_engine.MASTER_DIR, fast_engine.MICRO_DIR = self.saved
+        shutil.rmtree(self.test_dir)
+
+    def run_bulk(self, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return fast_engine.bulk_main(**kwargs)
+
+    def test_stub_json_matches_json_dumps(self):
+        """Test the hand-formatted stub JSON is what json.dumps writes for the same stub."""
+        for source in fast_engine.SOURCES[:3] + ['https://x/"quoted"/∞']:
+            for now in (time.time(), 1e-7, 1700000000.0, 0.25):
+                stub = {"source": source, "generated_at": now,
+                        "summary": fast_engine.STUB_SUMMARY, "placeholder": True}
+                self.assertEqual(fast_engine.stub_json(source, now),
+                                 (json.dumps(stub), json.dumps(stub, indent=2)))
+
+    def test_bulk_writes_micros_and_master(self):
+        """Test bulk mode writes every micro and a master hashed over their hashes."""
+        master_hash, master_path = self.run_bulk(count=10, batch_size=4)
+
+        micros = sorted(os.listdir(fast_engine.MICRO_DIR))
+        self.assertEqual(len(micros), 10)
+        with zipfile.ZipFile(master_path) as master:
+            self.assertIsNone(master.testzip())
+            index = json.loads(master.read("index.json"))
+            self.assertEqual([m["member"] for m in index["micros"]], micros)
+            with open(os.path.join(fast_engine.MICRO_DIR, micros[0]), "rb") as f:
+                self.assertEqual(master.read(micros[0]), f.read())
+
+        combined = "".join(m["sha"] for m in index["micros"])
+        self.assertEqual(master_hash, hashlib.sha256(combined.encode()).hexdigest())
+
+    def test_virtual_micros_only_in_master(self):
+        """Test virtual mode keeps micros inside the master, readable via the index."""
+        _, master_path = self.run_bulk(count=5, virtual=True)
+
+        self.assertEqual(os.listdir(fast_engine.MICRO_DIR), [])
+        with zipfile.ZipFile(master_path) as master:
+            entry = json.loads(master.read("index.json"))["micros"][2]
+            with zipfile.ZipFile(io.BytesIO(master.read(entry["member"]))) as micro:
+                stub = json.loads(micro.read("meta.json"))
+        self.assertEqual(hashlib.sha256(json.dumps(stub).encode()).hexdigest(), entry["sha"])
+        self.assertIn(stub["source"], fast_engine.SOURCES)
+
+
+class TestMasterFuser(unittest.TestCase):
+    """Test the pipelined master fuser against a local HTTP server."""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                n = int(self.path.strip("/"))
+                # Later pages answer first, so fetches finish out of order
+                time.sleep(0.002 * (8 - n))
+                body = f"<html><p>page {n}</p></html>".encode()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        base = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.saved = fuser.SOURCES, fuser.MICRO_DIR, fetch_cache.FETCH_CACHE_DIR
+        fuser.SOURCES = [f"{base}/{n}" for n in range(8)]
+        fuser.MICRO_DIR = os.path.join(self.test_dir, "micro")
+        os.makedirs(fuser.MICRO_DIR)
+        fetch_cache.FETCH_CACHE_DIR = os.path.join(self.test_dir, "fetch_cache")
+
+    def tearDown(self):
+        fuser.SOURCES, fuser.MICRO_DIR, fetch_cache.FETCH_CACHE_DIR = self.saved
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.test_dir)
+
+    def test_fetch_all_in_order(self):
+        """Test results come back numbered in order, each with its own URL's page."""
+        results = list(fuser.fetch_all(30, 6))
+        self.assertEqual([i for i, _, _ in results], list(range(1, 31)))
+        for _, url, html in results:
+            self.assertEqual(html, f"<html><p>page {url.rsplit('/', 1)[1]}</p></html>")
+
+    def test_master_renamed_to_sha(self):
+        """Test the temp master is renamed to <sha>.zip and holds every micro as it was added."""
+        master_dir = os.path.join(self.test_dir, "zipcoins")
+        os.makedirs(master_dir)
+        master = fuser.MasterWriter(master_dir, blobs=False)
+        micros = [(f"micro_{i:04d}.zip", fuser.micro_zip_bytes(f"u{i}", f"<p>{i}</p>")) for i in range(3)]
+        for name, data in micros:
+            master.add(name, data, [])
+        self.assertEqual(os.listdir(master_dir), [os.path.basename(master.tmp_path)])
+        sha, path = master.close()
+
+        self.assertEqual(sha, hashlib.sha256("".join(d.hex() for _, d in micros).encode()).hexdigest())
+        self.assertEqual(os.listdir(master_dir), [f"{sha}.zip"])
+        self.assertEqual(path, os.path.join(master_dir, f"{sha}.zip"))
+        with zipfile.ZipFile(path) as zf:
+            self.assertEqual([(n, zf.read(n)) for n in zf.namelist()], micros)
+
+    def test_master_hash_matches_serial(self):
+        """Test the pipeline gives the master hash the serial fuser computed from its micro files."""
+        master = fuser.MasterWriter(self.test_dir, blobs=False)
+        urls = []
+        for i, url, html in fuser.fetch_all(12, 4):
+            members = fuser.micro_members(url, html)
+            name = f"micro_{i:04d}.zip"
+            data = fuser.micro_zip_bytes(url, html)
+            fuser.write_micro(name, members, data)
+            master.add(name, data, members)
+            urls.append(url)
+        sha, path = master.close()
+
+        # The serial fuser: fetch one page at a time, then hash the micro files in order
+        micro_paths = []
+        for i, url in enumerate(urls, 1):
+            with urllib.request.urlopen(url, timeout=5) as r:
+                html = r.read().decode()
+            micro_path = os.path.join(fuser.MICRO_DIR, f"micro_{i:04d}.zip")
+            with zipfile.ZipFile(micro_path) as zf:
+                self.assertEqual(zf.read("source.txt").decode(), url)
+                self.assertEqual(zf.read("page.html").decode(), html)
+            micro_paths.append(micro_path)
+        combined = "".join(open(p, "rb").read().hex() for p in micro_paths)
+        self.assertEqual(sha, hashlib.sha256(combined.encode()).hexdigest())
+        self.assertTrue(os.path.exists(path))
+
+
+class TestBlobStore(unittest.TestCase):
+    """Test the content-addressed blob store and archive manifests."""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.store = BlobStore(os.path.join(self.test_dir, "blobs"))
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_put_dedups_normalized_content(self):
+        """Test equal JSON with different whitespace and CRLF text map to one blob."""
+        a = self.store.put(b'{"a": 1, "b": [1, 2]}')
+        b = self.store.put(b'{\n    "a": 1,\n    "b": [\n        1,\n        2\n    ]\n}')
+        self.assertEqual(a, b)
+        self.assertEqual(self.store.put(b"line\r\nline\r\n"), self.store.put(b"line\nline\n"))
+        self.assertEqual(json.loads(self.store.get(a)), {"a": 1, "b": [1, 2]})
+        self.assertEqual(self.store.stats()[0], 2)
+
+    def test_manifest_materialize_and_gc(self):
+        """Test a manifest with a nested zip materializes and refcounts drive gc."""
+        archive = os.path.join(self.test_dir, "master.zip")
+        writer = ManifestWriter(archive, store=self.store)
+        writer.add("page_0001.html", "<html>same</html>")
+        writer.add_zip("micro_0001.zip", [("source.txt", "http://x"), ("page.html", "<html>same</html>")])
+        manifest = writer.close()
+        self.assertEqual(manifest, archive + ".manifest.json")
+        page = self.store.put(b"<html>same</html>")
+        self.assertEqual(self.store.refcount(page), 2)
+
+        with zipfile.ZipFile(blob_store.materialize(manifest, store=self.store)) as zf:
+            self.assertEqual(zf.read("page_0001.html"), b"<html>same</html>")
+            with zipfile.ZipFile(io.BytesIO(zf.read("micro_0001.zip"))) as micro:
+                self.assertEqual(micro.read("source.txt"), b"http://x")
+
+        blob_store.remove(manifest, self.store)
+        self.assertEqual(self.store.refcount(page), 0)
+        self.assertEqual(self.store.gc(grace=3600, dirs=[self.test_dir]), 0)  # too recent
+        self.assertEqual(self.store.gc(grace=-1, dirs=[self.test_dir]), 2)
+        self.assertNotIn(page, self.store)
+
+    def test_gc_keeps_blobs_of_pulled_manifests(self):
+        """Test gc recounts manifests it never saw written (e.g. from git pull) before collecting."""
+        pulled, orphan = self.store.put(b"<html>pulled</html>"), self.store.put(b"<html>orphan</html>")
+        with open(os.path.join(self.test_dir, "remote.zip.manifest.json"), "w") as f:
+            json.dump({"manifest": 1, "archive": "remote.zip", "format": "zip",
+                       "entries": [{"name": "page.html", "blob": pulled, "size": 19}]}, f)
+        self.assertEqual(self.store.refcount(pulled), 0)
+
+        self.assertEqual(self.store.gc(grace=-1, dirs=[self.test_dir]), 1)
+        self.assertIn(pulled, self.store)
+        self.assertNotIn(orphan, self.store)
+        self.assertEqual(self.store.refcount(pulled), 1)
+
+    def test_new_objects_for_git_sync(self):
+        """Test a writer lists only the object files it created, nested ones included."""
+        self.store.put(b"<html>old</html>")
+        writer = ManifestWriter(os.path.join(self.test_dir, "a.zip"), store=self.store)
+        writer.add("old.html", "<html>old</html>")
+        writer.add("new.html", "<html>new</html>")
+        writer.add_zip("micro.zip", [("page.html", "<html>nested</html>"), ("again.html", "<html>new</html>")])
+        writer.close()
+
+        expected = [self.store._object_path(self.store.put(d)) for d in (b"<html>new</html>", b"<html>nested</html>")]
+        self.assertEqual(writer.new_objects, expected)
+        self.assertTrue(all(os.path.exists(p) for p in expected))
+
+    def test_ingest_gzip_zipcoin(self):
+        """Test an existing .zipcoin.gz is replaced by a manifest that materializes back."""
+        path = os.path.join(self.test_dir, "abc.zipcoin.gz")
+        with gzip.open(path, "wb") as f:
+            f.write(b"token one\n---\ntoken two\n---\n")
+
+        manifest = blob_store.ingest(path, self.store)
+        self.assertFalse(os.path.exists(path))
+        with gzip.open(blob_store.materialize(manifest, store=self.store)) as f:
+            self.assertEqual(f.read(), b"token one\n---\ntoken two\n---\n")
+
+
+class TestArchiveWriter(unittest.TestCase):
+    """Test per-payload compression policies."""
+
+    def write_archive(self, members, policy=None):
+        buf = io.BytesIO()
+        with ArchiveWriter(buf, policy=policy) as zf:
+            for name, data in members:
+                zf.writestr(name, data)
+        return zipfile.ZipFile(buf)
+
+    def test_policy_per_payload_kind(self):
+        """Test nested zips and tiny members are stored while html is deflated."""
+        nested = io.BytesIO()
+        with zipfile.ZipFile(nested, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr("page.html", "<p>research</p>" * 100)
+        html = "<html><p>quantum research</p></html>" * 50
+
+        with self.write_archive([("micro.zip", nested.getvalue()), ("micro_bin", nested.getvalue()),
+                                 ("page.html", html), ("meta.json", "{}")]) as zf:
+            kinds = {info.filename: info.compress_type for info in zf.infolist()}
+            self.assertEqual(zf.read("page.html").decode(), html)
+        self.assertEqual(kinds, {"micro.zip": zipfile.ZIP_STORED, "micro_bin": zipfile.ZIP_STORED,
+                                 "page.html": zipfile.ZIP_DEFLATED, "meta.json": zipfile.ZIP_STORED})
+
+    def test_policy_override(self):
+        """Test ZIP_POLICY style overrides and streamed members."""
+        policy = load_policy("html=lzma, json=stored")
+        self.assertEqual(policy["html"], (zipfile.ZIP_LZMA, None))
+        self.assertEqual(policy["archive"], (zipfile.ZIP_STORED, None))
+        with self.assertRaises(ValueError):
+            load_policy("html=snappy")
+
+        buf = io.BytesIO()
+        with ArchiveWriter(buf, policy=policy) as zf:
+            with zf.open("big.json", "w") as f:
+                f.write(b"[" + b"1," * 1000 + b"1]")
+            with zf.open("page.htm", "w") as f:
+                f.write(b"<p>" * 1000)
+        with zipfile.ZipFile(buf) as zf:
+            self.assertEqual(zf.getinfo("big.json").compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(zf.getinfo("page.htm").compress_type, zipfile.ZIP_LZMA)
+            self.assertEqual(zf.read("page.htm"), b"<p>" * 1000)
+
+    def test_benchmark_reports_each_kind(self):
+        """Test the benchmark compares policies for every payload kind in a corpus."""
+        test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, test_dir)
+        with zipfile.ZipFile(os.path.join(test_dir, "coin.zip"), "w") as zf:
+            zf.writestr("page.html", "<p>research</p>" * 100)
+            zf.writestr("manifest.json", json.dumps({"count": 1}))
+
+        results = archive_writer.benchmark(archive_writer.iter_payloads([test_dir]),
+                                           ["stored", "deflate-6"])
+        self.assertEqual(set(results), {"html", "json"})
+        files, size, packed, _ = results["html"]["deflate-6"]
+        self.assertEqual((files, size), (1, 1500))
+        self.assertLess(packed, size)
+        self.assertEqual(results["html"]["stored"][2], size)
+
+
+class TestHtmlExtract(unittest.TestCase):
+    """Test one-pass paragraph, link and text extraction."""
+
+    PAGE = """<html><head><title>Helium</title>
+        <style>p { color: red }</style><script>var p = "<p>not text</p>";</script></head>
+        <body><h1>Helium</h1>
+        <p>Helium is a <b>chemical</b>   element.</p>
+        <p>First<p>Second &amp; last
+        <a href="https://en.wikipedia.org/wiki/Neon">Neon</a>
+        <a href=" https://example.org/x ">x</a>
+        <a href="/wiki/Argon">Argon</a><a name="top"></a>
+        </body></html>"""
+
+    def test_paragraphs_skip_scripts(self):
+        """Test paragraph text matches get_text(" ", strip=True) and ignores scripts."""
+        page = extract_page(self.PAGE)
+        self.assertEqual(page.paragraphs, ["Helium is a chemical element.", "First",
+                                           "Second & last Neon x Argon"])
+        self.assertEqual(paragraph_text("<div>no paragraphs</div>"), "")
+
+    def test_links(self):
+        """Test only absolute links are kept unless a base URL is given."""
+        self.assertEqual(page_links(self.PAGE),
+                         ["https://en.wikipedia.org/wiki/Neon", "https://example.org/x"])
+        self.assertEqual(page_links(self.PAGE, "https://en.wikipedia.org/wiki/Helium")[-1],
+                         "https://en.wikipedia.org/wiki/Argon")
+
+    def test_visible_text_limit(self):
+        """Test visible text keeps block lines and stops parsing at the limit."""
+        text = visible_text(self.PAGE)
+        self.assertEqual(text.split("\n")[:3], ["Helium", "Helium", "Helium is a chemical element."])
+        self.assertNotIn("color", text)
+
+        page = extract_page("<p>" + "word " * 100000 + "</p>" * 2000, max_text=100)
+        self.assertTrue(page.done)
+        self.assertEqual(len(page.text()), 100)
+
+
+class TestGitSync(unittest.TestCase):
+    """Test batched commits of queued paths, pushed to a local bare repo."""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.remote = os.path.join(self.test_dir, "remote.git")
+        self.repo = os.path.join(self.test_dir, "work")
+        self.git("init", "-q", "--bare", self.remote, cwd=self.test_dir)
+        self.git("init", "-q", self.repo, cwd=self.test_dir)
+        self.git("config", "user.name", "Pewpi Test")
+        self.git("config", "user.email", "test@pewpi.local")
+        self.git("remote", "add", "origin", self.remote)
+
+    def tearDown(self):
+        git_sync._queues.clear()
+        shutil.rmtree(self.test_dir)
+
+    def git(self, *args, cwd=None):
+        result = subprocess.run(["git", *args], cwd=cwd or self.repo,
+                                capture_output=True, text=True, check=True)
+        return result.stdout
+
+    def write(self, rel, text="x"):
+        path = os.path.join(self.repo, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def test_commits_only_submitted_paths(self):
+        """Test one commit stages just the queued files, directories and removals, then pushes."""
+        token = self.write("tokens/a b ∞.json")
+        self.write("zips/1.zip")
+        self.write("zips/2.zip")
+        self.write("scratch.txt")
+        git_sync.submit([token, os.path.join(self.repo, "zips"), "/elsewhere/x"], repo=self.repo)
+        commit = git_sync.sync_now(self.repo)
+
+        self.assertEqual(self.git("--git-dir", self.remote, "rev-parse", "HEAD").strip(), commit)
+        files = self.git("show", "--name-only", "--format=", "-z", commit).split("\0")
+        self.assertEqual(sorted(f for f in files if f), ["tokens/a b ∞.json", "zips/1.zip", "zips/2.zip"])
+        self.assertIn("?? scratch.txt", self.git("status", "--porcelain"))
+
+        os.remove(token)
+        git_sync.submit([token], repo=self.repo)
+        self.assertIsNotNone(git_sync.sync_now(self.repo))
+        self.assertEqual(self.git("ls-files").split(), ["zips/1.zip", "zips/2.zip"])
+        self.assertIsNone(git_sync.sync_now(self.repo))
+
+    def test_window_and_threshold(self):
+        """Test paths are gathered for the window unless max_paths are waiting."""
+        sync = GitSync(self.repo, window=10, max_paths=3, remote="")
+        git_sync.submit([self.write("t1.json")], repo=self.repo)
+        self.assertIsNone(sync.poll(now=100))
+        git_sync.submit([self.write("t2.json")], repo=self.repo)
+        self.assertIsNone(sync.poll(now=105))
+        self.assertIsNotNone(sync.poll(now=110))
+        self.assertEqual(self.git("rev-list", "--count", "HEAD").strip(), "1")
+
+        git_sync.submit([self.write(f"u{i}.json") for i in range(3)], repo=self.repo)
+        self.assertIsNotNone(sync.poll(now=111))
+        self.assertEqual(self.git("rev-list", "--count", "HEAD").strip(), "2")
+        self.assertEqual(sync.queue.pending(), [])
+
+
+class TestFetchCache(unittest.TestCase):
+    """Test the on-disk page cache against a local HTTP server."""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.hits = []
+        self.version = "v1"
+        test = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                test.hits.append((self.path, self.headers.get("If-None-Match")))
+                if self.path == "/missing":
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                etag = f'"{test.version}"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                body = f"<p>page {test.version} ∞</p>".encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        shutil.rmtree(self.test_dir)
+
+    def test_fresh_then_revalidated(self):
+        """Test fresh pages skip the network and stale ones are revalidated with their ETag."""
+        cache = FetchCache(self.test_dir, ttl=60)
+        self.assertEqual(cache.get(self.base + "/a").text, "<p>page v1 ∞</p>")
+        r = cache.get(self.base + "/a")
+        self.assertTrue(r.from_cache)
+        self.assertEqual(r.text, "<p>page v1 ∞</p>")
+        self.assertEqual(len(self.hits), 1)
+
+        stale = FetchCache(self.test_dir, ttl=0)
+        self.assertEqual(stale.get(self.base + "/a").text, "<p>page v1 ∞</p>")
+        self.assertEqual(self.hits[-1], ("/a", '"v1"'))
+        self.assertEqual(stale.stats["revalidated"], 1)
+
+        self.version = "v2"
+        self.assertEqual(stale.get(self.base + "/a").text, "<p>page v2 ∞</p>")
+        self.assertEqual(stale.stats["fetched"], 1)
+
+    def test_failures_are_negatively_cached(self):
+        """Test a failed URL is not retried until negative_ttl passes, unless refreshed."""
+        cache = FetchCache(self.test_dir, ttl=60, negative_ttl=60)
+        self.assertEqual(cache.get(self.base + "/missing").status_code, 404)
+        self.assertEqual(cache.get(self.base + "/missing").status_code, 404)
+        self.assertEqual(len(self.hits), 1)
+        cache.get(self.base + "/missing", refresh=True)
+        self.assertEqual(len(self.hits), 2)
+
+        # A page that goes away keeps being served from the cache
+        cache.get(self.base + "/a")
+        self.server.shutdown()
+        self.server.server_close()
+        self.server = None
+        r = FetchCache(self.test_dir, ttl=0).get(self.base + "/a", timeout=1)
+        self.assertEqual((r.status_code, r.from_cache), (200, True))
+
+
+class TestZipBundler(unittest.TestCase):
+    """Test the event-driven raw file bundler."""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.raw_dir = os.path.join(self.test_dir, "raw")
+        self.bundle_dir = os.path.join(self.test_dir, "data")
+        os.makedirs(self.raw_dir)
+        os.makedirs(self.bundle_dir)
+        self.saved = zip_bundler.BUNDLE_DIR, zip_bundler.LOGFILE
+        zip_bundler.BUNDLE_DIR = self.bundle_dir
+        zip_bundler.LOGFILE = os.path.join(self.bundle_dir, "bundler_log.txt")
+
+    def tearDown(self):
+        zip_bundler.BUNDLE_DIR, zip_bundler.LOGFILE = self.saved
+        shutil.rmtree(self.test_dir)
+
+    def write_raw(self, name, text="{}"):
+        path = os.path.join(self.raw_dir, name)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def bundler(self, **kwargs):
+        kwargs.setdefault("batch_size", 3)
+        kwargs.setdefault("max_age", 0)
+        return zip_bundler.Bundler(raw_dir=self.raw_dir,
+                                   bundled_log=os.path.join(self.bundle_dir, "bundled.log"),
+                                   **kwargs)
+
+    def seal_ready(self, bundler):
+        with contextlib.redirect_stdout(io.StringIO()):
+            bundler.seal_ready()
+
+    def test_seals_full_batches_only(self):
+        """Test files are sealed in batch_size bundles and the rest keep waiting."""
+        for i in range(7):
+            self.write_raw(f"{i}.json")
+        self.write_raw("notes.txt")
+        bundler = self.bundler()
+        bundler.rescan()
+        self.seal_ready(bundler)
+
+        self.assertEqual(bundler.batch, 2)
+        self.assertEqual(len(bundler.pending), 1)
+        with zipfile.ZipFile(os.path.join(self.bundle_dir, "token_batch_00002.zip")) as z:
+            self.assertEqual(len(z.namelist()), 3)
+
+    def test_restart_skips_bundled_files(self):
+        """Test a restarted bundler neither rebundles files nor reuses batch numbers."""
+        for i in range(3):
+            self.write_raw(f"{i}.json")
+        first = self.bundler()
+        first.rescan()
+        self.seal_ready(first)
+
+        second = self.bundler()
+        second.rescan()
+        self.assertEqual(second.pending, {})
+        self.assertEqual(second.batch, 1)
+
+        # A rewritten file is a new candidate
+        self.write_raw("1.json", '{"changed": true}')
+        second.rescan()
+        self.assertEqual(list(second.pending), ["1.json"])
+
+    def test_partial_batch_sealed_by_age(self):
+        """Test a partial batch is sealed once its oldest file is max_age old."""
+        self.write_raw("a.json")
+        bundler = self.bundler(max_age=60)
+        bundler.rescan()
+        self.seal_ready(bundler)
+        self.assertEqual(bundler.batch, 0)
+        self.assertGreater(bundler.due(), 0)
+
+        bundler.pending["a.json"] -= 60
+        self.assertEqual(bundler.due(), 0)
+        self.seal_ready(bundler)
+        self.assertEqual(bundler.batch, 1)
+
+    @unittest.skipUnless(INOTIFY_AVAILABLE, "inotify not available")
+    def test_watcher_reports_new_files(self):
+        """Test the watcher reports files written in the root and in new subdirectories."""
+        watcher = DirWatcher(self.raw_dir)
+        self.addCleanup(watcher.close)
+        self.assertFalse(watcher.polling)
+        self.assertEqual(watcher.wait(0), [])
+
+        path = self.write_raw("a.json")
+        self.assertEqual(watcher.wait(1), [path])
+
+        os.makedirs(os.path.join(self.raw_dir, "sub"))
+        watcher.wait(1)
+        path = self.write_raw(os.path.join("sub", "b.json"))
+        self.assertEqual(watcher.wait(1), [path])
+
+    def test_polling_fallback_asks_for_rescan(self):
+        """Test the polling watcher returns None so callers rescan."""
+        watcher = DirWatcher(self.raw_dir, poll_interval=0.01, use_inotify=False)
+        self.assertTrue(watcher.polling)
+        self.assertIsNone(watcher.wait())
+
+
 class TestMegaHash(unittest.TestCase):
     """Test mega hash generation."""
 
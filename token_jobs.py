@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Token Jobs - Background token builds for the auth server
+Part of the Pewpi Login / Infinity Research Portal
+
+/api/token/build scored up to 1 MB of text and saved the token while the
+request thread waited, so one large build held up every small one behind
+it. TokenJobs takes builds off the request thread:
+
+    job = jobs.submit(username, texts, source_type, filenames, context)
+    jobs.get(job["id"])    # {"status": "queued" | "running" | "done" | "failed", ...}
+
+Jobs run in two lanes so small builds never queue behind large ones:
+
+    small   at most SMALL_JOB_SIZE characters; one thread in this process
+    large   a pool of `workers` processes (a thread when workers <= 1)
+
+Workers score and save the tokens (token store and pending queue are both
+safe across processes) and send back only their summaries. The on_done
+callback then runs in this process, for the user and commit bookkeeping
+that must stay here. At most max_queue jobs wait or run at once; submit
+returns None beyond that. Finished jobs are kept for `keep` seconds.
+
+Jobs run in the process that accepted them. When the server runs several
+workers, a SQLiteJobRegistry records every job's status and result so a
+status poll can be answered by any of them; the build marks its job
+"running" there when it starts.
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from build_token import build_tokens
+from shared_state import sqlite_connection
+
+# ------------------------------ CONFIG ------------------------------
+# Processes for large builds
+TOKEN_JOB_WORKERS = int(os.getenv("TOKEN_JOB_WORKERS", os.cpu_count() or 1))
+# Jobs waiting or running at once
+TOKEN_JOB_QUEUE = int(os.getenv("TOKEN_JOB_QUEUE", 64))
+# Seconds a finished job's result can be fetched
+TOKEN_JOB_KEEP = int(os.getenv("TOKEN_JOB_KEEP", 600))
+# Jobs up to this many characters in total take the small lane
+SMALL_JOB_SIZE = 64 * 1024
+
+SUMMARY_FIELDS = ("hash", "value", "value_formatted", "score", "timestamp")
+
+
+def run_build(texts, source_type, filenames):
+    """Build and save tokens; returns their summaries, without the raw text (runs in a worker)."""
+    tokens = build_tokens(texts, source_type=source_type, filenames=filenames)
+    return [{field: token.get(field) for field in SUMMARY_FIELDS} for token in tokens]
+
+
+_worker_registries = {}
+
+
+def run_job(job_id, registry_path, texts, source_type, filenames):
+    """Mark the job running in the shared registry (if any), then build it (runs in a worker)."""
+    if registry_path is not None:
+        registry = _worker_registries.get(registry_path)
+        if registry is None:
+            registry = _worker_registries[registry_path] = SQLiteJobRegistry(registry_path)
+        try:
+            registry.mark_running(job_id)
+        except sqlite3.Error as e:
+            print(f"[JOBS] could not mark job {job_id} running: {e}")
+    return run_build(texts, source_type, filenames)
+
+
+class TokenJobs:
+    """Bounded two-lane queue of token build jobs."""
+
+    def __init__(self, workers=TOKEN_JOB_WORKERS, max_queue=TOKEN_JOB_QUEUE, keep=TOKEN_JOB_KEEP,
+                 on_done=None, registry=None):
+        """
+        Args:
+            workers: Processes for large jobs (<= 1 runs them on a thread)
+            max_queue: Unfinished jobs accepted at once
+            keep: Seconds finished jobs are kept
+            on_done: fn(job, summaries) -> result dict, called in this process
+                when a job's tokens are built; default {"tokens": summaries}
+            registry: SQLiteJobRegistry shared with other worker processes, or None
+        """
+        self.workers = workers
+        self.max_queue = max_queue
+        self.keep = keep
+        self.on_done = on_done
+        self.registry = registry
+
+        self._jobs = {}
+        self._finished = OrderedDict()  # job id -> finished_at, oldest first
+        self._unfinished = 0
+        self._lock = threading.Lock()
+        self._small = None
+        self._large = None
+
+    def submit(self, owner, texts, source_type="text", filenames=None, context=None):
+        """
+        Queue a build of ``texts`` for ``owner``.
+
+        Returns:
+            A copy of the new job, or None if max_queue jobs are unfinished
+        """
+        size = sum(len(t) for t in texts)
+        now = time.time()
+        if self.registry is not None:
+            self.registry.expire(now - self.keep)
+        with self._lock:
+            self._expire(now)
+            if self._unfinished >= self.max_queue:
+                return None
+            job = {
+                "id": uuid.uuid4().hex,
+                "owner": owner,
+                "status": "queued",
+                "size": size,
+                "count": len(texts),
+                "context": context or {},
+                "created_at": time.time(),
+                "finished_at": None,
+                "result": None,
+                "error": None,
+            }
+            self._jobs[job["id"]] = job
+            self._unfinished += 1
+            snapshot = dict(job)
+        if self.registry is not None:
+            self.registry.put(snapshot)
+
+        lane = self._small_lane() if size <= SMALL_JOB_SIZE else self._large_lane()
+        args = (job["id"], self.registry.path if self.registry is not None else None,
+                list(texts), source_type, filenames)
+        try:
+            try:
+                future = lane.submit(run_job, *args)
+            except BrokenProcessPool:
+                # A worker died (OOM-killed, say) and the pool refuses all work from then on
+                future = self._replace_large(lane).submit(run_job, *args)
+        except Exception:
+            with self._lock:
+                del self._jobs[job["id"]]
+                self._unfinished -= 1
+            raise
+        job["future"] = future
+        future.add_done_callback(lambda f: self._finish(job, f))
+        return snapshot
+
+    def get(self, job_id):
+        """A copy of the job (status, result or error), or None if unknown or expired."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                # Accepted by another worker process, perhaps
+                return self.registry.get(job_id) if self.registry is not None else None
+            snapshot = {k: v for k, v in job.items() if k != "future"}
+        future = job.get("future")
+        if snapshot["status"] == "queued" and future is not None and future.running():
+            snapshot["status"] = "running"
+        return snapshot
+
+    def pending(self):
+        """Number of jobs waiting or running."""
+        with self._lock:
+            return self._unfinished
+
+    def shutdown(self, wait=True):
+        for lane in (self._small, self._large):
+            if lane is not None:
+                lane.shutdown(wait=wait)
+        self._small = self._large = None
+
+    # ------------------------------ INTERNALS ------------------------------
+    def _small_lane(self):
+        with self._lock:
+            if self._small is None:
+                self._small = ThreadPoolExecutor(1, thread_name_prefix="token-job-small")
+            return self._small
+
+    def _large_lane(self):
+        with self._lock:
+            if self._large is None:
+                if self.workers <= 1:
+                    self._large = ThreadPoolExecutor(1, thread_name_prefix="token-job-large")
+                else:
+                    # spawn, not fork: the server has threads (and open stores) of its own
+                    self._large = ProcessPoolExecutor(self.workers,
+                                                      mp_context=multiprocessing.get_context("spawn"))
+            return self._large
+
+    def _replace_large(self, broken):
+        """Drop the broken large lane ``broken`` and return a fresh one."""
+        with self._lock:
+            if self._large is broken:
+                self._large = None
+        print("[JOBS] large build pool broke; starting a new one")
+        broken.shutdown(wait=False)
+        return self._large_lane()
+
+    def _finish(self, job, future):
+        try:
+            summaries = future.result()
+            result = self.on_done(job, summaries) if self.on_done else {"tokens": summaries}
+            status, error = "done", None
+        except Exception as e:
+            result, status, error = None, "failed", str(e)
+
+        with self._lock:
+            job["result"] = result
+            job["error"] = error
+            job["status"] = status
+            job["finished_at"] = time.time()
+            job.pop("future", None)
+            self._unfinished -= 1
+            self._finished[job["id"]] = job["finished_at"]
+            snapshot = dict(job)
+        if self.registry is not None:
+            try:
+                self.registry.put(snapshot)
+            except sqlite3.Error as e:
+                print(f"[JOBS] could not record job {job['id']}: {e}")
+
+    def _expire(self, now):
+        while self._finished:
+            job_id, finished_at = next(iter(self._finished.items()))
+            if now - finished_at < self.keep:
+                break
+            del self._finished[job_id]
+            self._jobs.pop(job_id, None)
+
+
+class SQLiteJobRegistry:
+    """Status and results of token jobs in a SQLite table shared by the server's workers."""
+
+    FIELDS = ("id", "owner", "status", "size", "count", "context", "created_at", "finished_at",
+              "result", "error")
+
+    def __init__(self, path, timeout=5.0):
+        """
+        Args:
+            path: Database file; created if missing
+            timeout: Seconds to wait for another process's write
+        """
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS token_jobs "
+                       "(id TEXT PRIMARY KEY, owner TEXT, status TEXT, size INTEGER, count INTEGER, "
+                       "context TEXT, created_at REAL, finished_at REAL, result TEXT, error TEXT)")
+            db.execute("CREATE INDEX IF NOT EXISTS token_jobs_finished ON token_jobs (finished_at)")
+
+    def put(self, job):
+        """Record (or update) a job."""
+        row = [job.get(field) for field in self.FIELDS]
+        row[5], row[8] = json.dumps(row[5]), json.dumps(row[8])
+        with self._connect() as db:
+            db.execute(f"INSERT OR REPLACE INTO token_jobs ({', '.join(self.FIELDS)}) "
+                       f"VALUES ({', '.join('?' * len(self.FIELDS))})", row)
+
+    def mark_running(self, job_id):
+        """Move a queued job to "running" (a finished one is left as it is)."""
+        with self._connect() as db:
+            db.execute("UPDATE token_jobs SET status = 'running' WHERE id = ? AND status = 'queued'",
+                       (job_id,))
+
+    def get(self, job_id):
+        """The job as put, or None."""
+        row = self._connect().execute(f"SELECT {', '.join(self.FIELDS)} FROM token_jobs WHERE id = ?",
+                                      (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(self.FIELDS, row))
+        job["context"], job["result"] = json.loads(job["context"]), json.loads(job["result"])
+        return job
+
+    def expire(self, before):
+        """Forget jobs that finished before ``before``."""
+        with self._connect() as db:
+            db.execute("DELETE FROM token_jobs WHERE finished_at < ?", (before,))
+
+    # ------------------------------ INTERNALS ------------------------------
+    def _connect(self):
+        return sqlite_connection(self._local, self.path, self.timeout)
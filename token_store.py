@@ -0,0 +1,588 @@
+#!/usr/bin/env python3
+"""
+Token Store - Segment files plus a hash index in place of one JSON file per token
+Part of the Pewpi Login / Infinity Research Portal
+
+A store lives next to the token directory it replaces (tokens/ -> tokens.store/):
+
+    seg-000000.dat ...   append-only records: header, key, compact JSON payload
+    index.dat            append-only hash -> (segment, offset, length) records
+    lock                 writers serialise on this with flock
+
+Writers append and fsync the segment record before its index record, so a
+crash leaves at worst unindexed bytes at the end of a segment or a torn index
+record, both of which readers ignore and the next writer truncates. The index
+is replayed into a dict when the store is opened, giving O(1) get(); readers
+pick up other processes' writes by following the index file as it grows.
+
+Per-token JSON files are still what the static frontend fetches, so
+export_json() writes them from the store on demand; the research index sync
+exports each stored token it publishes a link to (export_token).
+"""
+
+import os
+import sys
+import json
+import struct
+import zlib
+
+from pending_queue import FileLock
+
+# Try to import mmap, fall back to pread if not available
+try:
+    import mmap
+    MMAP_AVAILABLE = True
+except ImportError:
+    MMAP_AVAILABLE = False
+
+# ------------------------------ CONFIG ------------------------------
+# Roll over to a new segment file once the current one reaches this size
+# (a single write batch always lands in one segment)
+SEGMENT_SIZE = 64 << 20
+
+SEGMENT_MAGIC = b"TKS1"
+# magic, key length, payload length, crc32(key + payload); payload length 0 is a delete
+SEGMENT_HEADER = struct.Struct("<4sHII")
+# key length, segment, payload offset, payload length, crc32 of the record
+INDEX_HEADER = struct.Struct("<HHQII")
+
+COPY_CHUNK_SIZE = 1 << 20
+
+
+def store_for(tokens_dir, **kwargs):
+    """Open the store that sits next to a token directory (tokens/ -> tokens.store/)."""
+    return TokenStore(os.path.normpath(tokens_dir) + ".store", **kwargs)
+
+
+def encode_token(token):
+    """Serialise a token object the way the store keeps it."""
+    return json.dumps(token, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+class TokenStore:
+    """Append-only token store with an in-memory hash index."""
+
+    def __init__(self, root, use_mmap=False, fsync=True, segment_size=SEGMENT_SIZE):
+        """
+        Open a store. Nothing is created on disk until the first write.
+
+        Args:
+            root: Store directory
+            use_mmap: Read payloads through memory maps instead of pread
+            fsync: fsync segment and index after every write batch
+            segment_size: Size at which writers start a new segment file
+        """
+        self.root = root
+        self.index_path = os.path.join(root, "index.dat")
+        self.lock_path = os.path.join(root, "lock")
+        self.use_mmap = use_mmap and MMAP_AVAILABLE
+        self.fsync = fsync
+        self.segment_size = segment_size
+
+        self._index = {}
+        self._segment_end = {}
+        self._index_pos = 0
+        self._index_ino = None
+        self._fds = {}
+        self._maps = {}
+
+    # ------------------------------ READ API ------------------------------
+    def get(self, key, default=None):
+        """Return the token stored under ``key`` (a hash), or ``default``."""
+        payload = self.get_raw(key)
+        return default if payload is None else json.loads(payload)
+
+    def get_raw(self, key):
+        """Return the stored JSON bytes for ``key``, or None."""
+        self._refresh()
+        entry = self._index.get(key)
+        if entry is None:
+            return None
+        try:
+            return self._read(*entry)
+        except FileNotFoundError:
+            # Segment removed by a compaction we have not seen yet
+            self._reload()
+            entry = self._index.get(key)
+            return None if entry is None else self._read(*entry)
+
+    def __contains__(self, key):
+        self._refresh()
+        return key in self._index
+
+    def __len__(self):
+        self._refresh()
+        return len(self._index)
+
+    def keys(self):
+        """Return stored keys in write order."""
+        self._refresh()
+        return list(self._index)
+
+    def changes(self, since=None):
+        """
+        Report keys written or deleted since an earlier call, by following the index.
+
+        Args:
+            since: Position returned by a previous call, or None
+
+        Returns:
+            (position, changed, deleted): sets of keys, or changed None when
+            ``since`` is unusable (first call, or the index was compacted) and
+            the caller has to treat every stored key as changed
+        """
+        try:
+            st = os.stat(self.index_path)
+        except FileNotFoundError:
+            position = [0, 0]
+            return position, (set() if since == position else None), set()
+
+        # [0, 0] is "before the store existed", valid for whatever index appears
+        if since == [0, 0]:
+            since = [st.st_ino, 0]
+        if not since or since[0] != st.st_ino or since[1] > st.st_size:
+            self._refresh()
+            return [self._index_ino, self._index_pos], None, set()
+
+        with open(self.index_path, "rb") as f:
+            f.seek(since[1])
+            data = f.read()
+
+        pos = since[1]
+        changed, deleted = set(), set()
+        for key, _, _, length, size in self._parse_index(data):
+            if length:
+                changed.add(key)
+                deleted.discard(key)
+            else:
+                deleted.add(key)
+                changed.discard(key)
+            pos += size
+        return [st.st_ino, pos], changed, deleted
+
+    def scan(self):
+        """
+        Yield (key, token) for every live token, reading segments sequentially.
+
+        Older versions of rewritten tokens and deleted tokens are skipped.
+        """
+        self._refresh()
+        for segment in sorted(self._segment_end):
+            end = self._segment_end[segment]
+            try:
+                f = open(self._segment_path(segment), "rb")
+            except FileNotFoundError:
+                continue
+            with f:
+                offset = 0
+                while offset < end:
+                    header = f.read(SEGMENT_HEADER.size)
+                    if len(header) < SEGMENT_HEADER.size:
+                        break
+                    magic, key_len, length, _ = SEGMENT_HEADER.unpack(header)
+                    if magic != SEGMENT_MAGIC:
+                        break
+                    key = f.read(key_len).decode("utf-8")
+                    payload_offset = offset + SEGMENT_HEADER.size + key_len
+                    payload = f.read(length)
+                    offset = payload_offset + length
+                    if length and self._index.get(key) == (segment, payload_offset, length):
+                        yield key, json.loads(payload)
+
+    # ------------------------------ WRITE API ------------------------------
+    def put(self, token, key=None):
+        """
+        Store a token object, replacing any earlier version.
+
+        Args:
+            token: Token dict
+            key: Store key, defaults to token["hash"]
+
+        Returns:
+            The key
+        """
+        key = key or token["hash"]
+        self._append([(key, encode_token(token))])
+        return key
+
+    def put_many(self, tokens, key_field="hash"):
+        """Store several token objects with one segment and index append."""
+        records = [(token[key_field], encode_token(token)) for token in tokens]
+        self._append(records)
+        return [key for key, _ in records]
+
+    def put_file(self, key, path):
+        """Store an existing JSON file under ``key`` without loading it."""
+        with open(path, "rb") as f:
+            self._append([(key, f)])
+        return key
+
+    def delete(self, keys):
+        """Remove tokens from the store; unknown keys are ignored."""
+        if isinstance(keys, str):
+            keys = [keys]
+        self._refresh()
+        self._append([(key, b"") for key in keys if key in self._index])
+
+    def close(self):
+        """Release open segment files and memory maps."""
+        for m in self._maps.values():
+            m.close()
+        for fd in self._fds.values():
+            os.close(fd)
+        self._maps = {}
+        self._fds = {}
+
+    # ------------------------------ IMPORT / EXPORT ------------------------------
+    def import_dir(self, tokens_dir, batch_size=1000):
+        """
+        Pack every *.json token file in ``tokens_dir`` into the store.
+
+        Files are keyed by their name without ".json". Unreadable files are skipped.
+
+        Returns:
+            Number of tokens imported
+        """
+        count = 0
+        batch = []
+        for fname in sorted(os.listdir(tokens_dir)):
+            if not fname.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(tokens_dir, fname), "r", encoding="utf-8") as f:
+                    batch.append((fname[:-5], encode_token(json.load(f))))
+            except (OSError, ValueError):
+                continue
+            if len(batch) >= batch_size:
+                self._append(batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            self._append(batch)
+            count += len(batch)
+        return count
+
+    def export_json(self, out_dir, keys=None, indent=4):
+        """
+        Write tokens out as one <key>.json file each, for the static frontend.
+
+        Args:
+            out_dir: Destination directory
+            keys: Keys to export, defaults to every stored token
+            indent: JSON indent, matching what the builders used to write
+
+        Returns:
+            Number of files written
+        """
+        os.makedirs(out_dir, exist_ok=True)
+        if keys is None:
+            items = self.scan()
+        else:
+            items = ((key, self.get(key)) for key in keys)
+
+        count = 0
+        for key, token in items:
+            if token is None:
+                continue
+            export_token(out_dir, key, token, indent)
+            count += 1
+        return count
+
+    # ------------------------------ COMPACTION ------------------------------
+    def compact(self):
+        """Rewrite live tokens into fresh segments and drop the old ones."""
+        with self._locked():
+            self._refresh()
+            old_segments = sorted(self._segment_end)
+            if not old_segments:
+                return
+            live = self._index
+            segment = (old_segments[-1] + 1) if old_segments else 0
+
+            entries = []
+            seg_f = open(self._segment_path(segment), "wb")
+            offset = 0
+            try:
+                for key, entry in live.items():
+                    payload = self._read(*entry)
+                    if offset >= self.segment_size:
+                        self._close_segment_file(seg_f)
+                        segment += 1
+                        seg_f = open(self._segment_path(segment), "wb")
+                        offset = 0
+                    key_bytes = key.encode("utf-8")
+                    seg_f.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, len(key_bytes), len(payload),
+                                                    zlib.crc32(key_bytes + payload)))
+                    seg_f.write(key_bytes)
+                    seg_f.write(payload)
+                    payload_offset = offset + SEGMENT_HEADER.size + len(key_bytes)
+                    entries.append((key_bytes, segment, payload_offset, len(payload)))
+                    offset = payload_offset + len(payload)
+            finally:
+                self._close_segment_file(seg_f)
+
+            tmp_path = self.index_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(b"".join(self._index_record(*e) for e in entries))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.index_path)
+            self._fsync_dir()
+
+            self.close()
+            for old in old_segments:
+                try:
+                    os.remove(self._segment_path(old))
+                except FileNotFoundError:
+                    pass
+            self._reload()
+
+    # ------------------------------ INTERNALS ------------------------------
+    def _append(self, records):
+        """Append (key, bytes or binary file) records to the current segment, then index them."""
+        if not records:
+            return
+        os.makedirs(self.root, exist_ok=True)
+
+        with self._locked():
+            self._refresh()
+            self._truncate_torn_index()
+
+            segment = max(self._segment_end, default=0)
+            end = self._segment_end.get(segment, 0)
+            if end >= self.segment_size:
+                segment += 1
+                end = 0
+
+            entries = []
+            fd = os.open(self._segment_path(segment), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                # Unindexed bytes past the last record were left by a crashed writer
+                if os.fstat(fd).st_size != end:
+                    os.ftruncate(fd, end)
+                offset = end
+                for key, payload in records:
+                    key_bytes = key.encode("utf-8")
+                    if isinstance(payload, (bytes, bytearray)):
+                        crc = zlib.crc32(key_bytes + payload)
+                        os.pwrite(fd, SEGMENT_HEADER.pack(SEGMENT_MAGIC, len(key_bytes), len(payload), crc)
+                                  + key_bytes + payload, offset)
+                        length = len(payload)
+                    else:
+                        length, crc = self._copy_payload(fd, payload, offset + SEGMENT_HEADER.size + len(key_bytes),
+                                                         zlib.crc32(key_bytes))
+                        os.pwrite(fd, SEGMENT_HEADER.pack(SEGMENT_MAGIC, len(key_bytes), length, crc)
+                                  + key_bytes, offset)
+                    payload_offset = offset + SEGMENT_HEADER.size + len(key_bytes)
+                    entries.append((key_bytes, segment, payload_offset, length))
+                    offset = payload_offset + length
+                if self.fsync:
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+
+            fd = os.open(self.index_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            try:
+                os.write(fd, b"".join(self._index_record(*e) for e in entries))
+                if self.fsync:
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+            self._refresh()
+
+    @staticmethod
+    def _copy_payload(fd, f, offset, crc):
+        """Copy a file object into the segment at ``offset``; returns (length, crc)."""
+        length = 0
+        while True:
+            chunk = f.read(COPY_CHUNK_SIZE)
+            if not chunk:
+                return length, crc
+            os.pwrite(fd, chunk, offset + length)
+            crc = zlib.crc32(chunk, crc)
+            length += len(chunk)
+
+    @staticmethod
+    def _index_record(key_bytes, segment, offset, length):
+        fields = (len(key_bytes), segment, offset, length)
+        crc = zlib.crc32(struct.pack("<HHQI", *fields) + key_bytes)
+        return INDEX_HEADER.pack(*fields, crc) + key_bytes
+
+    def _refresh(self):
+        """Apply index records appended since the last call."""
+        try:
+            st = os.stat(self.index_path)
+        except FileNotFoundError:
+            if self._index_ino is not None:
+                self._reset()
+            return
+        if self._index_ino is not None and st.st_ino != self._index_ino:
+            self._reset()  # replaced by a compaction
+        if st.st_size <= self._index_pos and self._index_ino is not None:
+            return
+
+        with open(self.index_path, "rb") as f:
+            self._index_ino = os.fstat(f.fileno()).st_ino
+            f.seek(self._index_pos)
+            data = f.read()
+
+        for key, segment, offset, length, pos in self._parse_index(data):
+            if length:
+                self._index.pop(key, None)  # keep dict order = latest write order
+                self._index[key] = (segment, offset, length)
+            else:
+                self._index.pop(key, None)
+            self._segment_end[segment] = max(self._segment_end.get(segment, 0), offset + length)
+            self._index_pos += pos
+
+    @staticmethod
+    def _parse_index(data):
+        """Yield (key, segment, offset, length, record size) for complete index records in ``data``."""
+        pos = 0
+        while pos + INDEX_HEADER.size <= len(data):
+            key_len, segment, offset, length, crc = INDEX_HEADER.unpack_from(data, pos)
+            end = pos + INDEX_HEADER.size + key_len
+            if end > len(data):
+                return
+            key_bytes = data[pos + INDEX_HEADER.size:end]
+            if zlib.crc32(data[pos:pos + INDEX_HEADER.size - 4] + key_bytes) != crc:
+                return  # torn record, left for the next writer to truncate
+            yield key_bytes.decode("utf-8"), segment, offset, length, end - pos
+            pos = end
+
+    def _truncate_torn_index(self):
+        """Drop a torn index tail; caller holds the lock and has refreshed."""
+        try:
+            if os.path.getsize(self.index_path) > self._index_pos:
+                os.truncate(self.index_path, self._index_pos)
+        except FileNotFoundError:
+            pass
+
+    def _reset(self):
+        self.close()
+        self._index = {}
+        self._segment_end = {}
+        self._index_pos = 0
+        self._index_ino = None
+
+    def _reload(self):
+        self._reset()
+        self._refresh()
+
+    def _read(self, segment, offset, length):
+        if self.use_mmap:
+            m = self._maps.get(segment)
+            if m is None or len(m) < offset + length:
+                if m is not None:
+                    m.close()
+                m = mmap.mmap(self._segment_fd(segment), 0, access=mmap.ACCESS_READ)
+                self._maps[segment] = m
+            return m[offset:offset + length]
+        return os.pread(self._segment_fd(segment), length, offset)
+
+    def _segment_fd(self, segment):
+        fd = self._fds.get(segment)
+        if fd is None:
+            fd = self._fds[segment] = os.open(self._segment_path(segment), os.O_RDONLY)
+        return fd
+
+    def _segment_path(self, segment):
+        return os.path.join(self.root, f"seg-{segment:06d}.dat")
+
+    def _close_segment_file(self, f):
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+
+    def _fsync_dir(self):
+        if not self.fsync or not hasattr(os, "O_DIRECTORY"):
+            return
+        fd = os.open(self.root, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _locked(self):
+        return FileLock(self.lock_path)
+
+
+# ------------------------------ DIRECTORY HELPERS ------------------------------
+def token_filenames(tokens_dir, store=None):
+    """
+    List token file names for a directory and its store, without opening any file.
+
+    Stored tokens come first (write order), then loose *.json files not in the store.
+    """
+    if store is None:
+        store = store_for(tokens_dir)
+    names = [f"{key}.json" for key in store.keys()]
+    stored = set(names)
+    if os.path.isdir(tokens_dir):
+        names.extend(f for f in sorted(os.listdir(tokens_dir))
+                     if f.endswith(".json") and f not in stored)
+    return names
+
+
+def export_token(out_dir, key, token, indent=4):
+    """Write one token as <out_dir>/<key>.json (atomically); returns the path."""
+    path = os.path.join(out_dir, f"{key}.json")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(token, f, indent=indent)
+    os.replace(tmp_path, path)
+    return path
+
+
+def iter_tokens(tokens_dir, store=None):
+    """
+    Yield (filename, token) for every token in a directory and its store.
+
+    Stored tokens are read sequentially from the store; loose *.json files
+    written by tools that bypass the store are parsed individually. A loose
+    file that cannot be parsed is yielded with token None.
+    """
+    if store is None:
+        store = store_for(tokens_dir)
+    stored = set()
+    for key, token in store.scan():
+        stored.add(f"{key}.json")
+        yield f"{key}.json", token
+
+    if not os.path.isdir(tokens_dir):
+        return
+    for fname in os.listdir(tokens_dir):
+        if not fname.endswith(".json") or fname in stored:
+            continue
+        try:
+            with open(os.path.join(tokens_dir, fname), "r", encoding="utf-8") as f:
+                yield fname, json.load(f)
+        except (OSError, ValueError):
+            yield fname, None
+
+
+# ------------------------------ CLI ------------------------------
+def main(argv=None):
+    """python token_store.py {import|export|compact|stats} TOKENS_DIR"""
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2 or argv[0] not in ("import", "export", "compact", "stats"):
+        print(f"Usage: {os.path.basename(__file__)} {{import|export|compact|stats}} TOKENS_DIR")
+        return 1
+
+    cmd, tokens_dir = argv
+    store = store_for(tokens_dir)
+    if cmd == "import":
+        print(f"[∞] Imported {store.import_dir(tokens_dir)} tokens into {store.root}")
+    elif cmd == "export":
+        print(f"[∞] Exported {store.export_json(tokens_dir)} tokens to {tokens_dir}")
+    elif cmd == "compact":
+        store.compact()
+        print(f"[∞] Compacted {store.root} ({len(store)} tokens)")
+    else:
+        print(f"[∞] {len(store)} tokens in {store.root}")
+    store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
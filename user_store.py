@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+User Store - In-memory users/sessions with write-behind persistence
+Part of the Pewpi Login / Infinity Research Portal
+
+Keeps users.json loaded as dicts keyed by username and session token, so
+auth checks are a dict lookup instead of a JSON parse. Mutations are applied
+in memory and appended to users.json.log (one JSON op per line, fsynced);
+the full snapshot is rewritten atomically every few seconds or after enough
+ops, after which the log is truncated.
+
+Ops are idempotent when replayed in order, so a crash between writing a
+snapshot and truncating the log is harmless. If users.json is rewritten by
+another program (e.g. the pewpi_login CLI) it is reloaded and the log
+replayed on top, so neither side's changes are lost.
+
+By default only one process should write through a given store. With
+shared=True several processes (the workers of one server) can: writers
+serialise on users.json.lock and catch up with the log before appending,
+and readers apply other processes' new log records before answering, so a
+session created by one worker is valid on all of them straight away.
+"""
+
+import os
+import json
+import copy
+import atexit
+import threading
+import contextlib
+
+from pending_queue import FileLock
+
+# ------------------------------ CONFIG ------------------------------
+Z_ROOT = os.path.abspath(os.path.dirname(__file__))
+USERS_FILE = os.path.join(Z_ROOT, "users.json")
+
+# Snapshot at most this many seconds after the first unsaved change...
+SNAPSHOT_INTERVAL = 5.0
+# ...or straight away once this many ops are waiting in the log
+SNAPSHOT_OPS = 1000
+
+
+class UserStore:
+    """Process-level repository for users.json."""
+
+    def __init__(self, path=USERS_FILE, snapshot_interval=SNAPSHOT_INTERVAL,
+                 snapshot_ops=SNAPSHOT_OPS, fsync=True, shared=False):
+        """
+        Args:
+            path: users.json path; the op log lives at <path>.log
+            snapshot_interval: Seconds between background snapshots (0 disables the thread)
+            snapshot_ops: Unsaved ops that trigger an immediate snapshot
+            fsync: fsync the op log and snapshots
+            shared: Other processes write through stores of the same path
+        """
+        self.path = path
+        self.log_path = path + ".log"
+        self.lock_path = path + ".lock"
+        self.shared = shared
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_ops = snapshot_ops
+        self.fsync = fsync
+
+        self._lock = threading.RLock()
+        self._data = None
+        self._sig = None
+        self._unsaved = 0
+        self._log_pos = None  # (inode, offset) of the op log applied so far
+        self._file_lock = None
+        self._stop = threading.Event()
+        self._flusher = None
+        atexit.register(self.close)
+
+    # ------------------------------ READS ------------------------------
+    # Returned records are the live objects: treat them as read-only.
+    def get_session(self, session_token):
+        """Return the session record for a token, or None."""
+        with self._lock:
+            return self._view()["sessions"].get(session_token)
+
+    def get_user(self, username):
+        """Return a user record, or None."""
+        with self._lock:
+            return self._view()["users"].get(username)
+
+    def has_user(self, username):
+        with self._lock:
+            return username in self._view()["users"]
+
+    def export(self):
+        """Return a deep copy of the whole users.json document."""
+        with self._lock:
+            return copy.deepcopy(self._view())
+
+    # ------------------------------ WRITES ------------------------------
+    def put_user(self, username, record):
+        """Create or replace a user record."""
+        self._commit({"op": "put", "kind": "users", "key": username, "value": record})
+
+    def patch_user(self, username, **fields):
+        """Update fields of an existing user; returns False if there is no such user."""
+        with self._writing() as data:
+            if username not in data["users"]:
+                return False
+            self._commit({"op": "patch", "kind": "users", "key": username, "fields": fields})
+            return True
+
+    def add_user_tokens(self, username, entries):
+        """
+        Append entries to a user's tokens_created and bump token_count.
+
+        Returns:
+            The user's new token count, or 0 if the user does not exist
+        """
+        with self._writing() as data:
+            user = data["users"].get(username)
+            if not user:
+                return 0
+            entries = list(entries)
+            self._commit({
+                "op": "tokens", "key": username, "entries": entries,
+                "at": len(user.get("tokens_created", [])),
+                "count": user.get("token_count", 0) + len(entries),
+            })
+            return user["token_count"]
+
+    def put_session(self, session_token, record):
+        """Create or replace a session."""
+        self._commit({"op": "put", "kind": "sessions", "key": session_token, "value": record})
+
+    def delete_session(self, session_token):
+        """Remove a session; returns False if it did not exist."""
+        with self._writing() as data:
+            if session_token not in data["sessions"]:
+                return False
+            self._commit({"op": "del", "kind": "sessions", "key": session_token})
+            return True
+
+    def replace_all(self, data):
+        """Replace the whole document and snapshot it immediately."""
+        with self._writing():
+            self._data = self._normalise(copy.deepcopy(data))
+            self._write_snapshot()
+
+    # ------------------------------ PERSISTENCE ------------------------------
+    def snapshot(self):
+        """Write unsaved changes to users.json now and truncate the op log."""
+        with self._lock:
+            if self._data is None or not self._unsaved:
+                return
+            with self._writing():  # folds in an external rewrite before overwriting it
+                self._write_snapshot()
+
+    def _write_snapshot(self):
+        """Atomically replace users.json with the in-memory document; caller holds the lock."""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._data, f, indent=4)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._sig = self._stat()
+
+        # Ops up to here are in the snapshot; replaying them again would be harmless
+        with open(self.log_path, "w") as f:
+            self._log_pos = (os.fstat(f.fileno()).st_ino, 0)
+        self._unsaved = 0
+
+    def close(self):
+        """Stop the background flusher and write any unsaved changes."""
+        self._stop.set()
+        try:
+            self.snapshot()
+        except OSError:
+            pass
+
+    # ------------------------------ INTERNALS ------------------------------
+    def _view(self):
+        """Current document, (re)loaded if users.json changed on disk; caller holds the lock."""
+        sig = self._stat()
+        if self._data is None or sig != self._sig:
+            self._load(sig)
+        elif self.shared:
+            self._follow_log()
+        return self._data
+
+    @contextlib.contextmanager
+    def _writing(self):
+        """Lock for a read-modify-write, across processes when shared; yields the current document."""
+        with self._lock:
+            if not self.shared or self._file_lock is not None:
+                yield self._view()
+                return
+            with FileLock(self.lock_path) as lock:
+                self._file_lock = lock
+                try:
+                    yield self._view()
+                finally:
+                    self._file_lock = None
+
+    def _follow_log(self):
+        """Apply records other processes appended to the op log since we last looked."""
+        try:
+            st = os.stat(self.log_path)
+        except FileNotFoundError:
+            return
+        inode, offset = self._log_pos or (None, 0)
+        if st.st_ino != inode or st.st_size < offset:
+            # Truncated by another process's snapshot: start again from users.json
+            self._load(self._stat())
+        elif st.st_size > offset:
+            applied = self._read_log(self._data, offset)
+            if applied:
+                self._unsaved += applied
+                self._start_flusher()
+
+    def _read_log(self, data, offset=0):
+        """Apply the complete op records from ``offset`` on; returns how many."""
+        try:
+            f = open(self.log_path, "rb")
+        except FileNotFoundError:
+            self._log_pos = None
+            return 0
+        applied = 0
+        with f:
+            inode = os.fstat(f.fileno()).st_ino
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # torn last record, or one still being written
+                offset += len(line)
+                try:
+                    op = json.loads(line)
+                except ValueError:
+                    continue
+                self._apply(data, op)
+                applied += 1
+        self._log_pos = (inode, offset)
+        return applied
+
+    def _load(self, sig):
+        data = None
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as f:
+                    data = json.load(f)
+            except ValueError:
+                # Mid-write by a non-atomic writer: keep what we have, retry next call
+                if self._data is not None:
+                    return
+        data = self._normalise(data)
+
+        replayed = self._read_log(data)
+
+        self._data = data
+        self._sig = sig
+        self._unsaved = max(self._unsaved, replayed)
+        if replayed:
+            self._start_flusher()
+
+    def _commit(self, op):
+        with self._writing() as data:
+            with open(self.log_path, "ab") as f:
+                f.write((json.dumps(op, separators=(",", ":")) + "\n").encode("utf-8"))
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+                self._log_pos = (os.fstat(f.fileno()).st_ino, f.tell())
+            self._apply(data, op)
+            self._unsaved += 1
+
+            if self._unsaved >= self.snapshot_ops:
+                self.snapshot()
+            else:
+                self._start_flusher()
+
+    @staticmethod
+    def _apply(data, op):
+        kind = data.setdefault(op.get("kind", "users"), {})
+        key = op.get("key")
+        if op["op"] == "put":
+            kind[key] = op["value"]
+        elif op["op"] == "del":
+            kind.pop(key, None)
+        elif op["op"] == "patch":
+            if key in kind:
+                kind[key].update(op["fields"])
+        elif op["op"] == "tokens":
+            user = kind.get(key)
+            if user is not None:
+                created = user.setdefault("tokens_created", [])
+                del created[op["at"]:]
+                created.extend(op["entries"])
+                user["token_count"] = op["count"]
+
+    @staticmethod
+    def _normalise(data):
+        if not isinstance(data, dict):
+            data = {}
+        data.setdefault("users", {})
+        data.setdefault("sessions", {})
+        return data
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _start_flusher(self):
+        if self._flusher is not None or self.snapshot_interval <= 0:
+            return
+        self._flusher = threading.Thread(target=self._flush_loop, name="user-store-flush", daemon=True)
+        self._flusher.start()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.snapshot_interval):
+            try:
+                self.snapshot()
+            except OSError:
+                pass  # retried on the next tick; the op log still has everything